@@ -1,377 +1,1212 @@
+import time
+# start of the container init, for STARTUP_PROFILE
+INIT_START = time.perf_counter()
 import json
-import boto3
 import datetime
-import time
 import logging
-import math
 import os
-import xmltodict
-import threefive
-from threefive import Cue
-import copy
 import binascii
+import bisect
+import collections
+import importlib
+import types
+import xml.parsers.expat
+import pois_config
+import pois_storage
+import pois_scte35
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+# Cold start profile. With STARTUP_PROFILE true the container logs one record at the end of its init with the time
+# spent in the imports, in creating the storage client and in the whole init, then one record for each module
+# imported on demand, when the first request that needs it loads it. For the import time of every module, set
+# PYTHONPROFILEIMPORTTIME=1 as well, python then logs it to stderr
+STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE','false').lower() == "true"
+startup_profile = collections.OrderedDict()
+startup_profile['imports'] = time.perf_counter() - INIT_START
+
+
+def startup_profile_emit(record_type,durations):
+    if not STARTUP_PROFILE:
+        return
+    record = {"startup":record_type}
+    for name,duration in durations.items():
+        record[name] = round(duration * 1000,4)
+    print(json.dumps(record),flush=True)
+
+
+class LazyModule(types.ModuleType):
+    # Stands in for a module that only some requests need, the module is imported when one of its attributes is
+    # first read. Its attributes are then copied here so later reads don't go through __getattr__
+    def __getattr__(self,attribute):
+        if attribute.startswith("__"):
+            raise AttributeError(attribute)
+        start = time.perf_counter()
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        startup_profile_emit("lazy_import",{self.__name__:time.perf_counter() - start})
+        return getattr(module,attribute)
+
+
+# threefive is only needed to decode cues the header reader doesn't handle (see scte35_header_index), xmltodict
+# only for SignalProcessingEvents the expat parser doesn't recognise (see parse_signal_processing_event)
+threefive = LazyModule("threefive")
+xmltodict = LazyModule("xmltodict")
+
+# Storage backend (DynamoDB unless POIS_STORAGE says otherwise), created once per container and reused by every invocation.
+# ESAM responses are time critical, so DynamoDB calls time out quicker than in the control API.
+# The client is created during the init, which Lambda runs with full CPU, as every request needs it
+storage_start = time.perf_counter()
+STORAGE = pois_storage.storage_from_environment(connect_timeout=1,read_timeout=2)
+startup_profile['storage'] = time.perf_counter() - storage_start
+
+# channels database
+CHANNELDB = os.environ['CHANNELDB']
+SCHEDULEDB = os.environ['SCHEDULEDB']
+STATEDB = os.environ['STATEDB']
+
+# Properties supported for SCTE35 binary replace
+threefive_scte_format = dict()
+threefive_scte_format['info_section'] = {
+    'table_id':'int',
+    'section_syntax_indicator':'bool',
+    'private':'bool',
+    'sap_type':'int',
+    'sap_details':'',
+    'protocol_version':'int',
+    'pts_adjustment':'float',
+    'splice_command_type':'int'
+}
+threefive_scte_format['command'] = {
+    'command_type':'int',
+    'time_specified_flag':'bool',
+    'pts_time':'float',
+    'break_auto_return':'bool',
+    'break_duration':'float',
+    'splice_event_id':'int',
+    'splice_event_cancel_indicator':'',
+    'out_of_network_indicator':'bool',
+    'program_splice_flag':'bool',
+    'duration_flag':'bool',
+    'splice_immediate_flag':'bool',
+    'unique_program_id':'int',
+    'avail_num':'int',
+    'avail_expected':'int'
+}
+threefive_scte_format['descriptors'] = {
+    'tag':'int',
+    'name':'str',
+    'segmentation_message':'str',
+    'segmentation_upid_type_name':'str',
+    'splice_immediate_flag':'bool',
+    'segmentation_upid_length':'int',
+    'sub_segment_num':'int',
+    'sub_segments_expected':'int',
+    'descriptor_length':'int',
+    'identifier':'str',
+    'segmentation_event_id':'str',
+    'segmentation_duration':'int',
+    'segmentation_duration_raw':'int',
+    'segmentation_event_cancel_indicator':'bool',
+    'program_segmentation_flag':'bool',
+    'segmentation_duration_flag':'bool',
+    'delivery_not_restricted_flag':'bool',
+    'web_delivery_allowed_flag':'bool',
+    'no_regional_blackout_flag':'bool',
+    'archive_allowed_flag':'bool',
+    'device_restrictions':'str',
+    'segmentation_upid_type':'int',
+    'segmentation_upid':'str',
+    'segmentation_type_id':'int',
+    'segment_num':'int',
+    'segments_expected':'int',
+    'provider_avail_id':'int'
+}
+
+
+# Lookups derived from threefive_scte_format, property -> section header and property -> type.
+# When a property is listed in more than one section, the last section wins
+scte_property_section = dict()
+scte_property_type = dict()
+for property_header in threefive_scte_format:
+    for property_key in threefive_scte_format[property_header]:
+        scte_property_section[property_key] = property_header
+        scte_property_type[property_key] = threefive_scte_format[property_header][property_key]
+SCTE_PROPERTY_SECTION = types.MappingProxyType(scte_property_section)
+SCTE_PROPERTY_TYPE = types.MappingProxyType(scte_property_type)
+
+
+def value_type_validator(rk,rv):
+
+    vartype = SCTE_PROPERTY_TYPE.get(rk,"")
+
+    if vartype == "int":
+        return int(rv)
+    elif vartype == "float":
+        return float(rv)
+    elif vartype == "bool":
+        if str(rv).lower() == "true":
+            return True
+        else:
+            return False
+    else:
+        return str(rv)
+
+
+class CompiledRule(object):
+    # A channel rule with its condition values cast to the type of the SCTE35 property at load time,
+    # so evaluating a signal only runs comparisons
+    __slots__ = ('index','type','property','operator','values','bound','ranges','replace_params')
+
+    def __init__(self,index,rule):
+        # rule is a normalized rule (see pois_config.py), its condition values are already split and its
+        # ranges parsed
+        self.index = index
+        self.type = rule['type']
+        self.property = rule['property']
+        self.operator = rule['operator']
+        self.values = frozenset()
+        self.bound = None
+        self.ranges = ()
+        self.replace_params = []
 
-def lambda_handler(event, context):
-    LOGGER.info(event)
-
-    # Properties supported for SCTE35 binary replace
-    threefive_scte_format = dict()
-    threefive_scte_format['info_section'] = {
-        'table_id':'int',
-        'section_syntax_indicator':'bool',
-        'private':'bool',
-        'sap_type':'int',
-        'sap_details':'',
-        'protocol_version':'int',
-        'pts_adjustment':'float',
-        'splice_command_type':'int'
-    }
-    threefive_scte_format['command'] = {
-        'command_type':'int',
-        'time_specified_flag':'bool',
-        'pts_time':'float',
-        'break_auto_return':'bool',
-        'break_duration':'float',
-        'splice_event_id':'int',
-        'splice_event_cancel_indicator':'',
-        'out_of_network_indicator':'bool',
-        'program_splice_flag':'bool',
-        'duration_flag':'bool',
-        'splice_immediate_flag':'bool',
-        'unique_program_id':'int',
-        'avail_num':'int',
-        'avail_expected':'int'
-    }
-    threefive_scte_format['descriptors'] = {
-        'tag':'int',
-        'name':'str',
-        'segmentation_message':'str',
-        'segmentation_upid_type_name':'str',
-        'splice_immediate_flag':'bool',
-        'segmentation_upid_length':'int',
-        'sub_segment_num':'int',
-        'sub_segments_expected':'int',
-        'descriptor_length':'int',
-        'identifier':'str',
-        'segmentation_event_id':'str',
-        'segmentation_duration':'int',
-        'segmentation_duration_raw':'int',
-        'segmentation_event_cancel_indicator':'bool',
-        'program_segmentation_flag':'bool',
-        'segmentation_duration_flag':'bool',
-        'delivery_not_restricted_flag':'bool',
-        'web_delivery_allowed_flag':'bool',
-        'no_regional_blackout_flag':'bool',
-        'archive_allowed_flag':'bool',
-        'device_restrictions':'str',
-        'segmentation_upid_type':'int',
-        'segmentation_upid':'str',
-        'segmentation_type_id':'int',
-        'segment_num':'int',
-        'segments_expected':'int',
-        'provider_avail_id':'int'
-    }
-
-    # initialize BOTO3 Client for Dynamodb
-    db_client = boto3.client('dynamodb')
-
-    # channels database
-    channeldb = os.environ['CHANNELDB']
-    scheduledb = os.environ['SCHEDULEDB']
-    statedb = os.environ['STATEDB']
-
-    # Extract SPE from Transcoder
-    esam_payload_xml = event['body']
-
-    # Convert to JSON
-    esam_payload_json = xmltodict.parse(esam_payload_xml)
-
-    # Extract SPE
-    spe = esam_payload_json['SignalProcessingEvent']
-
-    # xml namespace attributes only
-    response_main_elements_attributes = dict()
-    keys_in_spe = list(spe.keys())
-    for key in keys_in_spe:
-        if "@" in key:
-            response_main_elements_attributes[key] = spe[key]
-
-
-    # Extract acquired signal parameters
-    acq_signal = spe['AcquiredSignal']
-
-    acquisition_point_id = acq_signal['@acquisitionPointIdentity']
-    acquisition_signal_id = acq_signal['@acquisitionSignalID']
-    acquisition_time = acq_signal['@acquisitionTime']
-    zone_identity = acq_signal['@zoneIdentity']
+        try:
+            if "error" in rule:
+                raise ValueError(rule['error'])
 
-    sig_utc_point = acq_signal['sig:UTCPoint']['@utcPoint']
-    sig_binary_data_type = acq_signal['sig:BinaryData']['@signalType']
-    sig_binary_data = acq_signal['sig:BinaryData']['#text']
+            if self.operator == "-":
+                self.ranges = tuple((rule_value_min,rule_value_max) for rule_value_min,rule_value_max in rule['ranges'])
+            else:
+                typed_values = [rule_value_cast(self.property,rule_condition_value) for rule_condition_value in rule['values']]
+                self.values = frozenset(typed_values)
+                if self.operator == ">":
+                    self.bound = min(typed_values)
+                elif self.operator == "<":
+                    self.bound = max(typed_values)
+        except Exception as e:
+            LOGGER.warning("Unable to compile rule %s condition, rule will never match: %s" % (str(index),e))
+            self.operator = None
+
+        # list of (property, section header, typed value), header is None if the param can't be applied
+        for r_key,r_param_value in rule['replace_params']:
+            r_header = SCTE_PROPERTY_SECTION.get(r_key)
+            try:
+                r_value = value_type_validator(r_key,r_param_value)
+            except Exception as e:
+                LOGGER.warning("Unable to compile rule %s replace param %s: %s" % (str(index),r_key,e))
+                r_header = None
+                r_value = None
+            self.replace_params.append((r_key,r_header,r_value))
+
+    def evaluate(self,scte35_property_values):
+        # scte35_property_values holds every occurrence of the property in the cue (see scte_property_index).
+        # The rule is True if any occurrence satisfies the condition, except != which is True only if
+        # none of the occurrences equals one of the rule values
+        if self.operator == "!=":
+            for scte35_property_value in scte35_property_values:
+                if self.test("=",scte35_property_value):
+                    return False
+            return True
+
+        for scte35_property_value in scte35_property_values:
+            if self.test(self.operator,scte35_property_value):
+                return True
+        return False
 
-    LOGGER.info("SCTE35 Received in SPE: %s " % (sig_binary_data))
+    def test(self,operator,scte35_property_value):
+        if scte35_property_value == "":
+            scte35_property_value = 0
 
-    sig_stream_times = acq_signal['sig:StreamTimes']
+        try:
+            if operator == "=":
+                return scte35_property_value in self.values
+            elif operator == ">":
+                return scte35_property_value > self.bound
+            elif operator == "<":
+                return scte35_property_value < self.bound
+            elif operator == "-":
+                for rule_value_min,rule_value_max in self.ranges:
+                    if scte35_property_value > rule_value_min and scte35_property_value < rule_value_max:
+                        return True
+        except TypeError:
+            # unhashable (ie. structured upid) or not comparable with the rule value
+            pass
+
+        return False
+
+
+def rule_value_cast(rk,rv):
+    rule_condition_value = value_type_validator(rk,rv)
+    if rule_condition_value == "false":
+        rule_condition_value = False
+    elif rule_condition_value == "true":
+        rule_condition_value = True
+    return rule_condition_value
+
+
+def compile_rules(normalized_rules):
+    compiled_rules = []
+    for r in range(0,len(normalized_rules)):
+        compiled_rules.append(CompiledRule(r,normalized_rules[r]))
+    return compiled_rules
+
+
+def compile_descriptor_priority(channel_config):
+    # segmentation_type_ids of the comma separated descriptor_priority, in priority order. Values that aren't
+    # numbers are left out, an empty list means the channel has no descriptor priority
+    descriptor_priority = []
+    for value in str(channel_config.get('descriptor_priority','')).split(","):
+        value = value.strip()
+        if len(value) == 0:
+            continue
+        try:
+            descriptor_priority.append(int(value))
+        except ValueError:
+            LOGGER.warning("Ignoring descriptor_priority value %r, it isn't a segmentation_type_id" % (value))
+    return descriptor_priority
+
+
+# Value used for properties that are not present in the cue
+SCTE_PROPERTY_MISSING = (0,)
+
+
+class RuleIndex(object):
+    # Index of the compiled rules of a channel, built once per config version. match() returns the first rule, in
+    # rule order, that CompiledRule.evaluate would find True, looking up each property of the rules once instead of
+    # evaluating every rule:
+    #   =   dict of rule value -> first rule with that value
+    #   !=  dict of rule value -> rules with that value, the first != rule none of the cue values rule out matches
+    #   >   bounds sorted ascending with the first rule among all the lower bounds, found with bisect
+    #   <   bounds sorted ascending with the first rule among all the higher bounds
+    #   -   the range end points split the number line into points and open intervals, each holding its first rule
+    # Rules the index can't hold (values that can't be sorted together, unhashable values) are evaluated one by one
+    __slots__ = ('properties','linear_rules')
+
+    def __init__(self,channel_rules):
+        # property -> {"=":dict, "!=":(dict,rules), ">":(bounds,first), "<":(bounds,first), "-":(points,first)}
+        self.properties = dict()
+        self.linear_rules = []
+
+        grouped = collections.OrderedDict()
+        for rule in channel_rules:
+            if rule.operator in ("=","!=",">","<","-"):
+                grouped.setdefault((rule.property,rule.operator),[]).append(rule)
+
+        for (property_key,operator),rules in grouped.items():
+            try:
+                structure = self.build(operator,rules)
+            except TypeError:
+                self.linear_rules.extend(rules)
+                continue
+            self.properties.setdefault(property_key,dict())[operator] = structure
+        self.linear_rules.sort(key=lambda rule: rule.index)
+
+    def build(self,operator,rules):
+        if operator == "=":
+            first = dict()
+            for rule in rules:
+                for value in rule.values:
+                    if value not in first:
+                        first[value] = rule.index
+            return first
+
+        if operator == "!=":
+            excluded_by = dict()
+            for rule in rules:
+                for value in rule.values:
+                    excluded_by.setdefault(value,set()).add(rule.index)
+            return excluded_by,[rule.index for rule in rules]
+
+        if operator == ">" or operator == "<":
+            ordered = sorted(rules,key=lambda rule: rule.bound)
+            bounds = [rule.bound for rule in ordered]
+            first = []
+            if operator == ">":
+                # first[i] is the first rule among bounds[0..i], all matched by a value above bounds[i]
+                for rule in ordered:
+                    first.append(rule.index if len(first) == 0 else min(first[-1],rule.index))
+            else:
+                # first[i] is the first rule among bounds[i..], all matched by a value below bounds[i]
+                for rule in reversed(ordered):
+                    first.append(rule.index if len(first) == 0 else min(first[-1],rule.index))
+                first.reverse()
+            return bounds,first
+
+        # "-", region 2*i is the open interval below points[i], region 2*i+1 is points[i] itself
+        points = sorted(set([rule_value for rule in rules for rule_range in rule.ranges for rule_value in rule_range]))
+        first = [None] * (2 * len(points) + 1)
+        for rule in rules:
+            for rule_value_min,rule_value_max in rule.ranges:
+                # the range is open, it covers the regions strictly between its two end points
+                for region in range(2 * bisect.bisect_left(points,rule_value_min) + 2,2 * bisect.bisect_left(points,rule_value_max) + 1):
+                    if first[region] is None or rule.index < first[region]:
+                        first[region] = rule.index
+        return points,first
+
+    def lookup(self,operator,structure,scte35_property_values):
+        # first rule of the structure matched by any of the values, or None
+        matched = None
+        if operator == "!=":
+            excluded_by,rule_indexes = structure
+            excluded = set()
+            for scte35_property_value in scte35_property_values:
+                try:
+                    excluded.update(excluded_by.get(0 if scte35_property_value == "" else scte35_property_value,()))
+                except TypeError:
+                    pass
+            for rule_index in rule_indexes:
+                if rule_index not in excluded:
+                    return rule_index
+            return None
+
+        for scte35_property_value in scte35_property_values:
+            if scte35_property_value == "":
+                scte35_property_value = 0
+            try:
+                if operator == "=":
+                    found = structure.get(scte35_property_value)
+                elif operator == ">":
+                    bounds,first = structure
+                    position = bisect.bisect_left(bounds,scte35_property_value)
+                    found = first[position - 1] if position > 0 else None
+                elif operator == "<":
+                    bounds,first = structure
+                    position = bisect.bisect_right(bounds,scte35_property_value)
+                    found = first[position] if position < len(bounds) else None
+                else:
+                    points,first = structure
+                    position = bisect.bisect_left(points,scte35_property_value)
+                    if position < len(points) and points[position] == scte35_property_value:
+                        found = first[2 * position + 1]
+                    else:
+                        found = first[2 * position]
+            except TypeError:
+                # unhashable (ie. structured upid) or not comparable with the rule values
+                found = None
+            if found is not None and (matched is None or found < matched):
+                matched = found
+        return matched
+
+    def match(self,scte_35_index):
+        # Returns the index of the first matching rule, or None
+        matched = None
+        for property_key,structures in self.properties.items():
+            scte35_property_values = scte_35_index.get(property_key,SCTE_PROPERTY_MISSING)
+            for operator,structure in structures.items():
+                found = self.lookup(operator,structure,scte35_property_values)
+                if found is not None and (matched is None or found < matched):
+                    matched = found
+
+        for rule in self.linear_rules:
+            if matched is not None and rule.index > matched:
+                break
+            if rule.evaluate(scte_35_index.get(rule.property,SCTE_PROPERTY_MISSING)):
+                matched = rule.index
+                break
+        return matched
+
+
+def scte_property_index(scte_35_dict):
+    # Flattens the decoded cue once per signal into property -> tuple of values, covering the
+    # info_section, the command and every descriptor, in that order. A property found in several
+    # places (ie. segmentation_type_id on a cue with multiple descriptors) keeps all of its values
+    property_index = dict()
+    for main_key in scte_35_dict:
+        sections = scte_35_dict[main_key]
+        if isinstance(sections,dict):
+            sections = [sections]
+        elif not isinstance(sections,list):
+            continue
+
+        for section in sections:
+            for property_key,property_value in section.items():
+                if property_key in property_index:
+                    property_index[property_key] += (property_value,)
+                else:
+                    property_index[property_key] = (property_value,)
+    return property_index
+
+
+# Decoded cue cache, kept warm across invocations of the same container. Redundant encoders and retries send
+# the same BinaryData many times, the cue is decoded and indexed once and shared by every request sending it
+SCTE35_CACHE_SIZE = int(os.environ.get('SCTE35_CACHE_SIZE','1024'))
+scte35_cache = collections.OrderedDict()
+scte35_cache_stats = {"hits":0,"misses":0}
+
+
+def scte35_freeze(value):
+    # read-only copy of a decoded cue, so a request can't modify the cached entry shared with later requests
+    if isinstance(value,dict):
+        return types.MappingProxyType({k:scte35_freeze(v) for k,v in value.items()})
+    if isinstance(value,list):
+        return tuple(scte35_freeze(v) for v in value)
+    return value
+
+
+def scte35_thaw(value):
+    # modifiable copy of a frozen cue, for the replace and descriptor_priority paths
+    if isinstance(value,types.MappingProxyType):
+        return {k:scte35_thaw(v) for k,v in value.items()}
+    if isinstance(value,tuple):
+        return [scte35_thaw(v) for v in value]
+    return value
+
+
+def scte35_decode(sig_binary_data,stage_timer):
+    # Returns the frozen decoded cue and its scte_property_index, raises if the cue can't be decoded
+    cached = scte35_cache.get(sig_binary_data)
+    if cached is not None:
+        scte35_cache.move_to_end(sig_binary_data)
+        scte35_cache_stats['hits'] += 1
+        stage_timer.count("scte35_cache_hits")
+        return cached
+
+    scte35_cache_stats['misses'] += 1
+    stage_timer.count("scte35_cache_misses")
+    scte_35_cue = threefive.Cue(sig_binary_data)
+    scte_35_cue.decode()
+    scte_35_dict = scte_35_cue.get()
+    decoded = (scte35_freeze(scte_35_dict),scte_property_index(scte_35_dict))
+
+    if SCTE35_CACHE_SIZE > 0:
+        scte35_cache[sig_binary_data] = decoded
+        while len(scte35_cache) > SCTE35_CACHE_SIZE:
+            scte35_cache.popitem(last=False)
+    return decoded
+
+
+# splice_info_section fields up to splice_command_type, at fixed bit offsets in the first 14 bytes of the cue.
+# Channels whose rules only test these are evaluated without decoding the command and descriptors
+SCTE35_HEADER_LENGTH = 14
+SCTE35_HEADER_PROPERTIES = frozenset([
+    'table_id','section_syntax_indicator','private','sap_type','sap_details','section_length','protocol_version',
+    'encrypted_packet','encryption_algorithm','pts_adjustment_ticks','pts_adjustment','cw_index','tier',
+    'splice_command_length','splice_command_type'
+])
+SCTE35_SAP_DETAILS = ("Type 1 Closed GOP with no leading pictures","Type 2 Closed GOP with leading pictures","Type 3 Open GOP","No Sap Type")
+
+
+def scte35_header_only(descriptor_priority,channel_rules):
+    # True if the rules can be evaluated on the header alone. descriptor_priority needs the descriptors,
+    # a matched replace rule still decodes the whole cue to re-encode it
+    if len(channel_rules) == 0 or len(descriptor_priority) > 0:
+        return False
+    for rule in channel_rules:
+        if rule.property not in SCTE35_HEADER_PROPERTIES:
+            return False
+    return True
+
+
+def scte35_hex(value):
+    # same formatting as threefive, an even number of hex digits
+    hexed = hex(value)
+    if len(hexed) % 2 != 0:
+        hexed = hexed.replace("0x","0x0",1)
+    return hexed
+
+
+def scte35_header_index(sig_binary_data):
+    # scte_property_index of the splice_info_section header, read straight from the base64 decoded cue.
+    # Returns None if the cue isn't something this reader handles, the caller then does the full decode
+    try:
+        # threefive reads anything that parses as hex as a hex string
+        int(sig_binary_data,16)
+        return None
+    except ValueError:
+        pass
 
-    ##
-    ## Done Parsing
-    ##
+    try:
+        cue_bytes = memoryview(binascii.a2b_base64(sig_binary_data + "=" * (-len(sig_binary_data) % 4)))
+    except binascii.Error:
+        return None
+    header = cue_bytes[:SCTE35_HEADER_LENGTH]
+    if len(header) < SCTE35_HEADER_LENGTH or header[0] != 0xfc:
+        return None
+
+    section_flags = int.from_bytes(header[1:3],"big")
+    if len(cue_bytes) < (section_flags & 0xfff) + 3:
+        # truncated cue, let the full decode reject it
+        return None
+    pts_flags = int.from_bytes(header[4:9],"big")
+    tier_command_length = int.from_bytes(header[10:13],"big")
+    pts_adjustment_ticks = pts_flags & 0x1ffffffff
+    sap_type = (section_flags >> 12) & 0x3
 
+    return {
+        'table_id':(scte35_hex(header[0]),),
+        'section_syntax_indicator':(section_flags >> 15 == 1,),
+        'private':((section_flags >> 14) & 0x1 == 1,),
+        'sap_type':(scte35_hex(sap_type),),
+        'sap_details':(SCTE35_SAP_DETAILS[sap_type],),
+        'section_length':(section_flags & 0xfff,),
+        'protocol_version':(header[3],),
+        'encrypted_packet':(pts_flags >> 39 == 1,),
+        'encryption_algorithm':((pts_flags >> 33) & 0x3f,),
+        'pts_adjustment_ticks':(pts_adjustment_ticks,),
+        'pts_adjustment':(round(pts_adjustment_ticks / 90000.0,6),),
+        'cw_index':(scte35_hex(header[9]),),
+        'tier':(scte35_hex(tier_command_length >> 12),),
+        'splice_command_length':(tier_command_length & 0xfff,),
+        'splice_command_type':(header[13],)
+    }
 
-    # create exceptions list to catch exceptions
-    exceptions = []
-    exceptions.clear()
 
-    # DYNAMO DB JSON BUILDER
-    dynamodb_to_json = dict()
-    keylist = []
-    def dict_path(dicttopopulate,my_dict):
-        for k,v in my_dict.items():
+def scte35_duration(scte_35_dict):
+    # Duration in seconds of a decoded cue, the break_duration of a splice_insert or the segmentation_duration of
+    # the first descriptor, 30 seconds if the cue has none. Used for the replaced cue and for the stateful lock
+    scte_duration = None
+    if scte_35_dict['info_section'].get('splice_command_type') == 5:
+        scte_duration = scte_35_dict['command'].get('break_duration')
+    elif len(scte_35_dict.get('descriptors',[])) > 0:
+        scte_duration = scte_35_dict['descriptors'][0].get('segmentation_duration')
+    if scte_duration is None:
+        return 30.00
+    return scte_duration
 
-            value_type = list(my_dict[k].keys())[0]
 
-            if value_type == "M":
-                value = my_dict[k][value_type]
+def scte35_ticks(seconds):
+    # same rounding as threefive
+    return int(round(seconds * 90000))
 
-                for i in range(0,len(value)):
-                    dynamodb_item_m = dict()
-                    dict_path(dynamodb_item_m,value)
-                    v = dynamodb_item_m
 
-                value.update(dynamodb_item_m)
-                dicttopopulate.update({k:value})
+def replace_time_signal(scte_35_dict,scte_duration):
+    # Fields of the time_signal sent back on replace: the splice time and pts_adjustment of the decoded cue, and a
+    # Provider Placement Opportunity Start descriptor lasting scte_duration, with the segmentation_event_id of the
+    # first descriptor of the cue
+    info_section = scte_35_dict['info_section']
+    command = scte_35_dict['command']
 
-            elif value_type == "S":
-                value = my_dict[k][value_type]
-                dicttopopulate.update({k:value})
+    pts_time_ticks = None
+    if command.get('splice_immediate_flag') != True:
+        pts_time_ticks = command.get('pts_time_ticks')
+        if not pts_time_ticks and command.get('pts_time') is not None:
+            pts_time_ticks = scte35_ticks(command['pts_time'])
 
-            elif value_type == "L": # list
-                value = my_dict[k][value_type]
+    # a replaced pts_adjustment only changes the seconds value, which wins over the ticks
+    pts_adjustment_ticks = info_section.get('pts_adjustment_ticks') or 0
+    if info_section.get('pts_adjustment'):
+        pts_adjustment_ticks = scte35_ticks(info_section['pts_adjustment'])
 
-                for i in range(0,len(value)):
-                    dynamodb_item_list = dict()
-                    dict_path(dynamodb_item_list,value[i])
+    try:
+        segmentation_event_id = scte_35_dict['descriptors'][0]['segmentation_event_id']
+        if isinstance(segmentation_event_id,str):
+            # threefive decodes it as "0x..." hex, a replace_params value is decimal unless it has the 0x prefix
+            segmentation_event_id = int(segmentation_event_id,0)
+    except Exception as e:
+        segmentation_event_id = int(time.time()/1000)
+
+    return pois_scte35.TimeSignalFields(
+        pts_time_ticks=pts_time_ticks,
+        pts_adjustment_ticks=pts_adjustment_ticks,
+        segmentation_event_id=segmentation_event_id,
+        segmentation_duration_ticks=scte35_ticks(scte_duration),
+        segmentation_type_id=52,
+        segmentation_upid_type=9,
+        segmentation_upid=b"",
+        segment_num=0,
+        segments_expected=1
+    )
+
+
+# Channel config cache, kept warm across invocations of the same container.
+# Entries younger than CHANNEL_CACHE_TTL seconds are used as is, older entries are
+# revalidated by reading only the config_version attribute written by pois-control
+CHANNEL_CACHE_TTL = float(os.environ.get('CHANNEL_CACHE_TTL','5'))
+CHANNEL_CACHE_SIZE = int(os.environ.get('CHANNEL_CACHE_SIZE','1024'))
+channel_config_cache = collections.OrderedDict()
+
+# Per-stage timings of each request, printed to stdout as one CloudWatch Embedded Metric Format record.
+# When STAGE_METRICS isn't true the timers only check a flag
+STAGE_METRICS = os.environ.get('STAGE_METRICS','false').lower() == "true"
+STAGE_METRICS_NAMESPACE = os.environ.get('STAGE_METRICS_NAMESPACE','POIS/ESAM')
+STAGE_METRICS_DIMENSIONS = ("channel","action","rule_matched")
+
+
+class StageTimer(object):
+    __slots__ = ('enabled','start','last','stages','counts','signals')
+
+    def __init__(self,enabled):
+        self.enabled = enabled
+        if enabled:
+            self.start = time.perf_counter()
+            self.last = self.start
+            self.stages = dict()
+            self.counts = dict()
+            self.signals = []
+
+    def lap(self,stage):
+        # the time since the previous lap is added to stage
+        if self.enabled:
+            time_now = time.perf_counter()
+            self.stages[stage] = self.stages.get(stage,0.0) + time_now - self.last
+            self.last = time_now
+
+    def count(self,name):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name,0) + 1
+
+    def signal(self,channel,action,rule_matched):
+        if self.enabled:
+            self.signals.append((channel,action,"none" if rule_matched is None else str(rule_matched)))
+
+    def emit(self):
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self.start
+
+        # a SignalProcessingEvent with several signals gets "multiple" for the dimensions they don't share
+        record = dict()
+        for i in range(0,len(STAGE_METRICS_DIMENSIONS)):
+            values = set(signal[i] for signal in self.signals)
+            if len(values) == 1:
+                record[STAGE_METRICS_DIMENSIONS[i]] = values.pop()
+            else:
+                record[STAGE_METRICS_DIMENSIONS[i]] = "multiple" if len(values) > 1 else "none"
+
+        metrics = []
+        for stage,duration in self.stages.items():
+            record[stage] = round(duration * 1000,4)
+            metrics.append({"Name":stage,"Unit":"Milliseconds"})
+        record['total'] = round(total * 1000,4)
+        metrics.append({"Name":"total","Unit":"Milliseconds"})
+        for name,count in self.counts.items():
+            record[name] = count
+            metrics.append({"Name":name,"Unit":"Count"})
+        record['signals'] = len(self.signals)
+
+        record['_aws'] = {
+            "Timestamp":int(time.time() * 1000),
+            "CloudWatchMetrics":[{
+                "Namespace":STAGE_METRICS_NAMESPACE,
+                "Dimensions":[list(STAGE_METRICS_DIMENSIONS)],
+                "Metrics":metrics
+            }]
+        }
+        print(json.dumps(record),flush=True)
+
+
+# Decision cache. Transcoders retry an ESAM request when it times out, the retry gets the decision made for the
+# first request instead of running the rules again, which in stateful mode could see the lock written by that
+# first request. Decisions are kept DECISION_CACHE_TTL seconds, keyed by channel, acquisitionSignalID and
+# config_version so a config update isn't hidden by an earlier decision
+DECISION_CACHE_TTL = float(os.environ.get('DECISION_CACHE_TTL','30'))
+DECISION_CACHE_SIZE = int(os.environ.get('DECISION_CACHE_SIZE','4096'))
+decision_cache = collections.OrderedDict()
+
+
+def decision_cache_get(decision_key,sig_binary_data,time_now):
+    # Returns (resp_signal,custom_status_code,action,rule_matched), or None
+    cached = decision_cache.get(decision_key)
+    if cached is None:
+        return None
+    expiry_time,cached_binary_data,decision = cached
+    if time_now >= expiry_time or cached_binary_data != sig_binary_data:
+        # a reused acquisitionSignalID with another cue is a new signal
+        return None
+    return decision
+
+
+def decision_cache_put(decision_key,sig_binary_data,decision,time_now):
+    if DECISION_CACHE_TTL <= 0 or DECISION_CACHE_SIZE <= 0:
+        return
+    decision_cache.pop(decision_key,None)
+    decision_cache[decision_key] = (time_now + DECISION_CACHE_TTL,sig_binary_data,decision)
+
+    # entries are in expiry order, the TTL is the same for all of them
+    while len(decision_cache) > 0:
+        oldest_key = next(iter(decision_cache))
+        if len(decision_cache) <= DECISION_CACHE_SIZE and time_now < decision_cache[oldest_key][0]:
+            break
+        del decision_cache[oldest_key]
+
+
+def channel_cache_put(channel,channel_config,normalized_rules,config_version,time_now):
+    channel_entry = None
+    if channel_config is not None:
+        # rules are compiled once per config version and reused until the config changes
+        channel_rules = compile_rules(normalized_rules)
+        descriptor_priority = compile_descriptor_priority(channel_config)
+        channel_entry = {"config":channel_config,"version":config_version,"rules":channel_rules,"rule_index":RuleIndex(channel_rules),
+                         "descriptor_priority":descriptor_priority,"header_only":scte35_header_only(descriptor_priority,channel_rules)}
+    channel_config_cache[channel] = {"entry":channel_entry,"version":config_version,"checked":time_now}
+    channel_config_cache.move_to_end(channel)
+    while len(channel_config_cache) > CHANNEL_CACHE_SIZE:
+        channel_config_cache.popitem(last=False)
+
+
+def channel_cache_refresh(channel,channel_item,time_now):
+    # channel_item is the raw DynamoDB item, or None if the channel doesn't exist.
+    # The item is only unmarshalled and its rules compiled if its config_version changed
+    cached = channel_config_cache.get(channel)
+
+    if channel_item is None:
+        channel_cache_put(channel,None,None,None,time_now)
+        return None
+
+    config_version = channel_item.get('config_version',{}).get('S')
+    if cached is not None and cached['entry'] is not None and config_version == cached['version']:
+        cached['checked'] = time_now
+        channel_config_cache.move_to_end(channel)
+        return cached['entry']
+
+    # one decode of config_blob, items written before it existed are unmarshalled and their rules normalized here
+    channel_config,normalized_rules = pois_config.config_from_item(channel_item)
+    if normalized_rules is None:
+        normalized_rules = pois_config.normalize_rules(channel_config)
+    channel_cache_put(channel,channel_config,normalized_rules,config_version,time_now)
+    return channel_config_cache[channel]['entry']
+
+
+# Stateful lock cache, kept warm across invocations of the same container. The expiry time of the locks this
+# container wrote or read is used as is while the lock is active, for STATE_LOCK_REVALIDATE seconds at most, instead
+# of reading STATEDB for every signal of the break. A lock is only replaced once it expired, so another container
+# can't shorten a lock we know to be active, the revalidation picks up locks removed or changed outside of the POIS
+STATE_LOCK_REVALIDATE = float(os.environ.get('STATE_LOCK_REVALIDATE','5'))
+state_lock_cache = collections.OrderedDict()
+
+
+def state_lock_cache_get(channel,time_now,epoch_now):
+    # Returns the state item of a lock known to be active, or None if the state has to be read
+    cached = state_lock_cache.get(channel)
+    if cached is None:
+        return None
+    if time_now - cached['checked'] >= STATE_LOCK_REVALIDATE or epoch_now >= cached['expiry']:
+        del state_lock_cache[channel]
+        return None
+    return cached['item']
+
+
+def state_lock_cache_put(channel,state_item,time_now):
+    # state_item is the STATEDB item of the channel, or None if it has no state
+    state_lock_cache.pop(channel,None)
+    if STATE_LOCK_REVALIDATE <= 0 or state_item is None:
+        return
+    try:
+        expiry_time = int(state_item['expires_at']['N'])
+    except Exception as e:
+        return
+    state_lock_cache[channel] = {"item":state_item,"expiry":expiry_time,"checked":time_now}
+    while len(state_lock_cache) > CHANNEL_CACHE_SIZE:
+        state_lock_cache.popitem(last=False)
+
+
+def get_channel_records(storage,channeldb,statedb,channels):
+    # Returns ({channel: cache entry}, {channel: state item}) for the channels of a SignalProcessingEvent.
+    # Cache entries are {"config","version","rules","rule_index","descriptor_priority","header_only"}, or None if the channel is not registered with the POIS,
+    # they are shared with later invocations so callers must not modify them.
+    # Everything that isn't fresh in the container cache is read in one BatchGetItem: full items for channels
+    # not cached yet, only config_version for channels whose TTL expired and, as that call is made anyway, the state
+    # of stateful channels without an active lock in the lock cache. Channels that are missing from the state dict
+    # had their state not read
+    time_now = time.monotonic()
+    channel_records = dict()
+    state_records = dict()
+
+    uncached_channels = []
+    expired_channels = []
+    state_channels = []
+    for channel in channels:
+        cached = channel_config_cache.get(channel)
+        if cached is None:
+            uncached_channels.append(channel)
+            state_channels.append(channel)
+            continue
+
+        if time_now - cached['checked'] < CHANNEL_CACHE_TTL:
+            channel_config_cache.move_to_end(channel)
+            channel_records[channel] = cached['entry']
+        else:
+            expired_channels.append(channel)
+
+        if cached['entry'] is not None and cached['entry']['config'].get('mode') == "stateful":
+            state_channels.append(channel)
+
+    # locks known to be active aren't read again
+    epoch_now = int(datetime.datetime.utcnow().timestamp())
+    unlocked_channels = []
+    for channel in state_channels:
+        state_item = state_lock_cache_get(channel,time_now,epoch_now)
+        if state_item is None:
+            unlocked_channels.append(channel)
+        else:
+            state_records[channel] = state_item
+    state_channels = unlocked_channels
+
+    if len(uncached_channels) + len(expired_channels) == 0:
+        # the state isn't worth a round trip of its own here, the decision reads or takes the lock if it needs to
+        return channel_records,state_records
+
+    table_keys = dict()
+    projections = dict()
+    if len(uncached_channels) + len(expired_channels) > 0:
+        table_keys[channeldb] = uncached_channels + expired_channels
+        if len(uncached_channels) == 0:
+            # TTL expired only, check if the configs have been updated since we last loaded them
+            projections[channeldb] = ["config_version"]
+    if len(state_channels) > 0:
+        table_keys[statedb] = state_channels
+
+    LOGGER.debug("Doing a batch call to storage to get items : %s" % (table_keys))
+    found_items = storage.batch_get_items(table_keys,projections)
+
+    reload_channels = []
+    for channel in table_keys.get(channeldb,[]):
+        channel_item = found_items[channeldb].get(channel)
+        if channeldb in projections and channel_item is not None:
+            cached = channel_config_cache[channel]
+            config_version = channel_item.get('config_version',{}).get('S')
+            if cached['entry'] is None or config_version != cached['version']:
+                reload_channels.append(channel)
+                continue
+        channel_records[channel] = channel_cache_refresh(channel,channel_item,time_now)
+
+    if len(reload_channels) > 0:
+        reloaded_items = storage.batch_get_items({channeldb:reload_channels})
+        for channel in reload_channels:
+            channel_records[channel] = channel_cache_refresh(channel,reloaded_items[channeldb].get(channel),time_now)
+
+    for channel in state_channels:
+        state_records[channel] = found_items[statedb].get(channel)
+        state_lock_cache_put(channel,state_records[channel],time_now)
+
+    return channel_records,state_records
+
+
+def dbCheckState(storage,statedb,channel):
+    LOGGER.debug("Doing a call to storage to get signal state information for channel : %s" % (channel))
+    try:
+        item = storage.get_item(statedb,channel)
+    except Exception as e:
+        return ["Unable to get item from storage, got exception:  %s" % (str(e).upper())]
+    if item is None:
+        return {}
+    return {"Item":item}
+
+
+def dbAcquireLock(storage,statedb,channel,expiry_time,time_now):
+    # Returns (acquired, state item), raises if the state table can't be updated
+    LOGGER.debug("Doing a call to storage to acquire the signal lock for channel : %s" % (channel))
+    return storage.acquire_lock(statedb,channel,expiry_time,time_now)
+
+
+# Fast SignalProcessingEvent parser. xmltodict builds a dict for every element of the payload, the handler only
+# needs the AcquiredSignal attributes, UTCPoint, BinaryData and StreamTimes. These are built straight from the expat
+# callbacks, in the same shape xmltodict.parse gives them. Elements are matched on their namespace, so the prefixes
+# used by the encoder don't matter, and payloads of any other shape go through xmltodict instead
+ESAM_SIGNAL_NAMESPACE = "urn:cablelabs:iptvservices:esam:xsd:signal:1"
+ESAM_SIGNALING_NAMESPACE = "urn:cablelabs:md:xsd:signaling:3.0"
+
+SPE_ELEMENT = ESAM_SIGNAL_NAMESPACE + " SignalProcessingEvent"
+ACQUIRED_SIGNAL_ELEMENT = ESAM_SIGNAL_NAMESPACE + " AcquiredSignal"
+ACQUIRED_SIGNAL_CHILDREN = {
+    ESAM_SIGNALING_NAMESPACE + " UTCPoint":"sig:UTCPoint",
+    ESAM_SIGNALING_NAMESPACE + " BinaryData":"sig:BinaryData",
+    ESAM_SIGNALING_NAMESPACE + " StreamTimes":"sig:StreamTimes"
+}
+STREAM_TIME_ELEMENT = ESAM_SIGNALING_NAMESPACE + " StreamTime"
+
+
+class SpeParser(object):
+    __slots__ = ('path','acq_signals','acq_signal','child','text','stream_times','unexpected')
+
+    def __init__(self):
+        self.path = []
+        self.acq_signals = []
+        self.acq_signal = None
+        self.child = None
+        self.text = None
+        self.stream_times = None
+        self.unexpected = False
+
+    def attributes(self,attrs):
+        # xmltodict gives None for an element without attributes or text
+        if len(attrs) == 0:
+            return None
+        for k in attrs:
+            if " " in k:
+                # namespaced attribute, xmltodict would key it on its prefix
+                self.unexpected = True
+        return {"@" + k:v for k,v in attrs.items()}
+
+    def start(self,name,attrs):
+        depth = len(self.path)
+        self.path.append(name)
+
+        if depth == 0:
+            if name != SPE_ELEMENT:
+                self.unexpected = True
+        elif depth == 1:
+            if name == ACQUIRED_SIGNAL_ELEMENT:
+                self.acq_signal = self.attributes(attrs) or dict()
+        elif depth == 2:
+            if self.acq_signal is None or name not in ACQUIRED_SIGNAL_CHILDREN:
+                return
+            self.child = ACQUIRED_SIGNAL_CHILDREN[name]
+            if self.child in self.acq_signal:
+                # repeated element, xmltodict would make it a list
+                self.unexpected = True
+            self.acq_signal[self.child] = self.attributes(attrs)
+            if self.child == "sig:BinaryData":
+                self.text = []
+            elif self.child == "sig:StreamTimes":
+                if len(attrs) > 0:
+                    self.unexpected = True
+                self.stream_times = []
+        elif self.child is not None:
+            if depth == 3 and self.child == "sig:StreamTimes" and name == STREAM_TIME_ELEMENT:
+                self.stream_times.append(self.attributes(attrs))
+            else:
+                self.unexpected = True
+
+    def end(self,name):
+        self.path.pop()
+        depth = len(self.path)
+
+        if depth == 1 and name == ACQUIRED_SIGNAL_ELEMENT:
+            self.acq_signals.append(self.acq_signal)
+            self.acq_signal = None
+        elif depth == 2 and self.child is not None:
+            if self.child == "sig:BinaryData":
+                text = "".join(self.text).strip()
+                if self.acq_signal[self.child] is None:
+                    self.acq_signal[self.child] = text or None
+                elif len(text) > 0:
+                    self.acq_signal[self.child]['#text'] = text
+                self.text = None
+            elif self.child == "sig:StreamTimes":
+                if len(self.stream_times) == 1:
+                    self.acq_signal[self.child] = {"sig:StreamTime":self.stream_times[0]}
+                elif len(self.stream_times) > 1:
+                    self.acq_signal[self.child] = {"sig:StreamTime":self.stream_times}
+                self.stream_times = None
+            self.child = None
+
+    def characters(self,data):
+        if self.text is not None:
+            self.text.append(data)
+        elif self.child is not None and data.strip():
+            # text in an element that is expected to only have attributes
+            self.unexpected = True
+
+
+def parse_signal_processing_event(esam_payload_xml):
+    # Returns the list of AcquiredSignal dicts, or None if the payload isn't a SignalProcessingEvent shaped the way
+    # SpeParser expects, in which case the caller parses it with xmltodict
+    spe_parser = SpeParser()
+    parser = xml.parsers.expat.ParserCreate("utf-8"," ")
+    parser.buffer_text = True
+    parser.StartElementHandler = spe_parser.start
+    parser.EndElementHandler = spe_parser.end
+    parser.CharacterDataHandler = spe_parser.characters
+
+    if isinstance(esam_payload_xml,str):
+        esam_payload_xml = esam_payload_xml.encode("utf-8")
+    try:
+        parser.Parse(esam_payload_xml,True)
+    except xml.parsers.expat.ExpatError:
+        return None
 
-                    value[i] = dynamodb_item_list
+    if spe_parser.unexpected or len(spe_parser.acq_signals) == 0:
+        return None
+    return spe_parser.acq_signals
 
-                dicttopopulate.update({k:value})
-            elif k == "M":
 
-                dynamodb_item_m = dict()
-                dict_path(dynamodb_item_m,v)
-                v = dynamodb_item_m
-                dicttopopulate.update(v)
+# xml.sax.saxutils escape and quoteattr. Importing xml.sax.saxutils loads urllib.request, http.client and email,
+# which took a third of the handler's import time
+def xml_escape(data):
+    return data.replace("&","&amp;").replace(">","&gt;").replace("<","&lt;")
 
-    def value_type_validator(rk,rv):
 
-        vartype = ""
-        for property_header in threefive_scte_format:
-            if rk in threefive_scte_format[property_header]:
-                vartype = threefive_scte_format[property_header][rk]
+def xml_quoteattr(data):
+    data = xml_escape(data).replace("\n","&#10;").replace("\r","&#13;").replace("\t","&#9;")
+    if '"' in data:
+        if "'" in data:
+            return '"%s"' % (data.replace('"',"&quot;"))
+        return "'%s'" % (data)
+    return '"%s"' % (data)
 
-        if vartype == "int":
-            return int(rv)
-        elif vartype == "float":
-            return float(rv)
-        elif vartype == "bool":
-            if rv.lower() == "true":
-                return True
-            else:
-                return False
-        else:
-            return str(rv)
 
+# SignalProcessingNotification templates, rendered once at import. Only the per-signal values are escaped and
+# filled in per request. The layout is the one xmltodict.unparse gives, compact unless SPN_PRETTY is true
+SPN_PRETTY = os.environ.get('SPN_PRETTY','false').lower() == "true"
 
-    def dbGetSingleChannelInfo(channeldb,channel):
-        LOGGER.debug("Doing a call to Dynamo to get channel information for channel : %s" % (channel))
-        try:
-            response = db_client.get_item(TableName=channeldb,Key={"channelid":{"S":channel}})
-        except Exception as e:
-            exceptions.append("Unable to get item from DynamoDB, got exception:  %s" % (str(e).upper()))
-            return exceptions
-        return response
 
-    def dbCheckState(statedb,channel):
-        LOGGER.debug("Doing a call to Dynamo to get signal state information for channel : %s" % (channel))
-        try:
-            response = db_client.get_item(TableName=statedb,Key={"channelid":{"S":channel}})
-        except Exception as e:
-            exceptions.append("Unable to get item from DynamoDB, got exception:  %s" % (str(e).upper()))
-            return exceptions
-        return response
+def spn_lines(*lines):
+    # lines are (depth,markup), indented and terminated like xmltodict.unparse(pretty=True) does
+    if SPN_PRETTY:
+        return "".join("\t" * depth + markup + "\n" for depth,markup in lines)
+    return "".join(markup for depth,markup in lines)
 
-    # DynamoDB Put Item // Create and update item
-    def dbUpdateState(statedb,item,channel):
-        LOGGER.debug("Doing a call to Dynamo to get channel information for channel : %s" % (channel))
-        try:
-            response = db_client.put_item(TableName=statedb,Item=item)
-        except Exception as e:
-            exceptions.append("Unable to create/update item in DynamoDB, got exception:  %s" % (str(e).upper()))
-            return exceptions
-        return response
-
-    def scte_rule_checker(rule_condition_property,rule_condition_value,rule_condition_operator,scte_35_dict):
-        # ['=','>','<','-','!=']
-
-        scte35_property_value = ""
-        for main_key in scte_35_dict:
-            if isinstance(scte_35_dict[main_key],list):
-                for desc_number in range(0,len(scte_35_dict[main_key])):
-                    for property_key in scte_35_dict[main_key][desc_number]:
-                        if property_key == rule_condition_property:
-                            scte35_property_value = scte_35_dict[main_key][desc_number][property_key]
-            else:
-                for property_key in scte_35_dict[main_key]:
-                    if property_key == rule_condition_property:
-                        scte35_property_value = scte_35_dict[main_key][property_key]
 
-        rule_results = []
-        rule_condition_values = []
-        rule_evaluation = ""
-        if "," in rule_condition_value:
-            rule_condition_values = rule_condition_value.split(",")
+SPN_HEAD = ('<?xml version="1.0" encoding="utf-8"?>\n'
+    '<SignalProcessingNotification xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:sig="urn:cablelabs:md:xsd:signaling:3.0" xmlns:core="urn:cablelabs:md:xsd:core:3.0" xsi:schemaLocation="urn:cablelabs:iptvservices:esam:xsd:common:1 OC-SP-ESAM- API-I0x-Common.xsd" xmlns="urn:cablelabs:iptvservices:esam:xsd:common:1">'
+    + ("\n" if SPN_PRETTY else ""))
+SPN_TAIL = '</SignalProcessingNotification>'
 
-        else:
-            rule_condition_values.append(rule_condition_value)
+# the StreamTimes of the request are rendered with spn_element in between
+SPN_DELETE_HEAD = spn_lines(
+    (1,'<ResponseSignal action="delete" acquisitionPointIdentity=%s acquisitionSignalID=%s zoneIdentity=%s>'),
+    (2,'<sig:UTCPoint utcPoint=%s/>')
+)
+SPN_DELETE_TAIL = spn_lines((1,'</ResponseSignal>'))
 
-        for rule_condition_value in rule_condition_values:
 
 
-            rule_condition_value = value_type_validator(rule_condition_property,rule_condition_value)
+def spn_binary_data_template(action):
+    return spn_lines(
+        (1,'<ResponseSignal action="' + action + '" acquisitionPointIdentity=%s acquisitionSignalID=%s acquisitionTime=%s>'),
+        (2,'<sig:UTCPoint utcPoint=%s/>'),
+        (2,'<sig:BinaryData signalType=%s>%s</sig:BinaryData>'),
+        (1,'</ResponseSignal>')
+    )
 
-            if scte35_property_value == "":
-                scte35_property_value = 0
 
-            if rule_condition_value == "false":
-                rule_condition_value = False
-            elif rule_condition_value == "true":
-                rule_condition_value = True
+SPN_NOOP_TEMPLATE = spn_binary_data_template("noop")
+SPN_REPLACE_TEMPLATE = spn_binary_data_template("replace")
 
-            if rule_condition_operator == "=":
-                if scte35_property_value == rule_condition_value:
-                    rule_evaluation = True
-                else:
-                    if rule_evaluation == False:
-                        rule_evaluation = False
+SPN_STATUS_CODE_HEAD = spn_lines((1,'<StatusCode%s>'))
+SPN_STATUS_CODE_EMPTY = spn_lines((1,'<StatusCode%s/>'))
+SPN_STATUS_CODE_TAIL = spn_lines((1,'</StatusCode>'))
+SPN_NOTE_TEMPLATE = spn_lines((2,'<core:Note>%s</core:Note>'))
 
-            elif rule_condition_operator == ">":
-                if scte35_property_value > rule_condition_value:
-                    rule_evaluation = True
-                else:
-                    if rule_evaluation == False:
-                        rule_evaluation = False
 
-            elif rule_condition_operator == "<":
-                if scte35_property_value < rule_condition_value:
-                    # if scte35_property_value < rule_condition_value:
-                    rule_evaluation = True
-                else:
-                    if rule_evaluation == False:
-                        rule_evaluation = False
+def spn_element(name,value,depth):
+    # Renders an element of the request back to xml, same output as xmltodict.unparse(short_empty_elements=True)
+    if isinstance(value,list):
+        return "".join(spn_element(name,v,depth) for v in value)
 
-            elif rule_condition_operator == "-":
-                rule_value_min = rule_condition_value.split("-")[0]
-                rule_value_max = rule_condition_value.split("-")[1]
+    attributes = ""
+    children = ""
+    text = None
+    if isinstance(value,dict):
+        for k,v in value.items():
+            if k == "#text":
+                text = str(v)
+            elif k.startswith("@"):
+                attributes += " %s=%s" % (k[1:],xml_quoteattr(str(v)))
+            else:
+                children += spn_element(k,v,depth + 1)
+    elif value is not None:
+        text = str(value)
+
+    indent = "\t" * depth if SPN_PRETTY else ""
+    newline = "\n" if SPN_PRETTY else ""
+    if len(children) == 0 and not text:
+        return "%s<%s%s/>%s" % (indent,name,attributes,newline)
+    if len(children) > 0:
+        children = newline + children + indent
+    return "%s<%s%s>%s%s</%s>%s" % (indent,name,attributes,children,xml_escape(text or ""),name,newline)
+
+
+def spn_delete(acq_signal):
+    # Build Response Signal
+    quoteattr = xml_quoteattr
+    return (SPN_DELETE_HEAD % (
+        quoteattr(acq_signal['@acquisitionPointIdentity']),
+        quoteattr(acq_signal['@acquisitionSignalID']),
+        quoteattr(acq_signal['@zoneIdentity']),
+        quoteattr(acq_signal['sig:UTCPoint']['@utcPoint'])
+    ) + spn_element("sig:StreamTimes",acq_signal['sig:StreamTimes'],2) + SPN_DELETE_TAIL)
+
+
+def spn_noop(acq_signal):
+    # Build Response Signal
+    quoteattr = xml_quoteattr
+    return SPN_NOOP_TEMPLATE % (
+        quoteattr(acq_signal['@acquisitionPointIdentity']),
+        quoteattr(acq_signal['@acquisitionSignalID']),
+        quoteattr(acq_signal['@acquisitionTime']),
+        quoteattr(acq_signal['sig:UTCPoint']['@utcPoint']),
+        quoteattr(acq_signal['sig:BinaryData']['@signalType']),
+        xml_escape(acq_signal['sig:BinaryData']['#text'])
+    )
+
+
+def spn_replace(acq_signal,sig_binary_data):
+    # Build Response Signal
+    quoteattr = xml_quoteattr
+    return SPN_REPLACE_TEMPLATE % (
+        quoteattr(acq_signal['@acquisitionPointIdentity']),
+        quoteattr(acq_signal['@acquisitionSignalID']),
+        quoteattr(acq_signal['@acquisitionTime']),
+        quoteattr(acq_signal['sig:UTCPoint']['@utcPoint']),
+        quoteattr(acq_signal['sig:BinaryData']['@signalType']),
+        xml_escape(sig_binary_data)
+    )
+
+
+def spn_status_code(custom_status_code):
+    # StatusCode element, custom_status_code has an optional @classCode and a core:Note string or list
+    if len(custom_status_code) == 0:
+        return ""
+
+    class_code = ""
+    if '@classCode' in custom_status_code:
+        class_code = " classCode=%s" % (xml_quoteattr(str(custom_status_code['@classCode'])))
+
+    notes = custom_status_code.get('core:Note')
+    if notes is None:
+        return SPN_STATUS_CODE_EMPTY % (class_code)
+    if not isinstance(notes,list):
+        notes = [notes]
+    return (SPN_STATUS_CODE_HEAD % (class_code) +
+            "".join(SPN_NOTE_TEMPLATE % (xml_escape(str(note))) for note in notes) +
+            SPN_STATUS_CODE_TAIL)
+
+
+def process_acquired_signal(storage,statedb,acq_signal,channel_records,state_records,stage_timer):
+    # Makes the ESAM decision for one AcquiredSignal, returns the rendered ResponseSignal and the StatusCode dict.
+    # channel_records and state_records are the prefetched results of get_channel_records
 
-                if scte35_property_value > rule_value_min and scte35_property_value < rule_value_max:
-                    rule_evaluation = True
-                else:
-                    if rule_evaluation == False:
-                        rule_evaluation = False
+    # Extract acquired signal parameters
+    acquisition_point_id = acq_signal['@acquisitionPointIdentity']
+    acquisition_signal_id = acq_signal['@acquisitionSignalID']
+    sig_binary_data = acq_signal['sig:BinaryData']['#text']
+    # sig_binary_data is replaced by the re-encoded cue on replace, retries are matched on the cue they send
+    inbound_binary_data = sig_binary_data
 
-            elif rule_condition_operator == "!=":
-                if scte35_property_value != rule_condition_value:
+    LOGGER.info("SCTE35 Received in SPE: %s " % (sig_binary_data))
 
-                    if rule_evaluation != True:
-                        rule_evaluation = True
-                else:
-                    rule_evaluation = False
+    ##
+    ## Done Parsing
+    ##
 
-                rule_results.append({rule_condition_value:rule_evaluation})
 
-            else:
-                rule_evaluation = False
-
-        return rule_evaluation
-
-    def spn_delete():
-        # Build Response Signal
-        resp_signal = dict()
-
-        # A Delete example
-        resp_signal['@action'] = "delete"
-        resp_signal['@acquisitionPointIdentity'] = acquisition_point_id
-        resp_signal['@acquisitionSignalID'] = acquisition_signal_id
-        resp_signal['@zoneIdentity'] = zone_identity
-        #resp_signal['sig:BinaryData'] = {}
-        #resp_signal['sig:BinaryData']['@signalType'] = sig_binary_data_type
-        #resp_signal['sig:BinaryData']['#text'] = sig_binary_data
-        resp_signal['sig:UTCPoint'] = {}
-        resp_signal['sig:UTCPoint']['@utcPoint'] = sig_utc_point
-        resp_signal['sig:StreamTimes'] = sig_stream_times
-
-        return resp_signal
-
-    def spn_noop():
-        # Build Response Signal
-        resp_signal = dict()
-
-        # A NOOP Example
-        resp_signal['@action'] = "noop"
-        resp_signal['@acquisitionPointIdentity'] = acquisition_point_id
-        resp_signal['@acquisitionSignalID'] = acquisition_signal_id
-        resp_signal['@acquisitionTime'] = acquisition_time
-        resp_signal['sig:UTCPoint'] = {}
-        resp_signal['sig:UTCPoint']['@utcPoint'] = sig_utc_point
-        resp_signal['sig:BinaryData'] = {}
-        resp_signal['sig:BinaryData']['@signalType'] = sig_binary_data_type
-        resp_signal['sig:BinaryData']['#text'] = sig_binary_data
-        return resp_signal
-
-    def spn_replace(sig_binary_data):
-
-        # Build Response Signal
-        resp_signal = dict()
-
-        resp_signal['@action'] = "replace"
-        resp_signal['@acquisitionPointIdentity'] = acquisition_point_id
-        resp_signal['@acquisitionSignalID'] = acquisition_signal_id
-        resp_signal['@acquisitionTime'] = acquisition_time
-        resp_signal['sig:UTCPoint'] = {}
-        resp_signal['sig:UTCPoint']['@utcPoint'] = sig_utc_point
-        resp_signal['sig:BinaryData'] = {}
-        resp_signal['sig:BinaryData']['@signalType'] = sig_binary_data_type
-        resp_signal['sig:BinaryData']['#text'] = sig_binary_data
-
-        return resp_signal
+    dynamodb_to_json = dict()
 
     action = ""
+    rule_matched = None
     custom_status_code = dict()
     channel_pois_record = dict()
-    channel_state_record = dict()
     # See if channel exists in db
 
-    try:
-        get_channel_record = dbGetSingleChannelInfo(channeldb,acquisition_point_id)
-
-        if "Item" in get_channel_record:
-            channel_pois_record = get_channel_record['Item']
-            dict_path(dynamodb_to_json,channel_pois_record)
+    if acquisition_point_id not in channel_records:
+        action = "noop"
+        custom_status_code['@classCode'] = 2
+        custom_status_code['core:Note'] = "Unable to retrieve channel config from POIS"
 
-        else:
-            # channel doesn't exist in POIS, setting behavior to noop back to requestor
-            action = "noop"
-            custom_status_code['@classCode'] = 2
-            custom_status_code['core:Note'] = "Channel not registered with POIS"
+    elif channel_records[acquisition_point_id] is not None:
+        channel_pois_record = channel_records[acquisition_point_id]
+        dynamodb_to_json = channel_pois_record['config']
+        channel_rules = channel_pois_record['rules']
+
+        # retry of a signal we already made a decision for
+        decision_time = time.monotonic()
+        decision_key = (acquisition_point_id,acquisition_signal_id,channel_pois_record['version'])
+        decision = decision_cache_get(decision_key,inbound_binary_data,decision_time)
+        if decision is not None:
+            LOGGER.info("Returning the cached decision for signal %s on channel %s" % (acquisition_signal_id,acquisition_point_id))
+            resp_signal,custom_status_code,action,rule_matched = decision
+            stage_timer.count("decision_cache_hits")
+            stage_timer.signal(acquisition_point_id,action,rule_matched)
+            return resp_signal,dict(custom_status_code)
 
-    except Exception as e:
+    else:
+        # channel doesn't exist in POIS, setting behavior to noop back to requestor
         action = "noop"
         custom_status_code['@classCode'] = 2
-        custom_status_code['core:Note'] = "Unable to retrieve channel config from POIS"
+        custom_status_code['core:Note'] = "Channel not registered with POIS"
 
     # check if rules present
     # iterate through rules
@@ -393,14 +1228,22 @@ def lambda_handler(event, context):
         LOGGER.debug("Parsing inbound SCTE35")
 
         # Parse SCTE35 first
+        stage_timer.lap("other")
+        scte_35_dict = None
+        scte_35_index = None
         try:
-            scte_35_cue = threefive.Cue(sig_binary_data)
-            scte_35_cue.decode()
-            scte_35_dict = scte_35_cue.get()
+            if channel_pois_record['header_only'] and sig_binary_data not in scte35_cache:
+                scte_35_index = scte35_header_index(sig_binary_data)
+                if scte_35_index is not None:
+                    stage_timer.count("scte35_header_reads")
+            if scte_35_index is None:
+                # shared with the decoded cue cache, copied with scte35_thaw before it's modified
+                scte_35_dict,scte_35_index = scte35_decode(sig_binary_data,stage_timer)
         except:
             action = dynamodb_to_json['default_behavior']
             custom_status_code['@classCode'] = 2
             custom_status_code['core:Note'] = "Unable to decode inbound SCTE35, using default behavior"
+        stage_timer.lap("scte35_decode")
 
 
         try:
@@ -408,454 +1251,318 @@ def lambda_handler(event, context):
         except:
             LOGGER.debug("Cant obtain type or segtypeid")
 
-        # Iterate through rules
-        scte35notdeleted = True
         custom_status_code_rule_match = ""
 
 
         ## Check signal state
+        # The state read with the channel config, or a lock known to the lock cache, is used as is. Otherwise the
+        # state is only looked at once the decision is made, see below
         esam_lock = False
-        if "mode" in dynamodb_to_json:
-
-            if dynamodb_to_json['mode'] == "stateful":
-
+        stateful = dynamodb_to_json.get('mode') == "stateful"
+        if stateful and acquisition_point_id in state_records:
+            if not pois_storage.lock_expired(state_records[acquisition_point_id],int(datetime.datetime.utcnow().timestamp())):
+                action = "delete"
+                custom_status_code['@classCode'] = 0
+                custom_status_code['core:Note'] = "ESAM state is locked until previous SCTE expires"
+                esam_lock = True
+
+
+        stage_timer.lap("config_fetch")
+
+        if esam_lock == False and scte_35_index is not None:
+            # rules are evaluated in order, the first rule that evaluates to True is applied
+            r = channel_pois_record['rule_index'].match(scte_35_index)
+            rule_check_result = r is not None
+            if rule_check_result:
+                rule = channel_rules[r]
+            rule_matched = r
+            stage_timer.lap("rule_evaluation")
+
+            if rule_check_result and rule.type != "delete" and scte_35_dict is None:
+                # matched on the header only, the replace needs the whole cue
                 try:
-                    get_state_record = dbCheckState(statedb,acquisition_point_id)
-
-                    if "Item" in get_state_record:
-                        channel_state_record = get_state_record['Item']
-
-                        signal_expiry_time = int(channel_state_record["signal_expiry_time"]["S"])
-
-                        time_now = int(datetime.datetime.utcnow().timestamp())
-
-                        if time_now < signal_expiry_time:
-
-                            action = "delete"
-                            custom_status_code['@classCode'] = 0
-                            custom_status_code['core:Note'] = "ESAM state is locked until previous SCTE expires"
-
-                            esam_lock = True
-
-
-                    else:
-                        # channel doesn't exist in POIS, setting behavior to noop back to requestor
-
-                        LOGGER.debug("No channel state currently")
-                        action = "noop"
-                        custom_status_code['@classCode'] = 2
-                        custom_status_code['core:Note'] = "Channel not registered with POIS"
-
-                except Exception as e:
-                    action = "noop"
+                    scte_35_dict,scte_35_index = scte35_decode(sig_binary_data,stage_timer)
+                except:
+                    rule_check_result = None
+                    action = dynamodb_to_json['default_behavior']
                     custom_status_code['@classCode'] = 2
-                    custom_status_code['core:Note'] = "Unable to retrieve channel config from POIS"
-
-
-        if esam_lock == False:
-            for r in range(0,len(dynamodb_to_json['rules'])):
-                rule = dynamodb_to_json['rules'][r]
-
-
-                # do a while loop, if we're iterating through the rules but there's alreadby been a delete match, may as well exit for loop
-                while scte35notdeleted:
-                    rule_type = rule['type']
-                    rule_condition_property = rule['condition']['property']
-                    rule_condition_value = rule['condition']['value']
-                    rule_condition_operator = rule['condition']['operator']
+                    custom_status_code['core:Note'] = "Unable to decode inbound SCTE35, using default behavior"
+                stage_timer.lap("scte35_decode")
 
+            if rule_check_result: # if True
+                if rule.type == "delete":
+                    action = "delete"
 
-                    rule_check_result = scte_rule_checker(rule_condition_property,rule_condition_value,rule_condition_operator,scte_35_dict) # true false
-
-
-                    #return rule_check_result
-
-
-                    if rule_check_result: # if True
-                        if rule_type == "delete":
-                            action = "delete"
-                            scte35notdeleted = False
-
-                            custom_status_code_rule_match = "matched rule %r" % (str(r))
-                            custom_status_code['@classCode'] = 0
-                            custom_status_code['core:Note'] = custom_status_code_rule_match
+                    custom_status_code_rule_match = "matched rule %r" % (str(r))
+                    custom_status_code['@classCode'] = 0
+                    custom_status_code['core:Note'] = custom_status_code_rule_match
 
-                        else: # replace
-                            # iterate through replace_params and modify scte35 dict
-                            action = "replace"
+                else: # replace
+                    # iterate through replace_params and modify scte35 dict
+                    action = "replace"
+                    scte_35_dict = scte35_thaw(scte_35_dict)
 
-                            rule_params = rule['replace_params']
-                            descriptors_dict = dict()
-                            for replace_param_number in range(0,len(rule_params)):
-                                rule_param = rule_params[replace_param_number]
-                                r_key = list(rule_param.keys())[0]
+                    descriptors_dict = dict()
+                    for replace_param_number in range(0,len(rule.replace_params)):
+                        r_key,r_header,r_value = rule.replace_params[replace_param_number]
 
-                                r_value = value_type_validator(r_key,rule_param[r_key])
+                        if r_header is None:
+                            custom_status_code_rule_match += "rule %s replace param %s failed ." % (str(r),str(replace_param_number))
+                            custom_status_code['@classCode'] = 2
 
 
-                                for property_header in threefive_scte_format:
-                                    if r_key in threefive_scte_format[property_header]:
-                                        r_header = property_header
 
+                        else:
 
+                            # replace property in scte35 dict
+                            if not isinstance(scte_35_dict[r_header],list):
+                                scte_35_dict[r_header][r_key] = r_value
+                            else:
 
-                                if r_header == "":
-                                    custom_status_code_rule_match += "rule %s replace param %s failed ." % (str(r),str(replace_param_number))
-                                    custom_status_code['@classCode'] = 2
+                                properties_list = scte_35_dict[r_header]
 
+                                if len(properties_list) == 0:
 
+                                    descriptors_dict[r_key] = r_value
 
                                 else:
 
-                                    # replace property in scte35 dict
-                                    if not isinstance(scte_35_dict[r_header],list):
-                                        scte_35_dict[r_header][r_key] = r_value
-                                    else:
-
-                                        properties_list = scte_35_dict[r_header]
-
-                                        if len(properties_list) == 0:
-
-                                            descriptors_dict[r_key] = r_value
-
-                                        else:
+                                    for p_list in range(0,len(properties_list)):
+                                        properties_list[p_list][r_key] = r_value
 
-                                            for p_list in range(0,len(properties_list)):
-                                                properties_list[p_list][r_key] = r_value
 
+                                scte_35_dict[r_header] = properties_list
 
-                                        scte_35_dict[r_header] = properties_list
-
-                                        #scte_35_dict[r_header].append(r_key+":"+str(r_value))
-                                    custom_status_code_rule_match += "rule %s replace param %s filled ." % (str(r),str(replace_param_number))
-                                    if '@classCode' in custom_status_code:
-                                        if custom_status_code['@classCode'] != 2:
-                                            custom_status_code['@classCode'] = 0
-                                    else:
-                                        custom_status_code['@classCode'] = 0
-
-                            # add to descriptors
-                            if len(descriptors_dict) > 0:
-
-                                scte_35_dict['descriptors'] = [descriptors_dict]
-
-                            #
-                            # Build SCTE35 signal
-                            #
-                            cue = threefive.Cue()
-                            cmd = threefive.TimeSignal()
-
-                            if "splice_immediate_flag" in scte_35_dict['command'].keys():
-                                if scte_35_dict['command']['splice_immediate_flag'] == True:
-                                    cmd.splice_immediate_flag = True
-                                    cmd.time_specified_flag = False
-                                else:
-                                    cmd.time_specified_flag = True
-                                    cmd.pts_time = scte_35_dict['command']['pts_time']
-                                    cmd.pts_ticks = scte_35_dict['command']['pts_ticks']
-                                    cmd.break_auto_return = True
-                            else:
-                                cmd.time_specified_flag = True
-                                cmd.pts_time = scte_35_dict['command']['pts_time']
-                                cmd.pts_ticks = scte_35_dict['command']['pts_ticks']
-                                cmd.break_auto_return = True
-
-                                scte_duration_ticks = 2700000
-                                scte_duration = 30.00
-                                if scte_35_dict['info_section']['splice_command_type'] == 5:
-                                    try:
-                                        scte_duration = scte_35_dict['command']['break_duration']
-                                        scte_duration_ticks = scte_35_dict['command']['break_ticks']
-                                    except:
-                                        LOGGER.info("No duration field on segmentation descriptor")
-                                else:
-                                    try:
-                                        scte_duration = scte_35_dict['descriptors'][0]['segmentation_duration']
-                                        scte_duration_ticks = scte_35_dict['descriptors'][0]['segmentation_duration_ticks']
-                                    except:
-                                        LOGGER.info("No duration field on segmentation descriptor")
-
-                            cue.command = cmd
-                            cue.info_section.pts_adjustment = scte_35_dict['info_section']['pts_adjustment']
-                            cue.info_section.pts_adjustment_ticks = scte_35_dict['info_section']['pts_adjustment_ticks']
-
-                            tsdescriptor = threefive.SegmentationDescriptor(None)
-                            tsdescriptor.provider_avail_id = 1
-                            tsdescriptor.segmentation_event_id = 1
-                            tsdescriptor.segmentation_duration_flag = True
-                            tsdescriptor.delivery_not_restricted_flag = False
-                            tsdescriptor.web_delivery_allowed_flag = False
-                            tsdescriptor.no_regional_blackout_flag = False
-                            tsdescriptor.archive_allowed_flag = True
-                            tsdescriptor.segmentation_duration = scte_duration
-                            tsdescriptor.segmentation_duration_ticks = 2700000
-                            tsdescriptor.segmentation_upid_type = 9
-                            tsdescriptor.segmentation_upid = 00
-                            tsdescriptor.segmentation_type_id = 52
-                            tsdescriptor.segment_num = 0
-                            tsdescriptor.segments_expected = 0
-                            tsdescriptor.sub_segment_num = 0
-                            tsdescriptor.sub_segments_expected = 0
-
-                            cmd=threefive.TimeSignal()
-
-                            if scte_35_dict['command']['splice_immediate_flag'] == True:
-                                cmd.splice_immediate_flag = True
-                                cmd.time_specified_flag = False
+                                #scte_35_dict[r_header].append(r_key+":"+str(r_value))
+                            custom_status_code_rule_match += "rule %s replace param %s filled ." % (str(r),str(replace_param_number))
+                            if '@classCode' in custom_status_code:
+                                if custom_status_code['@classCode'] != 2:
+                                    custom_status_code['@classCode'] = 0
                             else:
-                                cmd.time_specified_flag = True
-                                cmd.pts_time = scte_35_dict['command']['pts_time']
-                                cmd.pts_ticks = scte_35_dict['command']['pts_ticks']
-                                cmd.break_auto_return = True
-
-
+                                custom_status_code['@classCode'] = 0
 
-                            cue.info_section.pts_adjustment = scte_35_dict['info_section']['pts_adjustment']
-                            cue.command = cmd
+                    # add to descriptors
+                    if len(descriptors_dict) > 0:
 
-                            try:
-                                segmentation_event_id_scte = scte_35_dict['descriptors'][0]['segmentation_event_id']
+                        scte_35_dict['descriptors'] = [descriptors_dict]
 
-                            except Exception as e:
-                                segmentation_event_id_scte = str(int(time.time()/1000))
+                    #
+                    # Build SCTE35 signal
+                    #
+                    scte_duration = scte35_duration(scte_35_dict)
+                    try:
+                        sig_binary_data = pois_scte35.encode_time_signal(replace_time_signal(scte_35_dict,scte_duration))
+                        LOGGER.info("SCTE35 encoded: %s " % (sig_binary_data))
 
-                            dscrptr = threefive.SegmentationDescriptor(None)
-                            dscrptr.tag = 2
-                            dscrptr.descriptor_length = 23
-                            dscrptr.name = "Segmentation Descriptor"
-                            dscrptr.identifier = "CUEI"
-                            dscrptr.components = []
-                            dscrptr.segmentation_event_id = segmentation_event_id_scte
-                            dscrptr.segmentation_event_cancel_indicator = False
-                            dscrptr.program_segmentation_flag = True
-                            dscrptr.segmentation_duration_flag = True
-                            dscrptr.segmentation_duration = 30.0
+                        custom_status_code['core:Note'] = custom_status_code_rule_match
+                    except Exception as e:
+                        LOGGER.warning("SCTE35 encode exception : %s " % (e))
+                        action = dynamodb_to_json['default_behavior']
+                        custom_status_code['@classCode'] = 2
+                        custom_status_code['core:Note'] = "Unable to encode new SCTE35, using default behavior"
+                    stage_timer.lap("re_encode")
 
-                            dscrptr.delivery_not_restricted_flag = False
-                            dscrptr.web_delivery_allowed_flag = False
-                            dscrptr.no_regional_blackout_flag = False
-                            dscrptr.archive_allowed_flag = True
-                            dscrptr.device_restrictions = "No Restrictions"
-                            dscrptr.segmentation_message = "Provider Placement Opportunity Start"
-                            dscrptr.segmentation_upid_type = 9
-                            dscrptr.segmentation_upid_type_name = "Deprecated"
-                            dscrptr.segmentation_upid_length = 0
-                            dscrptr.segmentation_upid = ""
-                            dscrptr.segmentation_type_id = 52
-                            dscrptr.segment_num = 0
-                            dscrptr.sub_segments_expected = 0
-                            dscrptr.sub_segment_num = 0
-                            dscrptr.segments_expected = 1
 
-                            cue.descriptors.append(dscrptr)
+            elif rule_check_result == False and len(channel_pois_record['descriptor_priority']) > 0:
 
-                            try:
-                                sig_binary_data = cue.encode()
-                                LOGGER.info("SCTE35 encoded: %s " % (sig_binary_data))
+                match = False
 
-                                custom_status_code['core:Note'] = custom_status_code_rule_match
-                            except Exception as e:
-                                LOGGER.warning("SCTE35 encode exception : %s " % (e))
-                                action = dynamodb_to_json['default_behavior']
-                                custom_status_code['@classCode'] = 2
-                                custom_status_code['core:Note'] = "Unable to encode new SCTE35, using default behavior"
+                if "descriptors" in scte_35_dict.keys():
 
+                    for dpriority in channel_pois_record['descriptor_priority']:
 
-                    elif rule_check_result == False and "descriptor_priority" in dynamodb_to_json:
+                        for d in scte_35_dict['descriptors']:
 
-                        descriptor_priority_list = dynamodb_to_json['descriptor_priority'].split(",")
-                        match = False
+                            # cancelled segmentation descriptors and the other descriptor types have no segmentation_type_id
+                            if d.get('segmentation_type_id') == dpriority:
 
-                        if "descriptors" in scte_35_dict.keys():
+                                if match == False:
+                                    new_descriptor = d
 
-                            for dpriority in descriptor_priority_list:
+                                match = True
 
-                                for d in scte_35_dict['descriptors']:
+                    if match == True:
 
-                                    if int(d['segmentation_type_id']) == int(dpriority):
+                        scte_35_dict = scte35_thaw(scte_35_dict)
+                        new_descriptor = scte35_thaw(new_descriptor)
+                        scte_35_dict['descriptors'].clear()
+                        scte_35_dict['descriptors'] = [new_descriptor]
 
-                                        if match == False:
-                                            new_descriptor = d
+                        scte_duration = scte35_duration(scte_35_dict)
 
-                                        match = True
+                        try:
+                            sig_binary_data = pois_scte35.encode_time_signal(replace_time_signal(scte_35_dict,scte_duration))
+                            LOGGER.info("SCTE35 encoded: %s " % (sig_binary_data))
+                            custom_status_code['@classCode'] = 0
+                            custom_status_code['core:Note'] = "Matched on priority descriptor"
+                            action = "replace"
+                        except Exception as e:
+                            LOGGER.warning("SCTE35 encode exception : %s " % (e))
+                            action = dynamodb_to_json['default_behavior']
+                            custom_status_code['@classCode'] = 2
+                            custom_status_code['core:Note'] = "Unable to encode new SCTE35, using default behavior"
+                        stage_timer.lap("re_encode")
 
-                            if match == True:
+                    else:
 
-                                scte_35_dict['descriptors'].clear()
-                                scte_35_dict['descriptors'] = [new_descriptor]
+                        action = dynamodb_to_json['default_behavior']
+                        custom_status_code['@classCode'] = 0
+                        custom_status_code['core:Note'] = "No rule match at POIS, using default behavior"
 
-                                cue = threefive.Cue()
-                                cmd = threefive.TimeSignal()
 
+                # for scte_descriptor in descriptor_priority_list:
 
-                                if "splice_immediate_flag" in scte_35_dict['command'].keys():
-                                    if scte_35_dict['command']['splice_immediate_flag'] == True:
-                                        cmd.splice_immediate_flag = True
-                                        cmd.time_specified_flag = False
-                                    else:
-                                        cmd.time_specified_flag = True
-                                        cmd.pts_time = scte_35_dict['command']['pts_time']
-                                        cmd.pts_ticks = scte_35_dict['command']['pts_ticks']
-                                        cmd.break_auto_return = True
-                                else:
-                                    cmd.time_specified_flag = True
-                                    cmd.pts_time = scte_35_dict['command']['pts_time']
-                                    cmd.pts_ticks = scte_35_dict['command']['pts_ticks']
-                                    cmd.break_auto_return = True
-
-                                    try:
-                                        scte_duration = scte_35_dict['descriptors'][0]['segmentation_duration']
-                                    except:
-                                        scte_duration = 30.00
-
-                                cue.info_section.pts_adjustment = scte_35_dict['info_section']['pts_adjustment']
-                                cue.info_section.pts_adjustment_ticks = scte_35_dict['info_section']['pts_adjustment_ticks']
-
-                                cue.command = cmd
-
-
-                                try:
-                                    segmentation_event_id_scte = scte_35_dict['descriptors'][0]['segmentation_event_id']
-
-                                except Exception as e:
-                                    segmentation_event_id_scte = str(int(time.time()/1000))
-
-                                dscrptr = threefive.SegmentationDescriptor(None)
-                                dscrptr.tag = 2
-                                dscrptr.descriptor_length = 23
-                                dscrptr.name = "Segmentation Descriptor"
-                                dscrptr.identifier = "CUEI"
-                                dscrptr.components = []
-                                dscrptr.segmentation_event_id = segmentation_event_id_scte
-                                dscrptr.segmentation_event_cancel_indicator = False
-                                dscrptr.program_segmentation_flag = True
-                                dscrptr.segmentation_duration_flag = True
-                                dscrptr.segmentation_duration = scte_duration
-
-                                dscrptr.delivery_not_restricted_flag = False
-                                dscrptr.web_delivery_allowed_flag = False
-                                dscrptr.no_regional_blackout_flag = False
-                                dscrptr.archive_allowed_flag = True
-                                dscrptr.device_restrictions = "No Restrictions"
-                                dscrptr.segmentation_message = "Provider Placement Opportunity Start"
-                                dscrptr.segmentation_upid_type = 9
-                                dscrptr.segmentation_upid_type_name = "Deprecated"
-                                dscrptr.segmentation_upid_length = 0
-                                dscrptr.segmentation_upid = ""
-                                dscrptr.segmentation_type_id = 52
-                                dscrptr.segment_num = 0
-                                dscrptr.sub_segments_expected = 0
-                                dscrptr.sub_segment_num = 0
-                                dscrptr.segments_expected = 1
-
-                                cue.descriptors.append(dscrptr)
-
-                                #return cue.encode()
-
-                                try:
-                                    sig_binary_data = cue.encode()
-                                    LOGGER.info("SCTE35 encoded: %s " % (sig_binary_data))
-                                    custom_status_code['@classCode'] = 0
-                                    custom_status_code['core:Note'] = "Matched on priority descriptor"
-                                    action = "replace"
-                                except Exception as e:
-                                    LOGGER.warning("SCTE35 encode exception : %s " % (e))
-                                    action = dynamodb_to_json['default_behavior']
-                                    custom_status_code['@classCode'] = 2
-                                    custom_status_code['core:Note'] = "Unable to encode new SCTE35, using default behavior"
 
-                            else:
+                # return dynamodb_to_json
 
-                                action = dynamodb_to_json['default_behavior']
-                                custom_status_code['@classCode'] = 0
-                                custom_status_code['core:Note'] = "No rule match at POIS, using default behavior"
+                else:
 
+                    action = dynamodb_to_json['default_behavior']
+                    custom_status_code['@classCode'] = 0
+                    custom_status_code['core:Note'] = "No rule match at POIS, using default behavior"
 
-                        # for scte_descriptor in descriptor_priority_list:
+            elif rule_check_result == False:
+                action = dynamodb_to_json['default_behavior']
+                custom_status_code['@classCode'] = 0
+                custom_status_code['core:Note'] = "No rule match at POIS, using default behavior"
 
+        if stateful and esam_lock == False:
+            # One round trip to the state table: a replace takes the lock with a conditional write, which fails if
+            # another signal holds it, any other decision reads the state to see if the channel is locked
+            epoch_now = int(datetime.datetime.utcnow().timestamp())
+            if action == "replace":
+                LOGGER.debug("Lock DB")
+                try:
+                    pts_offset = int(scte_35_dict['info_section']['pts_adjustment_ticks'])
+                    pts_offset_seconds = (pts_offset % (2 ** 33)) / 90000
+                    expiry_time = int(epoch_now + scte_duration + pts_offset_seconds)
 
-                        # return dynamodb_to_json
+                    lock_acquired,state_item = dbAcquireLock(storage,statedb,acquisition_point_id,expiry_time,epoch_now)
+                    state_lock_cache_put(acquisition_point_id,state_item,time.monotonic())
 
-                        else:
+                    # later signals for this channel in the same SignalProcessingEvent see the lock
+                    state_records[acquisition_point_id] = state_item
+                    esam_lock = not lock_acquired
 
-                            action = dynamodb_to_json['default_behavior']
-                            custom_status_code['@classCode'] = 0
-                            custom_status_code['core:Note'] = "No rule match at POIS, using default behavior"
+                    LOGGER.info("Lock on channel %s acquired %s, locked until %s" % (acquisition_point_id,lock_acquired,(state_item or {}).get('signal_expiry_time')))
+                except Exception as e:
+                    LOGGER.error("Unable to write the state information to DB, got exception: %s" % (e))
+                stage_timer.lap("state_update")
 
-                    else:
-                        action = dynamodb_to_json['default_behavior']
-                        custom_status_code['@classCode'] = 0
-                        custom_status_code['core:Note'] = "No rule match at POIS, using default behavior"
+            elif acquisition_point_id not in state_records:
+                get_state_record = dbCheckState(storage,statedb,acquisition_point_id)
+                if isinstance(get_state_record,list):
+                    action = "noop"
+                    custom_status_code['@classCode'] = 2
+                    custom_status_code['core:Note'] = "Unable to retrieve channel config from POIS"
+                else:
+                    state_records[acquisition_point_id] = get_state_record.get('Item')
+                    state_lock_cache_put(acquisition_point_id,state_records[acquisition_point_id],time.monotonic())
+                    esam_lock = not pois_storage.lock_expired(state_records[acquisition_point_id],epoch_now)
+                stage_timer.lap("config_fetch")
 
-                    scte35notdeleted = False
+            if esam_lock:
+                action = "delete"
+                rule_matched = None
+                custom_status_code['@classCode'] = 0
+                custom_status_code['core:Note'] = "ESAM state is locked until previous SCTE expires"
 
 
     ##
     ## Build ESAM Response
     ##
     LOGGER.info("action type : %s " % (action))
+    stage_timer.lap("other")
     if action == "delete":
-        resp_signal = spn_delete()
+        resp_signal = spn_delete(acq_signal)
     elif action == "noop":
-        resp_signal = spn_noop()
+        resp_signal = spn_noop(acq_signal)
     elif action == "replace":
-        resp_signal = spn_replace(sig_binary_data)
-
-        #Create signal lock
-        if "mode" in dynamodb_to_json:
-            if dynamodb_to_json['mode'] == "stateful":
-                LOGGER.debug("Lock DB")
-
-                try:
-
-                    pts_offset = int(scte_35_dict['info_section']['pts_adjustment_ticks'])
-                    pts_offset_seconds = (pts_offset % (2 ** 33)) / 90000
-                    time_now = int(datetime.datetime.utcnow().timestamp())
-                    expiry_time = str(int(time_now + scte_duration + pts_offset_seconds))
+        resp_signal = spn_replace(acq_signal,sig_binary_data)
+    else:
+        LOGGER.debug("requested action goes nowhere currently")
 
-                    item = {
-                        "channelid": {
-                            "S": acquisition_point_id
-                        },
-                        "signal_expiry_time": {
-                            "S": expiry_time
-                        }
-                    }
+    stage_timer.lap("xml_serialize")
 
-                    # write to DB
-                    db_update_response = dbUpdateState(statedb,item,acquisition_point_id)
+    # errors can be transient, only successful decisions are kept for retries
+    if len(channel_pois_record) > 0 and custom_status_code.get('@classCode',0) != 2:
+        decision_cache_put(decision_key,inbound_binary_data,(resp_signal,dict(custom_status_code),action,rule_matched),decision_time)
 
-                    LOGGER.info("Updated DB lock on channel %s to timestamp %s: %s" % (acquisition_point_id,expiry_time,str(db_update_response)))
+    stage_timer.signal(acquisition_point_id,action,rule_matched)
+    return resp_signal,custom_status_code
 
 
+def lambda_handler(event, context):
+    stage_timer = StageTimer(STAGE_METRICS)
+    LOGGER.info(event)
 
-                except Exception as e:
+    storage = STORAGE
 
-                    LOGGER.error("Unable to write the state information to DB, got exception: %s" % (e))
+    # channels database
+    channeldb = CHANNELDB
+    scheduledb = SCHEDULEDB
+    statedb = STATEDB
 
+    # Extract SPE from Transcoder
+    esam_payload_xml = event['body']
 
-    else:
-        LOGGER.debug("requested action goes nowhere currently")
+    # A SignalProcessingEvent can carry several AcquiredSignal elements
+    stage_timer.lap("other")
+    acq_signals = parse_signal_processing_event(esam_payload_xml)
+    if acq_signals is None:
+        LOGGER.debug("SignalProcessingEvent not handled by the fast parser, using xmltodict")
 
+        # Convert to JSON
+        esam_payload_json = xmltodict.parse(esam_payload_xml)
 
-    # Create response SPN
-    spn = dict()
-    response_main_elements_attributes = {
-        "@xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
-        "@xmlns:sig": "urn:cablelabs:md:xsd:signaling:3.0",
-        "@xmlns:core":"urn:cablelabs:md:xsd:core:3.0",
-        "@xsi:schemaLocation": "urn:cablelabs:iptvservices:esam:xsd:common:1 OC-SP-ESAM- API-I0x-Common.xsd",
-        "@xmlns": "urn:cablelabs:iptvservices:esam:xsd:common:1"
-    }
+        # Extract SPE
+        spe = esam_payload_json['SignalProcessingEvent']
 
-    spn['SignalProcessingNotification'] = response_main_elements_attributes
-    spn['SignalProcessingNotification']['ResponseSignal'] = resp_signal
-    if len(custom_status_code) > 0:
-        spn['SignalProcessingNotification']['StatusCode'] = custom_status_code
+        acq_signals = spe['AcquiredSignal']
+        if not isinstance(acq_signals,list):
+            acq_signals = [acq_signals]
+    stage_timer.lap("xml_parse")
 
+    # Get the config and state of every channel in the SPE in one round trip
+    acquisition_point_ids = []
+    for acq_signal in acq_signals:
+        if acq_signal['@acquisitionPointIdentity'] not in acquisition_point_ids:
+            acquisition_point_ids.append(acq_signal['@acquisitionPointIdentity'])
 
-    # convert payload to xml for return
-    spn_xml = xmltodict.unparse(spn, short_empty_elements=True, pretty=True)
+    try:
+        channel_records,state_records = get_channel_records(storage,channeldb,statedb,acquisition_point_ids)
+    except Exception as e:
+        LOGGER.error("Unable to get channel information from storage, got exception: %s" % (e))
+        channel_records = dict()
+        state_records = dict()
+    stage_timer.lap("config_fetch")
+
+    resp_signals = []
+    custom_status_codes = []
+    for acq_signal in acq_signals:
+        resp_signal,custom_status_code = process_acquired_signal(storage,statedb,acq_signal,channel_records,state_records,stage_timer)
+        resp_signals.append(resp_signal)
+        custom_status_codes.append((acq_signal['@acquisitionSignalID'],custom_status_code))
+
+    if len(resp_signals) == 1:
+        custom_status_code = custom_status_codes[0][1]
+    else:
+        # one StatusCode for the notification, with the worst classCode and a note per signal
+        custom_status_code = dict()
+        status_notes = []
+        for acquisition_signal_id,signal_status_code in custom_status_codes:
+            if '@classCode' in signal_status_code:
+                custom_status_code['@classCode'] = max(custom_status_code.get('@classCode',0),signal_status_code['@classCode'])
+            if 'core:Note' in signal_status_code:
+                status_notes.append("%s: %s" % (acquisition_signal_id,signal_status_code['core:Note']))
+        if len(status_notes) > 0:
+            custom_status_code['core:Note'] = status_notes
+
+    # Create response SPN from the rendered ResponseSignals
+    stage_timer.lap("other")
+    spn_xml = SPN_HEAD + "".join(resp_signals) + spn_status_code(custom_status_code) + SPN_TAIL
+    stage_timer.lap("xml_serialize")
+    stage_timer.emit()
 
     return {
         'statusCode': 200,
@@ -863,4 +1570,9 @@ def lambda_handler(event, context):
             "Content-Type": "application/xml",
         },
         'body': spn_xml
-    }
\ No newline at end of file
+    }
+
+
+# end of the container init
+startup_profile['init'] = time.perf_counter() - INIT_START
+startup_profile_emit("init",startup_profile)
@@ -0,0 +1,770 @@
+'''
+Latency benchmark for the ESAM decision path.
+
+Replays a corpus of SignalProcessingEvents shaped like spe.json through the lambda_handler of esam-processor.py,
+with channel config and state in the in-memory (or SQLite) storage backend, so no AWS account is needed.
+Channels are configured through the lambda_handler of pois-control.py, the same way as the deployed stack.
+
+Each scenario reports p50/p95/p99 latency and throughput for the whole request and for every stage of it:
+    xml_parse        parsing of the SignalProcessingEvent
+    config_fetch     channel config and state reads, including the container cache
+    scte35_decode    threefive decode and indexing of the inbound SCTE35, the decoded cue cache lookup,
+                     or the header read for channels whose rules only test header fields
+    rule_evaluation  SCTE35 property index and rule evaluation
+    re_encode        encode of the replaced SCTE35
+    state_update     stateful lock writes
+    xml_serialize    rendering of the SignalProcessingNotification
+    other            everything else in the handler
+Stages and the request total are the processor's own, from the record it prints with STAGE_METRICS on, the
+processor code itself runs unmodified.
+
+With --codec, the replaced time_signal of each corpus cue is encoded by pois_scte35 and by threefive instead,
+the two are checked to be byte for byte identical and their encode times are reported.
+
+With --marshal, channel configs of 10, 300 and 3000 rules are stored as a DynamoDB map of every attribute
+(pois_dynamodb) and as a config_blob (pois_config), both are checked to load the config unchanged, and the
+write and load times and item sizes of each are reported next to the time the processor takes to compile the rules.
+
+With --cues, every class of cue from pois-scte35-corpus.py (or a corpus file written by it) is put through the
+processor's SCTE35 path: the header read, the threefive decode and property index, evaluation of a 300 rule set,
+the replace re-encode and a threefive re-encode of the decoded cue. The time of each is reported per class, and
+valid cues are checked to decode, to give the same header fields with the header read as with the full decode,
+and to get the same replaced cue from pois_scte35 and threefive. Whether threefive re-encodes each decoded cue to
+the same bytes, and what it does with the malformed classes, is reported as the outcomes of the class. With
+--compare, outcomes that differ from the baseline fail the run, as they do when a new threefive is dropped in.
+
+With --startup, esam-processor.py is loaded in fresh python processes with STARTUP_PROFILE on and -X importtime, and
+the median init time, the time of the modules it imports on demand and the slowest imports of the init and of the
+first request are reported. --startup-storage dynamodb (the default) times the boto3 client creation of the
+deployed function, without making a request.
+
+Usage:
+    python3 pois-benchmark.py --iterations 2000 --output results.json
+    python3 pois-benchmark.py --iterations 2000 --compare results.json
+    python3 pois-benchmark.py --iterations 2000 --codec
+    python3 pois-benchmark.py --iterations 2000 --marshal
+    python3 pois-benchmark.py --iterations 2000 --cues --output cues.json
+    python3 pois-benchmark.py --iterations 2000 --cues --corpus corpus.json --compare cues.json
+    python3 pois-benchmark.py --iterations 20 --startup
+'''
+
+import argparse
+import contextlib
+import copy
+import datetime
+import gc
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import xmltodict
+
+STAGES = ["xml_parse","config_fetch","scte35_decode","rule_evaluation","re_encode","state_update","xml_serialize","other"]
+
+# SCTE35 cues used by the corpus
+SPLICE_INSERT = "/DAlAAAAAsrYAP/wFAUAAAABf+/+ACjJaP4AFJlwAAEBAQAA/XeB3g=="
+TIME_SIGNAL = "/DA0AAAAAAAA///wBQb+cr0AUAAeAhxDVUVJSAAAjn/PAAGlmbAICAAAAAAsoKGKNAIAmsnRfg=="
+# time_signal with a Provider Advertisement Start (48) then a Provider Placement Opportunity Start (52) descriptor
+MULTI_DESCRIPTOR = "/DBWAAAAAAAA///wBQb+cr0AUABAAh5DVUVJSAAAkH/PAAGlmbAICAAAAAAsoKGKMAIAAAACHkNVRUlIAACOf88AAaWZsAgIAAAAACygoYo0AgAAAMurQo0="
+
+
+def large_rule_set(rule_count):
+    # rule_count rules where only the last one matches TIME_SIGNAL: equality, range and threshold rules that miss,
+    # then a segmentation_type_id 52 delete
+    rules = []
+    for i in range(0,rule_count - 1):
+        if i % 3 == 0:
+            rules.append({"type":"delete","condition":{"property":"segmentation_type_id","operator":"=","value":"%s" % (i % 48)}})
+        elif i % 3 == 1:
+            rules.append({"type":"delete","condition":{"property":"segmentation_duration","operator":"-","value":"%s-%s" % (1000 + i,1010 + i)}})
+        else:
+            rules.append({"type":"delete","condition":{"property":"segmentation_duration","operator":">","value":"%s" % (5000 + i)}})
+    rules.append({"type":"delete","condition":{"property":"segmentation_type_id","operator":"=","value":"52"}})
+    return rules
+
+
+SCENARIOS = [
+    {
+        "name":"splice_insert",
+        "description":"splice_insert, no rule matches, default behavior",
+        "cue":SPLICE_INSERT,
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"delete","condition":{"property":"segmentation_type_id","operator":"=","value":"52"}}]},
+        "action":"noop"
+    },
+    {
+        "name":"time_signal",
+        "description":"time_signal, no rule matches, default behavior",
+        "cue":TIME_SIGNAL,
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"delete","condition":{"property":"splice_command_type","operator":"=","value":"5"}}]},
+        "action":"noop"
+    },
+    {
+        "name":"multi_descriptor",
+        "description":"time_signal with two segmentation descriptors, rule matches the second one",
+        "cue":MULTI_DESCRIPTOR,
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"delete","condition":{"property":"segmentation_type_id","operator":"=","value":"52"}}]},
+        "action":"delete"
+    },
+    {
+        "name":"delete",
+        "description":"splice_insert deleted by the second rule",
+        "cue":SPLICE_INSERT,
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"delete","condition":{"property":"segmentation_type_id","operator":"=","value":"48"}},
+            {"type":"delete","condition":{"property":"splice_command_type","operator":"=","value":"5"}}]},
+        "action":"delete"
+    },
+    {
+        "name":"header_delete",
+        "description":"splice_insert deleted on splice_command_type, read from the header without a full decode",
+        "cue":SPLICE_INSERT,
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"delete","condition":{"property":"splice_command_type","operator":"=","value":"5"}}]},
+        "action":"delete"
+    },
+    {
+        "name":"replace",
+        "description":"time_signal segmentation_duration replaced and re-encoded",
+        "cue":TIME_SIGNAL,
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"replace","condition":{"property":"segmentation_type_id","operator":"=","value":"52"},
+             "replace_params":[{"segmentation_duration":"60"}]}]},
+        "action":"replace"
+    },
+    {
+        "name":"descriptor_priority",
+        "description":"no rule matches, descriptor_priority keeps the 52 descriptor and re-encodes",
+        "cue":MULTI_DESCRIPTOR,
+        "config":{"default_behavior":"noop","esam_version":"2013","descriptor_priority":"52,48","rules":[
+            {"type":"delete","condition":{"property":"splice_command_type","operator":"=","value":"5"}}]},
+        "action":"replace"
+    },
+    {
+        "name":"large_rule_set",
+        "description":"time_signal against 300 rules, only the last one matches",
+        "cue":TIME_SIGNAL,
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":large_rule_set(300)},
+        "action":"delete"
+    },
+    {
+        "name":"stateful_lock",
+        "description":"stateful channel locked by a previous signal, the signal is deleted",
+        "cue":TIME_SIGNAL,
+        "config":{"default_behavior":"noop","esam_version":"2013","mode":"stateful","rules":[
+            {"type":"replace","condition":{"property":"segmentation_type_id","operator":"=","value":"52"},
+             "replace_params":[{"segmentation_duration":"60"}]}]},
+        "locked":True,
+        "action":"delete"
+    },
+    {
+        "name":"stateful_retry",
+        "description":"stateful replace retried with the same acquisitionSignalID, answered from the decision cache",
+        "cue":TIME_SIGNAL,
+        "config":{"default_behavior":"noop","esam_version":"2013","mode":"stateful","rules":[
+            {"type":"replace","condition":{"property":"segmentation_type_id","operator":"=","value":"52"},
+             "replace_params":[{"segmentation_duration":"60"}]}]},
+        "retry":True,
+        "action":"replace"
+    }
+]
+
+
+def load_module(module_name,file_name):
+    # The Lambda sources have dashes in their file names, so load them by path
+    file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),file_name)
+    spec = importlib.util.spec_from_file_location(module_name,file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def spe_body(template,channel,cue):
+    # SignalProcessingEvent with one AcquiredSignal, the acquisitionSignalID is filled in per request
+    spe = copy.deepcopy(template)
+    acq_signal = spe['SignalProcessingEvent']['AcquiredSignal']
+    acq_signal['@acquisitionPointIdentity'] = channel
+    acq_signal['@acquisitionSignalID'] = "@@SIGNALID@@"
+    acq_signal['sig:BinaryData']['#text'] = cue
+    return xmltodict.unparse(spe)
+
+
+def percentile(sorted_values,p):
+    # nearest rank
+    if len(sorted_values) == 0:
+        return None
+    rank = max(1,int(round(p / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank,len(sorted_values)) - 1]
+
+
+def summarize(durations):
+    # durations in seconds, summary in milliseconds
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        "count":len(durations),
+        "mean_ms":round(total / len(durations) * 1000,4) if durations else None,
+        "p50_ms":round(percentile(durations,50) * 1000,4) if durations else None,
+        "p95_ms":round(percentile(durations,95) * 1000,4) if durations else None,
+        "p99_ms":round(percentile(durations,99) * 1000,4) if durations else None,
+        "throughput_per_s":round(len(durations) / total,1) if total > 0 else None
+    }
+
+
+def run_scenario(esam_processor,scenario,body,iterations,warmup):
+    request_durations = []
+    stage_durations = {stage:[] for stage in STAGES}
+    actions = dict()
+
+    for i in range(0,warmup + iterations):
+        # a retried signal is sent with the acquisitionSignalID of the first request every time
+        signal_id = scenario['name'] if scenario.get('retry') else "%s-%s" % (scenario['name'],i)
+        event = {"body":body.replace("@@SIGNALID@@",signal_id)}
+        # the stage metrics record is the last line the handler prints
+        stage_metrics = io.StringIO()
+        with contextlib.redirect_stdout(stage_metrics):
+            response = esam_processor.lambda_handler(event,None)
+
+        if i < warmup:
+            continue
+        record = json.loads(stage_metrics.getvalue().splitlines()[-1])
+
+        action = xmltodict.parse(response['body'])['SignalProcessingNotification']['ResponseSignal']['@action']
+        actions[action] = actions.get(action,0) + 1
+
+        request_durations.append(record['total'] / 1000.0)
+        for stage in STAGES:
+            if stage in record:
+                stage_durations[stage].append(record[stage] / 1000.0)
+
+    result = {
+        "description":scenario['description'],
+        "expected_action":scenario['action'],
+        "actions":actions,
+        "ok":list(actions.keys()) == [scenario['action']],
+        "request":summarize(request_durations),
+        "stages":dict()
+    }
+    for stage in STAGES:
+        if len(stage_durations[stage]) > 0:
+            result['stages'][stage] = summarize(stage_durations[stage])
+    return result
+
+
+def threefive_time_signal(threefive,fields):
+    # the same cue as pois_scte35.encode_time_signal(fields), built with the threefive object model
+    cue = threefive.Cue()
+    cmd = threefive.TimeSignal()
+    cmd.time_specified_flag = fields.pts_time_ticks is not None
+    if cmd.time_specified_flag:
+        cmd.pts_time_ticks = fields.pts_time_ticks
+        cmd.pts_time = fields.pts_time_ticks / 90000.0
+    cue.command = cmd
+    cue.info_section.pts_adjustment_ticks = fields.pts_adjustment_ticks
+    cue.info_section.cw_index = hex(fields.cw_index)
+    cue.info_section.tier = hex(fields.tier)
+
+    dscrptr = threefive.SegmentationDescriptor(None)
+    dscrptr.segmentation_event_id = hex(fields.segmentation_event_id)
+    dscrptr.segmentation_event_cancel_indicator = fields.segmentation_event_cancel_indicator
+    dscrptr.segmentation_event_id_compliance_indicator = fields.segmentation_event_id_compliance_indicator
+    dscrptr.program_segmentation_flag = True
+    dscrptr.segmentation_duration_flag = fields.segmentation_duration_ticks is not None
+    dscrptr.segmentation_duration_ticks = fields.segmentation_duration_ticks
+    dscrptr.delivery_not_restricted_flag = fields.delivery_not_restricted_flag
+    dscrptr.web_delivery_allowed_flag = fields.web_delivery_allowed_flag
+    dscrptr.no_regional_blackout_flag = fields.no_regional_blackout_flag
+    dscrptr.archive_allowed_flag = fields.archive_allowed_flag
+    dscrptr.device_restrictions = ["Restrict Group 0","Restrict Group 1","Restrict Group 2","No Restrictions"][fields.device_restrictions]
+    dscrptr.segmentation_upid_type = fields.segmentation_upid_type
+    dscrptr.segmentation_upid_length = len(fields.segmentation_upid)
+    dscrptr.segmentation_upid = fields.segmentation_upid.decode("utf-8")
+    dscrptr.segmentation_type_id = fields.segmentation_type_id
+    dscrptr.segment_num = fields.segment_num
+    dscrptr.segments_expected = fields.segments_expected
+    dscrptr.sub_segment_num = fields.sub_segment_num
+    dscrptr.sub_segments_expected = fields.sub_segments_expected
+    cue.descriptors.append(dscrptr)
+    return cue.encode()
+
+
+def run_codec(esam_processor,iterations,warmup):
+    # time_signal fields of each corpus cue the way the replace path builds them, encoded by both encoders
+    threefive = esam_processor.threefive
+    pois_scte35 = esam_processor.pois_scte35
+    results = dict()
+    for name,cue in (("splice_insert",SPLICE_INSERT),("time_signal",TIME_SIGNAL),("multi_descriptor",MULTI_DESCRIPTOR)):
+        scte_35_cue = threefive.Cue(cue)
+        scte_35_cue.decode()
+        scte_35_dict = scte_35_cue.get()
+        fields = esam_processor.replace_time_signal(scte_35_dict,esam_processor.scte35_duration(scte_35_dict))
+
+        native = pois_scte35.encode_time_signal(fields)
+        reference = threefive_time_signal(threefive,fields)
+        result = {"native":native,"threefive":reference,"ok":native == reference}
+
+        for encoder_name,encoder in (("native_encode",lambda: pois_scte35.encode_time_signal(fields)),("threefive_encode",lambda: threefive_time_signal(threefive,fields))):
+            durations = []
+            for i in range(0,warmup + iterations):
+                start = time.perf_counter()
+                encoder()
+                if i >= warmup:
+                    durations.append(time.perf_counter() - start)
+            result[encoder_name] = summarize(durations)
+        results[name] = result
+    return results
+
+
+def dynamodb_size(attribute_value):
+    # bytes DynamoDB counts for an attribute value, maps and lists cost 3 bytes plus 1 per element
+    value_type,value = next(iter(attribute_value.items()))
+    if value_type == "S":
+        return len(value.encode("utf-8"))
+    elif value_type == "N":
+        return len(value.strip("-").replace(".","")) // 2 + 1
+    elif value_type == "B":
+        return len(value)
+    elif value_type == "M":
+        return 3 + sum(len(k.encode("utf-8")) + dynamodb_size(v) + 1 for k,v in value.items())
+    elif value_type == "L":
+        return 3 + sum(dynamodb_size(v) + 1 for v in value)
+    return 1
+
+
+def run_marshal(esam_processor,iterations,warmup):
+    # Channel configs the size of large deployments, stored the way the control API stores them (config_blob)
+    # and as the DynamoDB map of every attribute used before it. Iterations are scaled down with the rule count
+    # so the 3000 rule config runs a tenth of the 300 rule one
+    pois_config = esam_processor.pois_config
+    pois_dynamodb = pois_config.pois_dynamodb
+    results = dict()
+    for rule_count in (10,300,3000):
+        rules = large_rule_set(rule_count)
+        for rule in rules[::10]:
+            rule['type'] = "replace"
+            rule['replace_params'] = [{"segmentation_duration":"60"},{"segmentation_upid":"1"}]
+        channel_config = {"channelid":"benchmark-marshal","default_behavior":"noop","esam_version":"2013","mode":"stateful",
+                          "config_version":"20240101000000000000","rules":rules}
+        attributes_item = pois_dynamodb.to_dynamodb_item(channel_config)
+        blob_item = {"channelid":{"S":"benchmark-marshal"},"config_version":{"S":"20240101000000000000"},"config_blob":{"B":pois_config.encode_config(channel_config)}}
+        normalized_rules = pois_config.normalize_rules(channel_config)
+        result = {
+            "rules":rule_count,
+            "ok":pois_dynamodb.from_dynamodb_item(attributes_item) == channel_config and pois_config.config_from_item(blob_item) == (channel_config,normalized_rules),
+            "attributes_item_bytes":dynamodb_size({"M":attributes_item}),
+            "blob_item_bytes":dynamodb_size({"M":blob_item})
+        }
+
+        def load_attributes():
+            channel_config,normalized_rules = pois_config.config_from_item(attributes_item)
+            pois_config.normalize_rules(channel_config)
+
+        def compile_config():
+            esam_processor.RuleIndex(esam_processor.compile_rules(normalized_rules))
+
+        count = max(20,iterations * 30 // rule_count)
+        for step_name,step in (("to_dynamodb",lambda: pois_dynamodb.to_dynamodb_item(channel_config)),
+                               ("load_attributes",load_attributes),
+                               ("encode_config",lambda: pois_config.encode_config(channel_config)),
+                               ("load_blob",lambda: pois_config.config_from_item(blob_item)),
+                               ("compile_rules",compile_config)):
+            durations = []
+            for i in range(0,min(warmup,count) + count):
+                start = time.perf_counter()
+                step()
+                if i >= min(warmup,count):
+                    durations.append(time.perf_counter() - start)
+            result[step_name] = summarize(durations)
+        results["rules_%s" % (rule_count)] = result
+    return results
+
+
+def print_marshal_results(results):
+    print("%-12s %6s %14s %12s %16s %12s %14s %12s %14s" % ("config","ok","to_dynamodb ms","load_attr ms","encode_config ms","load_blob ms","compile_rules ms","attr bytes","blob bytes"))
+    for name,result in results.items():
+        print("%-12s %6s %14.3f %12.3f %16.3f %12.3f %14.3f %12s %14s" % (name,result['ok'],result['to_dynamodb']['p50_ms'],result['load_attributes']['p50_ms'],
+            result['encode_config']['p50_ms'],result['load_blob']['p50_ms'],result['compile_rules']['p50_ms'],result['attributes_item_bytes'],result['blob_item_bytes']))
+
+
+CUE_STEPS = ["header_read","decode","rule_evaluation","re_encode","threefive_encode"]
+
+
+def check_cue(esam_processor,threefive,cue):
+    # Returns (outcome, problems) of one corpus cue, the outcome is what the decoder made of it
+    problems = []
+    try:
+        scte_35_cue = threefive.Cue(cue)
+        scte_35_cue.decode()
+        scte_35_dict = scte_35_cue.get()
+    except Exception as e:
+        return "decode_error",["decode %s: %s" % (type(e).__name__,e)]
+
+    try:
+        round_trip = scte_35_cue.encode() == cue
+    except Exception as e:
+        return "encode_error",["threefive encode %s: %s" % (type(e).__name__,e)]
+
+    header_index = esam_processor.scte35_header_index(cue)
+    property_index = esam_processor.scte_property_index(scte_35_dict)
+    if header_index is None:
+        problems.append("header read failed")
+    else:
+        for property_key,values in header_index.items():
+            if property_index.get(property_key,values[:1])[:1] != values:
+                problems.append("header read %s %r, decode %r" % (property_key,values,property_index.get(property_key)))
+
+    try:
+        fields = esam_processor.replace_time_signal(scte_35_dict,esam_processor.scte35_duration(scte_35_dict))
+        if esam_processor.pois_scte35.encode_time_signal(fields) != threefive_time_signal(threefive,fields):
+            problems.append("pois_scte35 and threefive replaced cues differ")
+    except Exception as e:
+        problems.append("replace encode %s: %s" % (type(e).__name__,e))
+
+    return "round_trip" if round_trip else "re_encode_differs",problems
+
+
+def run_cues(esam_processor,corpus,iterations,warmup):
+    # Times every step of the SCTE35 path on the cues of each class, in turn, iterations times. The decoded cue
+    # cache is off (--scte35-cache-size 0) so decode is timed on every call
+    threefive = esam_processor.threefive
+    pois_config = esam_processor.pois_config
+    rule_index = esam_processor.RuleIndex(esam_processor.compile_rules(pois_config.normalize_rules({"rules":large_rule_set(300)})))
+    stage_timer = esam_processor.StageTimer(False)
+
+    classes = dict()
+    for corpus_cue in corpus:
+        classes.setdefault(corpus_cue['class'],{"valid":corpus_cue['valid'],"cues":[]})['cues'].append(corpus_cue['cue'])
+
+    results = dict()
+    for class_name,cue_class in classes.items():
+        result = {"cues":len(cue_class['cues']),"valid":cue_class['valid'],"outcomes":dict(),"problems":[]}
+        decoded = []
+        for cue in cue_class['cues']:
+            outcome,problems = check_cue(esam_processor,threefive,cue)
+            result['outcomes'][outcome] = result['outcomes'].get(outcome,0) + 1
+            result['problems'].extend(problems[:1])
+            if outcome in ("round_trip","re_encode_differs"):
+                scte_35_cue = threefive.Cue(cue)
+                scte_35_cue.decode()
+                scte_35_dict = scte_35_cue.get()
+                decoded.append((cue,scte_35_cue,scte_35_dict,esam_processor.scte_property_index(scte_35_dict)))
+        # a valid cue threefive re-encodes differently is reported in the outcomes, ie. 2.4.35 reads UUID UPIDs as
+        # text and loses their bytes. Malformed cues only have to behave the same as in the baseline
+        result['ok'] = not cue_class['valid'] or (len(decoded) == len(cue_class['cues']) and len(result['problems']) == 0)
+
+        def decode(cue):
+            try:
+                esam_processor.scte35_decode(cue,stage_timer)
+            except Exception:
+                pass
+
+        steps = {
+            "header_read":(cue_class['cues'],esam_processor.scte35_header_index),
+            "decode":(cue_class['cues'],decode),
+            "rule_evaluation":(decoded,lambda d: rule_index.match(d[3])),
+            "re_encode":(decoded,lambda d: esam_processor.pois_scte35.encode_time_signal(esam_processor.replace_time_signal(d[2],esam_processor.scte35_duration(d[2])))),
+            "threefive_encode":(decoded,lambda d: d[1].encode())
+        }
+        for step_name in CUE_STEPS:
+            step_inputs,step = steps[step_name]
+            if len(step_inputs) == 0:
+                continue
+            durations = []
+            for i in range(0,warmup + iterations):
+                step_input = step_inputs[i % len(step_inputs)]
+                start = time.perf_counter()
+                step(step_input)
+                if i >= warmup:
+                    durations.append(time.perf_counter() - start)
+            result[step_name] = summarize(durations)
+        results[class_name] = result
+    return results
+
+
+def print_cues_results(results,baseline=None):
+    print("%-30s %6s %12s %12s %12s %12s %12s %12s" % ("cue class","ok","header ms","decode ms","rules ms","re_encode ms","3five enc ms","decodes/s"))
+    for class_name,result in results.items():
+        p50 = ["%12.4f" % (result[step]['p50_ms']) if step in result else "%12s" % ("-") for step in CUE_STEPS]
+        decodes = result['decode']['throughput_per_s'] if 'decode' in result else None
+        print("%-30s %6s %s %12s" % (class_name,result['ok']," ".join(p50),decodes))
+        if result['outcomes'] != {"round_trip":result['cues']} or len(result['problems']) > 0:
+            print("%-30s %6s outcomes %s %s" % ("","",result['outcomes'],"; ".join(result['problems'][:3])))
+        if baseline is not None and class_name in baseline.get('cues',{}):
+            old = baseline['cues'][class_name]
+            changes = ["%+11.1f%%" % ((result[step]['p50_ms'] / old[step]['p50_ms'] - 1) * 100) if step in result and step in old else "%12s" % ("-") for step in CUE_STEPS]
+            print("%-30s %6s %s" % ("  vs baseline","",
+                " ".join(changes)))
+            if old['outcomes'] != result['outcomes']:
+                print("%-30s %6s outcomes were %s" % ("","",old['outcomes']))
+
+
+# Loads the processor the way the Lambda runtime does, in a new process. The modules it imports on demand are then
+# loaded the way the first request that needs them would. json isn't imported here so its import is timed.
+# The markers split the -X importtime output into the init and the on demand imports
+STARTUP_SCRIPT = """
+import importlib.util,os,sys
+sys.path.insert(0,%(directory)r)
+spec = importlib.util.spec_from_file_location("esam_processor",%(path)r)
+esam_processor = importlib.util.module_from_spec(spec)
+sys.stderr.write("esam-processor init\\n")
+sys.stderr.flush()
+spec.loader.exec_module(esam_processor)
+sys.stderr.write("esam-processor lazy imports\\n")
+sys.stderr.flush()
+esam_processor.threefive.Cue
+esam_processor.xmltodict.parse
+"""
+
+
+def import_times(lines):
+    # "import time: self [us] | cumulative | name", nested imports are indented, only the top level ones count
+    imports = dict()
+    for line in lines:
+        fields = line.split("|")
+        if line.startswith("import time:") and len(fields) == 3 and fields[2].startswith(" ") and not fields[2].startswith("  "):
+            imports[fields[2].strip()] = int(fields[1]) / 1000.0
+    return imports
+
+
+def run_startup(runs,storage_type):
+    # With dynamodb storage the storage figure is the boto3 import and client creation the deployed function
+    # pays, no request is made so no credentials are needed
+    directory = os.path.dirname(os.path.abspath(__file__))
+    script = STARTUP_SCRIPT % {"directory":directory,"path":os.path.join(directory,"esam-processor.py")}
+    environment = dict(os.environ,STARTUP_PROFILE="true",POIS_STORAGE=storage_type)
+    environment.setdefault('CHANNELDB','POIS-channels-benchmark')
+    environment.setdefault('SCHEDULEDB','POIS-schedules-benchmark')
+    environment.setdefault('STATEDB','POIS-state-benchmark')
+    if storage_type == "dynamodb" and "AWS_REGION" not in environment:
+        environment.setdefault('AWS_DEFAULT_REGION','us-east-1')
+
+    profiles = dict()
+    imports = {"init":dict(),"lazy":dict()}
+    for run in range(0,runs):
+        process = subprocess.run([sys.executable,"-X","importtime","-c",script],env=environment,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        stderr_lines = process.stderr.decode("utf-8").splitlines()
+        if process.returncode != 0:
+            raise Exception("esam-processor.py failed to load with %s storage: %s" % (storage_type,"\n".join(line for line in stderr_lines if not line.startswith("import time:"))[-2000:]))
+
+        for line in process.stdout.decode("utf-8").splitlines():
+            record = json.loads(line) if line.startswith("{") else dict()
+            for name,duration_ms in record.items():
+                if name != "startup":
+                    profiles.setdefault("%s %s" % (record['startup'],name),[]).append(duration_ms)
+
+        init_start = stderr_lines.index("esam-processor init") + 1
+        lazy_start = stderr_lines.index("esam-processor lazy imports") + 1
+        for phase,phase_lines in (("init",stderr_lines[init_start:lazy_start - 1]),("lazy",stderr_lines[lazy_start:])):
+            for name,duration_ms in import_times(phase_lines).items():
+                imports[phase].setdefault(name,[]).append(duration_ms)
+
+    median = lambda durations: sorted(durations)[len(durations) // 2]
+    return {
+        "runs":runs,
+        "storage":storage_type,
+        "profile":{name:median(durations) for name,durations in profiles.items()},
+        "imports":{name:median(durations) for name,durations in sorted(imports['init'].items(),key=lambda i: median(i[1]),reverse=True)},
+        "lazy_imports":{name:median(durations) for name,durations in sorted(imports['lazy'].items(),key=lambda i: median(i[1]),reverse=True)}
+    }
+
+
+def print_startup_results(results,import_count=10):
+    print("median of %s processes with %s storage, ms" % (results['runs'],results['storage']))
+    for name,duration_ms in results['profile'].items():
+        if name == "init storage":
+            name = "init storage (%s)" % (results['storage'])
+        print("  %-28s %10.2f" % (name,duration_ms))
+    print("slowest imports of the esam-processor.py init, cumulative ms")
+    for name,duration_ms in list(results['imports'].items())[:import_count]:
+        print("  %-28s %10.2f" % (name,duration_ms))
+    print("imports on the first request that needs them, cumulative ms")
+    for name,duration_ms in list(results['lazy_imports'].items())[:import_count]:
+        print("  %-28s %10.2f" % (name,duration_ms))
+
+
+def print_codec_results(results):
+    print("%-20s %8s %16s %16s %10s" % ("cue","ok","native p50 ms","threefive p50 ms","speedup"))
+    for name,result in results.items():
+        native = result['native_encode']['p50_ms']
+        reference = result['threefive_encode']['p50_ms']
+        print("%-20s %8s %16.4f %16.4f %9.1fx" % (name,result['ok'],native,reference,reference / native))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git","rev-parse","HEAD"],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except Exception:
+        return None
+
+
+def print_results(results,baseline=None):
+    print("%-20s %8s %10s %10s %10s %12s  %s" % ("scenario","ok","p50 ms","p95 ms","p99 ms","req/s","slowest stages (p50 ms)"))
+    for name,result in results['scenarios'].items():
+        request = result['request']
+        stages = sorted(result['stages'].items(),key=lambda s: s[1]['p50_ms'],reverse=True)[:3]
+        print("%-20s %8s %10.3f %10.3f %10.3f %12.1f  %s" % (name,result['ok'],request['p50_ms'],request['p95_ms'],request['p99_ms'],request['throughput_per_s'],
+                                                       ", ".join("%s %.3f" % (stage,summary['p50_ms']) for stage,summary in stages)))
+        if baseline is not None and name in baseline['scenarios']:
+            old = baseline['scenarios'][name]['request']
+            print("%-20s %8s %+9.1f%% %+9.1f%% %+9.1f%% %+11.1f%%" % ("  vs baseline","",
+                (request['p50_ms'] / old['p50_ms'] - 1) * 100,(request['p95_ms'] / old['p95_ms'] - 1) * 100,
+                (request['p99_ms'] / old['p99_ms'] - 1) * 100,(request['throughput_per_s'] / old['throughput_per_s'] - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESAM decision path latency benchmark")
+    parser.add_argument("--iterations",type=int,default=2000,help="timed requests per scenario")
+    parser.add_argument("--warmup",type=int,default=200,help="untimed requests per scenario before timing")
+    parser.add_argument("--scenario",action="append",help="only run this scenario, can be repeated")
+    parser.add_argument("--storage",default="memory",choices=["memory","sqlite"],help="storage backend for channel config and state")
+    parser.add_argument("--cache-ttl",default="5",help="CHANNEL_CACHE_TTL of the processor, 0 reads the channel config on every request")
+    parser.add_argument("--scte35-cache-size",default="0",help="SCTE35_CACHE_SIZE of the processor, every request of a scenario sends the same cue so by default the cache is off")
+    parser.add_argument("--codec",action="store_true",help="compare the replace time_signal encoder with threefive instead of running the scenarios")
+    parser.add_argument("--marshal",action="store_true",help="time the DynamoDB JSON conversion of large channel configs instead of running the scenarios")
+    parser.add_argument("--cues",action="store_true",help="time and check the SCTE35 path on a corpus of cue classes instead of running the scenarios")
+    parser.add_argument("--corpus",help="corpus JSON written by pois-scte35-corpus.py for --cues, generated with its defaults if not set")
+    parser.add_argument("--startup",action="store_true",help="profile the init of the processor in --iterations fresh processes instead of running the scenarios")
+    parser.add_argument("--startup-storage",default="dynamodb",choices=["dynamodb","memory"],help="storage backend the processor is loaded with for --startup")
+    parser.add_argument("--output",help="write the results to this JSON file")
+    parser.add_argument("--compare",help="results JSON of an earlier run to compare with")
+    parser.add_argument("--log-level",default="WARNING",help="python logging level, the Lambda handlers log every request at INFO")
+    args = parser.parse_args()
+
+    if args.startup:
+        try:
+            startup_results = run_startup(args.iterations,args.startup_storage)
+        except Exception as e:
+            print(e)
+            return 1
+        print_startup_results(startup_results)
+        if args.output:
+            with open(args.output,"w") as output_file:
+                json.dump({"metadata":{"git_commit":git_commit(),"python":platform.python_version()},"startup":startup_results},output_file,indent=2)
+        return 0
+
+    sqlite_dir = tempfile.TemporaryDirectory()
+    os.environ['POIS_STORAGE'] = args.storage
+    os.environ['POIS_SQLITE_PATH'] = os.path.join(sqlite_dir.name,"pois.db")
+    os.environ['CHANNEL_CACHE_TTL'] = args.cache_ttl
+    os.environ['SCTE35_CACHE_SIZE'] = args.scte35_cache_size
+    # the scenarios are timed by the processor's own stage metrics
+    os.environ['STAGE_METRICS'] = "true"
+    os.environ.setdefault('CHANNELDB','POIS-channels-benchmark')
+    os.environ.setdefault('SCHEDULEDB','POIS-schedules-benchmark')
+    os.environ.setdefault('STATEDB','POIS-state-benchmark')
+
+    esam_processor = load_module("esam_processor","esam-processor.py")
+    pois_control = load_module("pois_control","pois-control.py")
+    # the handlers set the root logger to INFO at import
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    if args.codec:
+        codec_results = run_codec(esam_processor,args.iterations,args.warmup)
+        print_codec_results(codec_results)
+        if args.output:
+            with open(args.output,"w") as output_file:
+                json.dump({"metadata":{"git_commit":git_commit(),"python":platform.python_version(),"iterations":args.iterations},"codec":codec_results},output_file,indent=2)
+        # an encoder mismatch fails the run
+        if not all(result['ok'] for result in codec_results.values()):
+            return 1
+        return 0
+
+    if args.marshal:
+        marshal_results = run_marshal(esam_processor,args.iterations,args.warmup)
+        print_marshal_results(marshal_results)
+        if args.output:
+            with open(args.output,"w") as output_file:
+                json.dump({"metadata":{"git_commit":git_commit(),"python":platform.python_version(),"iterations":args.iterations},"marshal":marshal_results},output_file,indent=2)
+        if not all(result['ok'] for result in marshal_results.values()):
+            return 1
+        return 0
+
+    if args.cues:
+        if args.corpus:
+            with open(args.corpus) as corpus_file:
+                corpus = json.load(corpus_file)['cues']
+        else:
+            corpus = load_module("pois_scte35_corpus","pois-scte35-corpus.py").generate_corpus()
+        cues_results = run_cues(esam_processor,corpus,args.iterations,args.warmup)
+        baseline = None
+        if args.compare:
+            with open(args.compare) as baseline_file:
+                baseline = json.load(baseline_file)
+        print_cues_results(cues_results,baseline)
+        if args.output:
+            threefive_version = getattr(esam_processor.threefive,"version",None)
+            with open(args.output,"w") as output_file:
+                json.dump({"metadata":{"git_commit":git_commit(),"python":platform.python_version(),"iterations":args.iterations,
+                                       "threefive":threefive_version() if callable(threefive_version) else threefive_version,"corpus":args.corpus},
+                           "cues":cues_results},output_file,indent=2)
+        # a valid cue that doesn't decode, round trip or re-encode the same fails the run, and so does a malformed
+        # cue the decoder now handles differently from the baseline
+        if not all(result['ok'] for result in cues_results.values()):
+            return 1
+        if baseline is not None and any(result['outcomes'] != baseline.get('cues',{}).get(class_name,result)['outcomes'] for class_name,result in cues_results.items()):
+            return 1
+        return 0
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"spe.json")) as spe_file:
+        template = json.load(spe_file)
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s['name'] in args.scenario]
+    results = {
+        "metadata":{
+            "timestamp":datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "git_commit":git_commit(),
+            "python":platform.python_version(),
+            "platform":platform.platform(),
+            "threefive":getattr(esam_processor.threefive,"version",None),
+            "xmltodict":getattr(xmltodict,"__version__",None),
+            "iterations":args.iterations,
+            "warmup":args.warmup,
+            "storage":args.storage,
+            "cache_ttl":args.cache_ttl,
+            "scte35_cache_size":args.scte35_cache_size
+        },
+        "scenarios":dict()
+    }
+    if callable(results['metadata']['threefive']):
+        results['metadata']['threefive'] = results['metadata']['threefive']()
+
+    for scenario in scenarios:
+        channel = "benchmark-%s" % (scenario['name'])
+        response = pois_control.lambda_handler({"httpMethod":"PUT","path":"/pois/channels/%s" % (channel),"body":json.dumps(scenario['config'])},None)
+        if response['statusCode'] != 200:
+            raise Exception("Unable to configure channel %s: %s" % (channel,response['body']))
+        if scenario.get('locked'):
+            expiry_time = int(datetime.datetime.utcnow().timestamp()) + 86400
+            esam_processor.STORAGE.put_item(os.environ['STATEDB'],esam_processor.pois_storage.lock_item(channel,expiry_time))
+
+        body = spe_body(template,channel,scenario['cue'])
+        gc.collect()
+        results['scenarios'][scenario['name']] = run_scenario(esam_processor,scenario,body,args.iterations,args.warmup)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results,baseline)
+
+    if args.output:
+        with open(args.output,"w") as output_file:
+            json.dump(results,output_file,indent=2)
+
+    # a scenario that didn't return its expected action measured the wrong code path
+    if not all(result['ok'] for result in results['scenarios'].values()):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,207 +1,458 @@
+import base64
+import binascii
 import json
-import boto3
 import datetime
 import logging
-import math
 import os
-import xmltodict
-
+import pois_config
+import pois_dynamodb
+import pois_storage
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 '''
 GET
 ../channels/get = get all channels
+../channels?limit=100&next=token = get one page of channels, the response has the token of the next page
+../channels?fields=channelid,mode = only return these attributes
+../channels?segments=4 = read all channels with a parallel scan of 4 segments
 ../channels/channel1 = get specific channel
 
 PUT
 ../channels/create/channel1
 ../channels/update/channel
+../channels = create or update a list of channels, same format as the GET ../channels response
 
 DELETE
 ../channels/delete/channel1
 '''
 
+# Storage backend (DynamoDB unless POIS_STORAGE says otherwise), created once per container and reused by every invocation
+STORAGE = pois_storage.storage_from_environment(connect_timeout=2,read_timeout=5)
+
+# Databases
+CHANNELDB = os.environ['CHANNELDB']
+SCHEDULEDB = os.environ['SCHEDULEDB']
+
+# GET /pois/channels paging and parallel scan limits, segments run on one thread each and share the
+# DynamoDB client connection pool (DYNAMODB_MAX_POOL_CONNECTIONS, 10 by default)
+CHANNEL_LIST_MAX_LIMIT = 1000
+CHANNEL_LIST_MAX_SEGMENTS = 8
+
+# Channels accepted by one bulk PUT /pois/channels
+CHANNEL_BULK_MAX = 1000
+
+# Top level attributes channelItem writes for every channel, a GET /pois/channels?fields= of only these doesn't
+# read config_blob. Rules, descriptor_priority and anything else come out of config_blob
+CHANNEL_SCALAR_ATTRIBUTES = ["channelid","config_version","default_behavior","esam_version","mode"]
+
+# Properties supported for SCTE35 binary replace
+threefive_scte_format = dict()
+threefive_scte_format['info_section'] = {
+    'table_id':'int',
+    'section_syntax_indicator':'bool',
+    'private':'bool',
+    'sap_type':'int',
+    'sap_details':'',
+    'protocol_version':'int',
+    'pts_adjustment':'float',
+    'splice_command_type':'int'
+}
+threefive_scte_format['command'] = {
+    'command_type':'int',
+    'time_specified_flag':'bool',
+    'pts_time':'float',
+    'break_auto_return':'bool',
+    'break_duration':'float',
+    'splice_event_id':'int',
+    'splice_event_cancel_indicator':'',
+    'out_of_network_indicator':'bool',
+    'program_splice_flag':'bool',
+    'duration_flag':'bool',
+    'splice_immediate_flag':'bool',
+    'unique_program_id':'int',
+    'avail_num':'int',
+    'avail_expected':'int'
+}
+threefive_scte_format['descriptors'] = {
+    'tag':'int',
+    'name':'str',
+    'segmentation_message':'str',
+    'segmentation_upid_type_name':'str',
+    'segmentation_upid_length':'int',
+    'sub_segment_num':'int',
+    'sub_segments_expected':'int',
+    'descriptor_length':'int',
+    'identifier':'str',
+    'segmentation_event_id':'int',
+    'segmentation_duration':'int',
+    'segmentation_duration_raw':'int',
+    'segmentation_event_cancel_indicator':'bool',
+    'program_segmentation_flag':'bool',
+    'segmentation_duration_flag':'bool',
+    'delivery_not_restricted_flag':'bool',
+    'web_delivery_allowed_flag':'bool',
+    'no_regional_blackout_flag':'bool',
+    'archive_allowed_flag':'bool',
+    'device_restrictions':'int',
+    'segmentation_upid_type':'int',
+    'segmentation_upid':'int',
+    'segmentation_type_id':'int',
+    'segment_num':'int',
+    'segments_expected':'int',
+    'provider_avail_id':'int'
+}
+
+# every property a rule condition or replace_param can reference
+VALID_PROPERTIES = []
+for property_header in threefive_scte_format:
+    for property_key in threefive_scte_format[property_header]:
+        VALID_PROPERTIES.append(property_key)
+VALID_PROPERTIES = tuple(VALID_PROPERTIES)
+VALID_PROPERTY_SET = frozenset(VALID_PROPERTIES)
+
+
+# Response Structure
+def clientResponse(status_code,response_message):
+    response_json = {
+        'statusCode': status_code,
+        "headers": {
+            "Content-Type": "application/json",
+        },
+        'body': json.dumps(response_message)
+    }
+    return response_json
+
+
+# DynamoDB Get Item
+def dbGetSingleChannelInfo(storage,channeldb,channel,exceptions):
+    LOGGER.debug("Doing a call to storage to get channel information for channel : %s" % (channel))
+    try:
+        item = storage.get_item(channeldb,channel)
+    except Exception as e:
+        exceptions.append("Unable to get item from storage, got exception:  %s" % (str(e).upper()))
+        return exceptions
+    if item is None:
+        return {}
+    return {"Item":item}
+
+
+# DynamoDB Scan DB // get all items
+def dbGetAllChannelInfo(storage,channeldb,exceptions,attributes=None,segments=1):
+    LOGGER.debug("Doing a call to storage to get all channels")
+    try:
+        if segments > 1:
+            items = storage.scan_segments(channeldb,segments,attributes)
+        else:
+            items = storage.scan(channeldb,attributes)
+    except Exception as e:
+        exceptions.append("error getting channel list from storage, got exception: %s" %  (e))
+        return exceptions
+    return items
+
+
+# DynamoDB Scan DB // get one page of items
+def dbGetChannelPage(storage,channeldb,limit,start_channel,exceptions,attributes=None):
+    LOGGER.debug("Doing a call to storage to get up to %s channels after : %s" % (limit,start_channel))
+    try:
+        items,next_channel = storage.scan_page(channeldb,attributes,limit,start_channel)
+    except Exception as e:
+        exceptions.append("error getting channel list from storage, got exception: %s" %  (e))
+        return exceptions
+    return items,next_channel
+
+
+# The next token is the channelid to continue after, base64 so any channel name is safe in a query string
+def encodePageToken(channel):
+    if channel is None:
+        return None
+    return base64.urlsafe_b64encode(channel.encode("utf-8")).decode("ascii")
+
+
+def decodePageToken(token):
+    try:
+        channel = base64.b64decode(token.encode("ascii"),altchars=b"-_",validate=True).decode("utf-8")
+    except (binascii.Error,UnicodeError,ValueError):
+        return None
+    if len(channel) == 0:
+        return None
+    return channel
+
+
+def channelListParameters(query_string_parameters):
+    # Returns (attributes, limit, start_channel, segments, error) from the GET /pois/channels query string
+    attributes = None
+    limit = None
+    start_channel = None
+    segments = 1
+
+    if "fields" in query_string_parameters:
+        # channelid is always returned so the results can be matched to channels
+        attributes = ["channelid"]
+        for field in query_string_parameters['fields'].split(","):
+            field = field.strip()
+            if len(field) > 0 and field not in attributes:
+                attributes.append(field)
+
+    if "limit" in query_string_parameters:
+        try:
+            limit = int(query_string_parameters['limit'])
+        except ValueError:
+            limit = 0
+        if limit < 1 or limit > CHANNEL_LIST_MAX_LIMIT:
+            return None,None,None,None,"limit must be a number from 1 to %s" % (CHANNEL_LIST_MAX_LIMIT)
+
+    if "next" in query_string_parameters:
+        start_channel = decodePageToken(query_string_parameters['next'])
+        if start_channel is None:
+            return None,None,None,None,"next is not a token returned by this api"
+        if limit is None:
+            limit = CHANNEL_LIST_MAX_LIMIT
+
+    if "segments" in query_string_parameters:
+        if limit is not None:
+            return None,None,None,None,"segments reads every channel and can't be combined with limit or next"
+        try:
+            segments = int(query_string_parameters['segments'])
+        except ValueError:
+            segments = 0
+        if segments < 1 or segments > CHANNEL_LIST_MAX_SEGMENTS:
+            return None,None,None,None,"segments must be a number from 1 to %s" % (CHANNEL_LIST_MAX_SEGMENTS)
 
-def lambda_handler(event, context):
-    LOGGER.info(event)
+    return attributes,limit,start_channel,segments,None
 
 
-    # initialize BOTO3 Client for Dynamodb
-    db_client = boto3.client('dynamodb')
+# DynamoDB Put Item // Create and update item
+def dbCreateUpdateSingleChannel(storage,channeldb,item,channel,exceptions):
+    LOGGER.debug("Doing a call to storage to create/update channel information for channel : %s" % (channel))
+    try:
+        response = storage.put_item(channeldb,item)
+    except Exception as e:
+        exceptions.append("Unable to create/update item in storage, got exception:  %s" % (str(e).upper()))
+        return exceptions
+    return response
 
-    # Databases
-    channeldb = os.environ['CHANNELDB']
-    scheduledb = os.environ['SCHEDULEDB']
 
-    # initialize a list to capture exceptions
-    exceptions = []
-    exceptions.clear()
+# DynamoDB Batch Write // Create and update many items
+def dbCreateUpdateChannels(storage,channeldb,items,exceptions):
+    LOGGER.debug("Doing a call to storage to create/update %s channels" % (len(items)))
+    try:
+        failed_items = storage.batch_put_items(channeldb,items)
+    except Exception as e:
+        exceptions.append("Unable to create/update items in storage, got exception:  %s" % (str(e).upper()))
+        return exceptions
+    return failed_items
 
-    # Properties supported for SCTE35 binary replace
-    threefive_scte_format = dict()
-    threefive_scte_format['info_section'] = {
-        'table_id':'int',
-        'section_syntax_indicator':'bool',
-        'private':'bool',
-        'sap_type':'int',
-        'sap_details':'',
-        'protocol_version':'int',
-        'pts_adjustment':'float',
-        'splice_command_type':'int'
-    }
-    threefive_scte_format['command'] = {
-        'command_type':'int',
-        'time_specified_flag':'bool',
-        'pts_time':'float',
-        'break_auto_return':'bool',
-        'break_duration':'float',
-        'splice_event_id':'int',
-        'splice_event_cancel_indicator':'',
-        'out_of_network_indicator':'bool',
-        'program_splice_flag':'bool',
-        'duration_flag':'bool',
-        'splice_immediate_flag':'bool',
-        'unique_program_id':'int',
-        'avail_num':'int',
-        'avail_expected':'int'
-    }
-    threefive_scte_format['descriptors'] = {
-        'tag':'int',
-        'name':'str',
-        'segmentation_message':'str',
-        'segmentation_upid_type_name':'str',
-        'segmentation_upid_length':'int',
-        'sub_segment_num':'int',
-        'sub_segments_expected':'int',
-        'descriptor_length':'int',
-        'identifier':'str',
-        'segmentation_event_id':'int',
-        'segmentation_duration':'int',
-        'segmentation_duration_raw':'int',
-        'segmentation_event_cancel_indicator':'bool',
-        'program_segmentation_flag':'bool',
-        'segmentation_duration_flag':'bool',
-        'delivery_not_restricted_flag':'bool',
-        'web_delivery_allowed_flag':'bool',
-        'no_regional_blackout_flag':'bool',
-        'archive_allowed_flag':'bool',
-        'device_restrictions':'int',
-        'segmentation_upid_type':'int',
-        'segmentation_upid':'int',
-        'segmentation_type_id':'int',
-        'segment_num':'int',
-        'segments_expected':'int',
-        'provider_avail_id':'int'
-    }
 
-    def dict_path(dicttopopulate,my_dict):
-        for k,v in my_dict.items():
+# DynamoDB Delete Item
+def dbDeleteSingleChannel(storage,channeldb,channel,exceptions):
+    LOGGER.debug("Doing a call to storage to delete channel record : %s" % (channel))
+    try:
+        response = storage.delete_item(channeldb,channel)
+    except Exception as e:
+        exceptions.append("Unable to delete item from storage, got exception:  %s" % (str(e).upper()))
+        return exceptions
+    return response
 
-            value_type = list(my_dict[k].keys())[0]
 
-            if value_type == "M":
-                value = my_dict[k][value_type]
+# Channel config validation, returns the error response body or None if the config is valid
+def validateChannelConfig(payload):
+    if not isinstance(payload,dict):
+        return {"status":"malformed request body, channel configuration must be a json object"}
 
-                for i in range(0,len(value)):
-                    dynamodb_item_m = dict()
-                    dict_path(dynamodb_item_m,value)
-                    v = dynamodb_item_m
+    # check required top level keys first
+    required_keys = ["default_behavior","esam_version"]
 
-                value.update(dynamodb_item_m)
-                dicttopopulate.update({k:value})
+    for rkey in required_keys:
+        if rkey not in list(payload.keys()):
+            return {"status":"malformed request body, please refer to the template: required keys - default_behavior,esam_version"}
 
-            elif value_type == "S":
-                value = my_dict[k][value_type]
-                dicttopopulate.update({k:value})
+    default_behaviors = ["noop","delete"]
 
-            elif value_type == "L": # list
-                value = my_dict[k][value_type]
+    if payload['default_behavior'] not in default_behaviors:
+        return {"status":"default_behavior value must be one of - noop , delete"}
 
-                for i in range(0,len(value)):
-                    dynamodb_item_list = dict()
-                    dict_path(dynamodb_item_list,value[i])
+    if "rules" in list(payload.keys()):
+        for esamrule in payload['rules']:
+            # check type = delete or replace
+            if esamrule['type'] not in ['replace','delete']:
+                return {"status":"malformed request body, for esam rule, type must be one of - delete, replace"}
 
-                    value[i] = dynamodb_item_list
+            if "condition" not in list(esamrule.keys()):
+                return {"status":"malformed request body, esam rule must have a condition key"}
 
-                dicttopopulate.update({k:value})
-            elif k == "M":
+            if esamrule['type'] == "replace":
+                if "replace_params" not in list(esamrule.keys()):
+                    return {"status":"malformed request body, esam rule type replace, you must have a key replace_params to indicate the result if the condition evaluates to true"}
 
-                dynamodb_item_m = dict()
-                dict_path(dynamodb_item_m,v)
-                v = dynamodb_item_m
-                dicttopopulate.update(v)
+            if "operator" not in list(esamrule['condition'].keys()):
 
-    # Response Structure
-    def clientResponse(status_code,response_message):
-        response_json = {
-            'statusCode': status_code,
-            "headers": {
-                "Content-Type": "application/json",
-            },
-            'body': json.dumps(response_message)
-        }
-        return response_json
+                return {"status":"malformed request body, esam rule must have a operator key"}
+
+            if "value" not in list(esamrule['condition'].keys()):
+                return {"status":"malformed request body, esam rule must have a value key"}
+
+            if esamrule['condition']['operator'] not in ['=','>','<','-','!=']:
+                return {"status":"malformed request body, esam rule operator must be one of = , > , < , - , != "}
+
+            #if esamrule['condition']['operator'] not in supported_properties:
+            #    clientResponse(502,{"status":"malformed request body, esam rule property must be one of: %s " % (supported_properties)})
+
+            if esamrule['type'] == "replace":
+                if not isinstance(esamrule['replace_params'], list):
+                    return {"status":"malformed request body, esam rule replace_params must be of type list"}
+
+                if esamrule['condition']['property'] not in VALID_PROPERTY_SET:
+                    return {"status":"malformed request body, esam condition property is %s, must be one of %s " % (esamrule['condition']['property'],list(VALID_PROPERTIES))}
+
+                for replace_param in esamrule['replace_params']:
+
+                    replace_property = list(replace_param.keys())[0]
+
+                    if replace_property not in VALID_PROPERTY_SET:
+
+                        return {"status":"malformed request body, esam rule replace_param is %s, must be one of %s " % (replace_property,list(VALID_PROPERTIES))}
+
+                    if replace_property == "segmentation_event_id":
+                        try:
+                            int(str(replace_param[replace_property]),0)
+                        except ValueError:
+                            return {"status":"malformed request body, esam rule replace_param segmentation_event_id must be a decimal number, or hexadecimal with the 0x prefix"}
+
+            if esamrule['type'] == "delete":
+                if esamrule['condition']['property'] not in VALID_PROPERTY_SET:
+                    return {"status":"malformed request body, esam condition property is %s, must be one of %s " % (esamrule['condition']['property'],list(VALID_PROPERTIES))}
+
+    return None
+
+
+# DynamoDB JSON item of a validated channel config
+def channelItem(channel,payload):
+    payload['channelid'] = channel
+
+    # the ESAM processor caches channel configs, a new version tells it to reload this one
+    payload['config_version'] = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+
+    # The whole config, with its rules normalized for the processor, is in config_blob (see pois_config.py).
+    # Top level settings are attributes as well so the channel listing can project them
+    dynamodb_item = pois_dynamodb.to_dynamodb_item({k:v for k,v in payload.items() if not isinstance(v,(dict,list))})
+    dynamodb_item['config_blob'] = {"B":pois_config.encode_config(payload)}
+    return dynamodb_item
+
+
+# Client view of a channel item, only the attributes listed in attributes when it is set
+def channelInformation(channel_item,attributes=None):
+    channel_item = dict(channel_item)
+    config_blob = channel_item.pop('config_blob',None)
+    if config_blob is not None and (attributes is None or any(attribute not in channel_item for attribute in attributes)):
+        channel_item['config_blob'] = config_blob
+        channel_information,normalized_rules = pois_config.config_from_item(channel_item)
+    else:
+        channel_information = pois_dynamodb.from_dynamodb_item(channel_item)
+    if attributes is not None:
+        channel_information = {k:v for k,v in channel_information.items() if k in attributes}
+    return channel_information
+
+
+def bulkCreateUpdateChannels(storage,channeldb,body):
+    # Validates every channel in the body before anything is written, returns the client response
+    try:
+        payload = json.loads(body)
+    except (TypeError,ValueError):
+        return clientResponse(502,{"status":"malformed request body, expecting a json list of channel configurations"})
+
+    if not isinstance(payload,list) or len(payload) == 0:
+        return clientResponse(502,{"status":"malformed request body, expecting a json list of channel configurations"})
+    if len(payload) > CHANNEL_BULK_MAX:
+        return clientResponse(502,{"status":"too many channels in one request, got %s, the maximum is %s" % (len(payload),CHANNEL_BULK_MAX)})
+
+    errors = dict()
+    channels = set()
+    for i in range(0,len(payload)):
+        channel_config = payload[i]
+        channel = channel_config.get('channelid') if isinstance(channel_config,dict) else None
+        if not isinstance(channel,str) or len(channel) == 0 or "/" in channel:
+            errors["channel %s" % (i)] = {"status":"malformed request body, every channel needs a channelid without /"}
+            continue
+        if channel in channels or channel in errors:
+            errors[channel] = {"status":"channel appears more than once in the request"}
+            continue
 
-    # DynamoDB Get Item
-    def dbGetSingleChannelInfo(channeldb,channel):
-        LOGGER.debug("Doing a call to Dynamo to get channel information for channel : %s" % (channel))
-        try:
-            response = db_client.get_item(TableName=channeldb,Key={"channelid":{"S":channel}})
-        except Exception as e:
-            exceptions.append("Unable to get item from DynamoDB, got exception:  %s" % (str(e).upper()))
-            return exceptions
-        return response
-
-    # DynamoDB Scan DB // get all items
-    def dbGetAllChannelInfo(channeldb):
-        LOGGER.debug("Doing a call to Dynamo to get all channels")
-        try:
-            response = db_client.scan(TableName=channeldb)
-        except Exception as e:
-            exceptions.append("error getting channel list from DynamoDB, got exception: %s" %  (e))
-            return exceptions
-        return response['Items']
-
-    # DynamoDB Put Item // Create and update item
-    def dbCreateUpdateSingleChannel(channeldb,item,channel):
-        LOGGER.debug("Doing a call to Dynamo to get channel information for channel : %s" % (channel))
-        try:
-            response = db_client.put_item(TableName=channeldb,Item=item)
-        except Exception as e:
-            exceptions.append("Unable to create/update item in DynamoDB, got exception:  %s" % (str(e).upper()))
-            return exceptions
-        return response
-
-    # DynamoDB Delete Item
-    def dbDeleteSingleChannel(channeldb,channel):
-        LOGGER.debug("Doing a call to Dynamo to delete channel record : %s" % (channel))
         try:
-            response = db_client.delete_item(TableName=channeldb,Key={"channelid":{"S":channel}})
-        except Exception as e:
-            exceptions.append("Unable to delete item from DynamoDB, got exception:  %s" % (str(e).upper()))
-            return exceptions
-        return response
+            validation_error = validateChannelConfig(channel_config)
+        except (AttributeError,KeyError,TypeError,IndexError):
+            validation_error = {"status":"malformed request body, please refer to the template"}
+        if validation_error is not None:
+            errors[channel] = validation_error
+        else:
+            channels.add(channel)
+
+    if len(errors) > 0:
+        return clientResponse(502,{"status":"%s channels failed validation, nothing was written" % (len(errors)),"errors":errors})
+
+    LOGGER.info("Passed Validation, now proceeding to Create/update %s records in DynamoDB" % (len(channels)))
+    items = [channelItem(channel_config['channelid'],channel_config) for channel_config in payload]
+
+    exceptions = []
+    failed_items = dbCreateUpdateChannels(storage,channeldb,items,exceptions)
+    if len(exceptions) > 0:
+        LOGGER.error("Something went wrong")
+        return clientResponse(502,exceptions)
+
+    if len(failed_items) > 0:
+        LOGGER.error("%s of %s channels were not written" % (len(failed_items),len(items)))
+        errors = {channel:{"status":"Unable to create/update item in storage: %s" % (failed_items[channel])} for channel in failed_items}
+        return clientResponse(502,{"status":"%s of %s channels were not written" % (len(failed_items),len(items)),"errors":errors})
+
+    return clientResponse(200,{"status":"%s channels created/updated successfully" % (len(items))})
 
 
+def lambda_handler(event, context):
+    LOGGER.info(event)
+
+    storage = STORAGE
+
+    # Databases
+    channeldb = CHANNELDB
+    scheduledb = SCHEDULEDB
+
+    # initialize a list to capture exceptions
+    exceptions = []
+    exceptions.clear()
+
     if event['httpMethod'] == "GET":
         if event['path'] == "/pois/channels":
 
             LOGGER.info("The inbound request is to get a list of all channels configured in the POIS")
-            # This is a request to return a list of all channels
+            # This is a request to return a list of all channels, or one page of them when limit or next is set
+
+            attributes,limit,start_channel,segments,parameter_error = channelListParameters(event.get('queryStringParameters') or dict())
+            if parameter_error is not None:
+                exceptions.append({"Status":"Error performing task, %s" % (parameter_error)})
+                return clientResponse(502,exceptions)
+
+            storage_attributes = None
+            if attributes is not None:
+                storage_attributes = list(attributes)
+                if any(attribute not in CHANNEL_SCALAR_ATTRIBUTES for attribute in attributes):
+                    storage_attributes.append("config_blob")
+
+            next_channel = None
+            if limit is not None:
+                channels_page = dbGetChannelPage(storage,channeldb,limit,start_channel,exceptions,storage_attributes)
+                if len(exceptions) == 0:
+                    channels_information,next_channel = channels_page
+            else:
+                channels_information = dbGetAllChannelInfo(storage,channeldb,exceptions,storage_attributes,segments)
 
-            channels_information = dbGetAllChannelInfo(channeldb)
             if len(exceptions) > 0:
                 LOGGER.error("Something went wrong")
                 return clientResponse(502,exceptions)
             else:
                 LOGGER.info("Returning response to client containing channnels")
-                for i in range(0,len(channels_information)):
-                    channels_information[i]
-                    channel_information_json = dict()
-                    dict_path(channel_information_json,channels_information[i])
-
-                    channels_information[i] = channel_information_json
+                channels_information = [channelInformation(channel_item,attributes) for channel_item in channels_information]
+                if limit is not None:
+                    return clientResponse(200,{"channels":channels_information,"next":encodePageToken(next_channel)})
                 return clientResponse(200,channels_information)
 
         elif "/pois/channels/" in event['path']:
@@ -220,7 +471,7 @@ def lambda_handler(event, context):
             else:
                 # lookup channel from DynamoDB
                 channel = path[3]
-                channel_information = dbGetSingleChannelInfo(channeldb,channel)
+                channel_information = dbGetSingleChannelInfo(storage,channeldb,channel,exceptions)
                 if len(exceptions) > 0:
                     LOGGER.error("Something went wrong")
                     return clientResponse(502,exceptions)
@@ -232,8 +483,7 @@ def lambda_handler(event, context):
                         return clientResponse(200,channel_information)
                     else:
 
-                        channel_information_json = dict()
-                        dict_path(channel_information_json,channel_information['Item'])
+                        channel_information_json = channelInformation(channel_information['Item'])
 
                         #return clientResponse(200,channel_information['Item'])
                         return clientResponse(200,channel_information_json)
@@ -248,7 +498,12 @@ def lambda_handler(event, context):
         # Need to do some validation on the request url first
         path = event['path'].split("/")
 
-        if "/pois/channels/" in event['path']:
+        if event['path'] == "/pois/channels":
+
+            LOGGER.info("The inbound request is to create/update a list of channels")
+            return bulkCreateUpdateChannels(storage,channeldb,event['body'])
+
+        elif "/pois/channels/" in event['path']:
             if len(path) != 4:
                 exceptions.append({"Status":"Error performing task, expected url in format /pois/channels/[channel], got something different"})
                 return clientResponse(502,exceptions)
@@ -261,108 +516,20 @@ def lambda_handler(event, context):
 
 
                 ##### VALIDATION START
-
-                # check required top level keys first
-                required_keys = ["default_behavior","esam_version"]
-
-
-                for rkey in required_keys:
-                    if rkey not in list(payload.keys()):
-                        return clientResponse(502,{"status":"malformed request body, please refer to the template: required keys - default_behavior,esam_version"})
-
-
-                default_behaviors = ["noop","delete"]
-
-                valid_properties = []
-                for key,value in threefive_scte_format.items():
-                    for value in threefive_scte_format[key]:
-                        valid_properties.append(value)
-
-                if payload['default_behavior'] not in default_behaviors:
-                    return clientResponse(502,{"status":"default_behavior value must be one of - noop , delete"})
-
-                if "rules" in list(payload.keys()):
-                    for esamrule in payload['rules']:
-                        # check type = delete or replace
-                        if esamrule['type'] not in ['replace','delete']:
-                            return clientResponse(502,{"status":"malformed request body, for esam rule, type must be one of - delete, replace"})
-
-                        if "condition" not in list(esamrule.keys()):
-                            return clientResponse(502,{"status":"malformed request body, esam rule must have a condition key"})
-
-                        if esamrule['type'] == "replace":
-                            if "replace_params" not in list(esamrule.keys()):
-                                return clientResponse(502,{"status":"malformed request body, esam rule type replace, you must have a key replace_params to indicate the result if the condition evaluates to true"})
-
-                        if "operator" not in list(esamrule['condition'].keys()):
-
-                            return clientResponse(502,{"status":"malformed request body, esam rule must have a operator key"})
-
-                        if "value" not in list(esamrule['condition'].keys()):
-                            return clientResponse(502,{"status":"malformed request body, esam rule must have a value key"})
-
-                        if esamrule['condition']['operator'] not in ['=','>','<','-','!=']:
-                            return clientResponse(502,{"status":"malformed request body, esam rule operator must be one of = , > , < , - , != "})
-
-                        #if esamrule['condition']['operator'] not in supported_properties:
-                        #    clientResponse(502,{"status":"malformed request body, esam rule property must be one of: %s " % (supported_properties)})
-
-                        if esamrule['type'] == "replace":
-                            if not isinstance(esamrule['replace_params'], list):
-                                return clientResponse(502,{"status":"malformed request body, esam rule replace_params must be of type list"})
-
-                            if esamrule['condition']['property'] not in valid_properties:
-                                return clientResponse(502,{"status":"malformed request body, esam condition property is %s, must be one of %s " % (esamrule['condition']['property'],valid_properties)})
-
-                            for replace_param in esamrule['replace_params']:
-
-                                replace_property = list(replace_param.keys())[0]
-
-                                if replace_property not in valid_properties:
-
-                                    return clientResponse(502,{"status":"malformed request body, esam rule replace_param is %s, must be one of %s " % (replace_property,valid_properties)})
-
-                        if esamrule['type'] == "delete":
-                            if esamrule['condition']['property'] not in valid_properties:
-                                return clientResponse(502,{"status":"malformed request body, esam condition property is %s, must be one of %s " % (esamrule['condition']['property'],valid_properties)})
-
+                validation_error = validateChannelConfig(payload)
+                if validation_error is not None:
+                    return clientResponse(502,validation_error)
                 ##### VALIDATION END
                 # If we get here then we can write the item to the Db
                 LOGGER.info("Passed Validation, now proceeding to Create/update record in DynamoDB")
 
                 channel = event['path'].split("/")[-1]
-                payload['channelid'] = channel
-                item = payload
-
 
                 # DYNAMO DB JSON BUILDER
-                dynamodb_item = dict()
-                keylist = []
-                def dict_path(dicttopopulate,my_dict):
-                    for k,v in my_dict.items():
-
-                        if isinstance(v,dict):
-                            dynamodb_item_subdict = dict()
-                            dict_path(dynamodb_item_subdict,v)
-
-                            v = dynamodb_item_subdict
-                            dicttopopulate.update({k:{"M":v}})
-
-                        elif isinstance(v,str):
-                            dicttopopulate.update({k:{"S":v}})
-                        elif isinstance(v,list):
-                            for i in range(0,len(v)):
-                                dynamodb_item_list = dict()
-                                dict_path(dynamodb_item_list,v[i])
-
-                                v[i] = {"M":dynamodb_item_list}
-
-                            dicttopopulate.update({k:{"L":v}})
-
-                dict_path(dynamodb_item,item)
+                dynamodb_item = channelItem(channel,payload)
 
                 # PUT DB Item
-                channel_create_update = dbCreateUpdateSingleChannel(channeldb,dynamodb_item,channel)
+                channel_create_update = dbCreateUpdateSingleChannel(storage,channeldb,dynamodb_item,channel,exceptions)
 
                 if len(exceptions) > 0:
                     LOGGER.error("Something went wrong")
@@ -396,7 +563,7 @@ def lambda_handler(event, context):
                 # DELETE Channel
                 channel = path[-1]
 
-                channel_information = dbDeleteSingleChannel(channeldb,channel)
+                channel_information = dbDeleteSingleChannel(storage,channeldb,channel,exceptions)
 
                 if len(exceptions) > 0:
                     LOGGER.error("Something went wrong")
@@ -0,0 +1,552 @@
+'''
+Multi-channel load generator for the ESAM processor.
+
+Synthesizes SignalProcessingEvents for --channels channels and sends them as fast as the processor answers them,
+or at --rate signals per second, from --workers workers at once. Reports sustained throughput, tail latency and
+the error and fallback rate, so the number of channels and signals per second one processor instance can handle
+is known before a big event.
+
+Targets:
+    handler    every worker is a process with its own esam-processor.py and pois-control.py lambda_handler,
+               like a warm Lambda container, with channel config and state in the in-memory (or SQLite) storage
+               backend. No AWS account is needed
+    --url      every worker is a thread with its own keep-alive connection to a running POIS, ie.
+               pois-local-server.py. Channels are configured with PUT {url}/pois/channels/{channel}
+
+Every channel is sent to by one worker only, so a channel's signals arrive in order the way one encoder sends
+them. Channels are given one of CHANNEL_PROFILES in turn, --stateful-ratio of them the stateful one.
+
+Each request is one AcquiredSignal, the signal mix is set with:
+    --time-signal-ratio      time_signals, the rest are splice_inserts with or without a break duration
+    --descriptor-weights     relative weights of time_signals with 1, 2, 3... segmentation descriptors
+    --duplicate-rate         the channel's previous cue again with a new acquisitionSignalID
+    --retry-rate             the channel's previous SignalProcessingEvent again, unchanged
+    --corrupt-rate           a truncated cue the processor can't decode
+Events are generated before the run starts, with --seed, so runs with the same options send the same events.
+Every worker first sends --warmup events of its own before the run starts. They are sent on top of
+--requests and aren't counted, so --requests is the number of timed events.
+
+A response that isn't a SignalProcessingNotification with a ResponseSignal, or an exception, is an error.
+A notification with StatusCode classCode 2 is a fallback: the processor answered with the channel's default
+behavior because something failed.
+
+Usage:
+    python3 pois-loadgen.py --channels 200 --requests 50000 --workers 4
+    python3 pois-loadgen.py --channels 200 --requests 50000 --workers 4 --rate 2000 --stateful-ratio 0.25
+    python3 pois-loadgen.py --channels 50 --requests 10000 --workers 8 --url http://127.0.0.1:8080
+'''
+
+import argparse
+import base64
+import datetime
+import http.client
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import xmltodict
+
+CHANNEL_PROFILES = [
+    {
+        "name":"delete_splice_insert",
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"delete","condition":{"property":"splice_command_type","operator":"=","value":"5"}}]}
+    },
+    {
+        "name":"delete_provider_ads",
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"delete","condition":{"property":"segmentation_type_id","operator":"=","value":"48,49"}},
+            {"type":"delete","condition":{"property":"segmentation_duration","operator":">","value":"120"}}]}
+    },
+    {
+        "name":"replace_placement",
+        "config":{"default_behavior":"noop","esam_version":"2013","rules":[
+            {"type":"replace","condition":{"property":"segmentation_type_id","operator":"=","value":"52"},
+             "replace_params":[{"segmentation_duration":"60"}]}]}
+    },
+    {
+        "name":"descriptor_priority",
+        "config":{"default_behavior":"noop","esam_version":"2013","descriptor_priority":"52,48","rules":[
+            {"type":"delete","condition":{"property":"segmentation_type_id","operator":"=","value":"16"}}]}
+    }
+]
+
+# replace rules take the lock of a stateful channel, later signals are deleted until it expires
+STATEFUL_PROFILE = {
+    "name":"stateful_replace",
+    "config":{"default_behavior":"noop","esam_version":"2013","mode":"stateful","rules":[
+        {"type":"replace","condition":{"property":"segmentation_type_id","operator":"=","value":"52"},
+         "replace_params":[{"segmentation_duration":"60"}]}]}
+}
+
+SIGNAL_CLASSES = ["splice_insert","time_signal_1","time_signal_n","duplicate","retry","corrupt"]
+
+RESPONSE_ACTION = re.compile(r'<ResponseSignal action="([a-z]+)"')
+RESPONSE_CLASS_CODE = re.compile(r'<StatusCode classCode="([0-9]+)"')
+
+
+def load_module(module_name,file_name):
+    # The Lambda sources have dashes in their file names, so load them by path
+    file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),file_name)
+    spec = importlib.util.spec_from_file_location(module_name,file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# cue builders, shared with pois-benchmark.py --cues
+pois_scte35_corpus = load_module("pois_scte35_corpus","pois-scte35-corpus.py")
+
+
+def random_cue(rng,options,channel_state):
+    # Returns (signal class, base64 cue) of the channel's next cue
+    channel_state['pts_time_ticks'] = (channel_state['pts_time_ticks'] + rng.randint(2,600) * 90000) & 0x1FFFFFFFF
+    channel_state['event_id'] += 1
+    pts_time_ticks = channel_state['pts_time_ticks']
+
+    if rng.random() >= options.time_signal_ratio:
+        # ad break out with a duration, or the return to network
+        if rng.random() < 0.5:
+            cue = pois_scte35_corpus.splice_insert(channel_state['event_id'],pts_time_ticks,rng.choice(pois_scte35_corpus.BREAK_DURATIONS) * 90000)
+        else:
+            cue = pois_scte35_corpus.splice_insert(channel_state['event_id'],pts_time_ticks,None,out_of_network_indicator=False)
+        return "splice_insert",base64.b64encode(cue).decode("ascii")
+
+    descriptor_count = rng.choices(range(1,len(options.descriptor_weights) + 1),weights=options.descriptor_weights)[0]
+    descriptor_fields = [pois_scte35_corpus.random_descriptor(rng,pts_time_ticks,channel_state['event_id'] + d) for d in range(0,descriptor_count)]
+    channel_state['event_id'] += descriptor_count
+    cue = pois_scte35_corpus.time_signal(pts_time_ticks,descriptor_fields)
+    return "time_signal_1" if descriptor_count == 1 else "time_signal_n",base64.b64encode(cue).decode("ascii")
+
+
+def spe_template():
+    # SignalProcessingEvent shaped like spe.json with one AcquiredSignal, the @@...@@ fields are filled in per event
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"spe.json")) as spe_file:
+        spe = json.load(spe_file)
+    acq_signal = spe['SignalProcessingEvent']['AcquiredSignal']
+    acq_signal['@acquisitionPointIdentity'] = "@@CHANNEL@@"
+    acq_signal['@acquisitionSignalID'] = "@@SIGNALID@@"
+    acq_signal['@acquisitionTime'] = "@@TIME@@"
+    acq_signal['sig:UTCPoint']['@utcPoint'] = "@@TIME@@"
+    acq_signal['sig:BinaryData']['#text'] = "@@CUE@@"
+    for stream_time in acq_signal['sig:StreamTimes']['sig:StreamTime']:
+        stream_time['@timeValue'] = "@@PTS@@"
+    return xmltodict.unparse(spe)
+
+
+def spe_body(template,channel,signal_id,cue,pts_time_ticks,utc_time):
+    return (template.replace("@@CHANNEL@@",channel).replace("@@SIGNALID@@",signal_id).replace("@@CUE@@",cue)
+            .replace("@@PTS@@",str(pts_time_ticks)).replace("@@TIME@@",utc_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"))
+
+
+def channel_profiles(options):
+    # channel name -> profile, the first --stateful-ratio of the channels are stateful
+    stateful_count = int(round(options.channels * options.stateful_ratio))
+    profiles = dict()
+    for c in range(0,options.channels):
+        channel = "%s-%04d" % (options.channel_prefix,c)
+        profiles[channel] = STATEFUL_PROFILE if c < stateful_count else CHANNEL_PROFILES[c % len(CHANNEL_PROFILES)]
+    return profiles
+
+
+def next_event(rng,options,template,channel,channel_state,signal_id,utc_time):
+    # Returns (signal class, SignalProcessingEvent) of the channel's next signal
+    previous = channel_state['previous']
+    draw = rng.random()
+    if previous is not None and draw < options.retry_rate:
+        return "retry",previous[2]
+    elif previous is not None and draw < options.retry_rate + options.duplicate_rate:
+        signal_class,cue = "duplicate",previous[1]
+    elif draw < options.retry_rate + options.duplicate_rate + options.corrupt_rate:
+        cue_bytes = base64.b64decode(random_cue(rng,options,channel_state)[1])
+        signal_class,cue = "corrupt",base64.b64encode(cue_bytes[:len(cue_bytes) // 2]).decode("ascii")
+    else:
+        signal_class,cue = random_cue(rng,options,channel_state)
+
+    body = spe_body(template,channel,signal_id,cue,channel_state['pts_time_ticks'],utc_time)
+    channel_state['previous'] = (signal_class,cue,body)
+    return signal_class,body
+
+
+def generate_events(options,channels):
+    # Returns a list of (channel, signal class, SignalProcessingEvent) per worker. The first --warmup events of a
+    # worker are its warmup, sent to its own channels on top of the --requests timed events
+    rng = random.Random(options.seed)
+    template = spe_template()
+    channel_names = list(channels.keys())
+    channel_states = {channel:{"pts_time_ticks":rng.getrandbits(33),"event_id":rng.getrandbits(24),"previous":None} for channel in channel_names}
+    worker_events = [[] for w in range(0,options.workers)]
+    utc_time = datetime.datetime.utcnow()
+
+    # the channel at channel_index is sent to by worker channel_index % workers
+    for w in range(0,options.workers):
+        worker_channels = channel_names[w::options.workers]
+        for i in range(0,options.warmup):
+            channel = worker_channels[rng.randrange(0,len(worker_channels))]
+            utc_time += datetime.timedelta(milliseconds=rng.randint(1,50))
+            signal_id = "%s-warmup-%s-%s" % (options.seed,w,i)
+            worker_events[w].append((channel,) + next_event(rng,options,template,channel,channel_states[channel],signal_id,utc_time))
+
+    for i in range(0,options.requests):
+        channel_index = rng.randrange(0,len(channel_names))
+        channel = channel_names[channel_index]
+        utc_time += datetime.timedelta(milliseconds=rng.randint(1,50))
+        signal_id = "%s-%s" % (options.seed,i)
+        worker_events[channel_index % options.workers].append((channel,) + next_event(rng,options,template,channel,channel_states[channel],signal_id,utc_time))
+    return worker_events
+
+
+class HandlerTarget(object):
+    # The processor and control API loaded in this process, with their own storage
+
+    def __init__(self,options):
+        os.environ['POIS_STORAGE'] = options.storage
+        os.environ['POIS_SQLITE_PATH'] = options.sqlite_path
+        for variable,value in options.processor_environment.items():
+            os.environ[variable] = value
+        os.environ.setdefault('CHANNELDB','POIS-channels-loadgen')
+        os.environ.setdefault('SCHEDULEDB','POIS-schedules-loadgen')
+        os.environ.setdefault('STATEDB','POIS-state-loadgen')
+
+        self.esam_processor = load_module("esam_processor","esam-processor.py")
+        self.pois_control = load_module("pois_control","pois-control.py")
+        # the handlers set the root logger to INFO at import
+        logging.getLogger().setLevel(options.log_level.upper())
+
+    def configure(self,channel,channel_config):
+        response = self.pois_control.lambda_handler({"httpMethod":"PUT","path":"/pois/channels/%s" % (channel),"body":json.dumps(channel_config)},None)
+        return response['statusCode'],response['body']
+
+    def send(self,body):
+        response = self.esam_processor.lambda_handler({"body":body},None)
+        return response['statusCode'],response['body']
+
+
+class UrlTarget(object):
+    # A running POIS, over one keep-alive HTTP connection
+
+    def __init__(self,options):
+        url = urllib.parse.urlsplit(options.url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.netloc = url.netloc
+        self.path = url.path.rstrip("/")
+        self.timeout = options.timeout
+        self.connection = None
+
+    def request(self,method,path,body,content_type):
+        if self.connection is None:
+            self.connection = self.connection_class(self.netloc,timeout=self.timeout)
+        try:
+            self.connection.request(method,self.path + path,body=body.encode("utf-8"),headers={"Content-Type":content_type})
+            response = self.connection.getresponse()
+            return response.status,response.read().decode("utf-8")
+        except Exception:
+            # a new connection for the next request
+            self.connection.close()
+            self.connection = None
+            raise
+
+    def configure(self,channel,channel_config):
+        return self.request("PUT","/pois/channels/%s" % (channel),json.dumps(channel_config),"application/json")
+
+    def send(self,body):
+        return self.request("POST","/esam",body,"application/xml")
+
+
+def run_worker(worker_id,options,channels,events,barrier,results):
+    # Configures the worker's channels and sends the first --warmup events, waits for every worker to be ready,
+    # then sends the rest.
+    # Latency is measured from the time a request was due, so with --rate a processor that falls behind
+    # shows the queueing delay too
+    try:
+        target = UrlTarget(options) if options.url else HandlerTarget(options)
+        for channel in sorted(set(event[0] for event in events)):
+            status_code,body = target.configure(channel,channels[channel]['config'])
+            if status_code != 200:
+                raise Exception("Unable to configure channel %s: %s %s" % (channel,status_code,body))
+        # first requests of a container load threefive and compile the channel rules
+        for channel,signal_class,body in events[:options.warmup]:
+            target.send(body)
+        events = events[options.warmup:]
+    except Exception as e:
+        barrier.abort()
+        results.put({"worker":worker_id,"exception":"%s: %s" % (type(e).__name__,e)})
+        return
+
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        results.put({"worker":worker_id,"exception":"another worker failed to start"})
+        return
+
+    interval = options.workers / options.rate if options.rate else 0.0
+    latencies = {signal_class:[] for signal_class in SIGNAL_CLASSES}
+    finish_times = []
+    actions = dict()
+    errors = dict()
+    fallbacks = 0
+
+    start_wall = time.time()
+    start = time.perf_counter()
+    for i in range(0,len(events)):
+        channel,signal_class,body = events[i]
+        due = start + i * interval
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        else:
+            due = time.perf_counter() if interval == 0.0 else due
+
+        try:
+            status_code,response_body = target.send(body)
+            action = RESPONSE_ACTION.search(response_body) if status_code == 200 else None
+            if action is None:
+                error = "status %s" % (status_code)
+            else:
+                error = None
+                actions[action.group(1)] = actions.get(action.group(1),0) + 1
+                class_code = RESPONSE_CLASS_CODE.search(response_body)
+                if class_code is not None and class_code.group(1) == "2":
+                    fallbacks += 1
+        except Exception as e:
+            error = type(e).__name__
+        finished = time.perf_counter()
+
+        if error is not None:
+            errors[error] = errors.get(error,0) + 1
+        latencies[signal_class].append(finished - due)
+        finish_times.append(start_wall + finished - start)
+
+    results.put({
+        "worker":worker_id,
+        "start":start_wall,
+        "end":start_wall + time.perf_counter() - start,
+        "latencies":latencies,
+        "finish_times":finish_times,
+        "actions":actions,
+        "errors":errors,
+        "fallbacks":fallbacks
+    })
+
+
+def run_workers(options,channels,worker_events):
+    # Processes for the handler target, each is its own processor instance. Threads for --url, the
+    # requests are handled by the server
+    if options.url:
+        barrier = threading.Barrier(options.workers)
+        results = queue.Queue()
+        workers = [threading.Thread(target=run_worker,args=(w,options,channels,worker_events[w],barrier,results)) for w in range(0,options.workers)]
+    else:
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(options.workers)
+        results = context.Queue()
+        workers = [context.Process(target=run_worker,args=(w,options,channels,worker_events[w],barrier,results)) for w in range(0,options.workers)]
+
+    for worker in workers:
+        worker.start()
+    # the results are read before joining, a process doesn't exit until its queue is flushed
+    worker_results = [results.get() for worker in workers]
+    for worker in workers:
+        worker.join()
+    return sorted(worker_results,key=lambda r: r['worker'])
+
+
+def percentile(sorted_values,p):
+    # nearest rank
+    if len(sorted_values) == 0:
+        return None
+    rank = max(1,int(round(p / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank,len(sorted_values)) - 1]
+
+
+def summarize(durations):
+    # durations in seconds, summary in milliseconds
+    durations = sorted(durations)
+    if len(durations) == 0:
+        return {"count":0}
+    return {
+        "count":len(durations),
+        "mean_ms":round(sum(durations) / len(durations) * 1000,4),
+        "p50_ms":round(percentile(durations,50) * 1000,4),
+        "p95_ms":round(percentile(durations,95) * 1000,4),
+        "p99_ms":round(percentile(durations,99) * 1000,4),
+        "p999_ms":round(percentile(durations,99.9) * 1000,4),
+        "max_ms":round(durations[-1] * 1000,4)
+    }
+
+
+def aggregate(options,worker_results):
+    start = min(r['start'] for r in worker_results)
+    end = max(r['end'] for r in worker_results)
+    requests = sum(len(r['finish_times']) for r in worker_results)
+
+    # signals completed in each whole --window seconds of the run, the lowest is what the processor sustained
+    window_counts = dict()
+    for r in worker_results:
+        for finish_time in r['finish_times']:
+            window = int((finish_time - start) / options.window)
+            window_counts[window] = window_counts.get(window,0) + 1
+    whole_windows = [window_counts.get(w,0) / options.window for w in range(0,int((end - start) / options.window))]
+
+    actions = dict()
+    errors = dict()
+    for r in worker_results:
+        for action,count in r['actions'].items():
+            actions[action] = actions.get(action,0) + count
+        for error,count in r['errors'].items():
+            errors[error] = errors.get(error,0) + count
+    error_count = sum(errors.values())
+    fallback_count = sum(r['fallbacks'] for r in worker_results)
+
+    all_latencies = []
+    classes = dict()
+    for signal_class in SIGNAL_CLASSES:
+        class_latencies = [latency for r in worker_results for latency in r['latencies'][signal_class]]
+        all_latencies.extend(class_latencies)
+        if len(class_latencies) > 0:
+            classes[signal_class] = summarize(class_latencies)
+
+    return {
+        "requests":requests,
+        "duration_s":round(end - start,3),
+        "throughput_per_s":round(requests / (end - start),1) if end > start else None,
+        "lowest_window_per_s":round(min(whole_windows),1) if len(whole_windows) > 0 else None,
+        "latency":summarize(all_latencies),
+        "classes":classes,
+        "actions":actions,
+        "errors":errors,
+        "error_rate":round(error_count / requests,6) if requests > 0 else None,
+        "fallbacks":fallback_count,
+        "fallback_rate":round(fallback_count / requests,6) if requests > 0 else None
+    }
+
+
+def print_results(results):
+    metadata = results['metadata']
+    print("%s channels (%s stateful), %s workers, %s" % (metadata['channels'],metadata['stateful_channels'],metadata['workers'],metadata['target']))
+    print("%s warmup signals per worker, not counted" % (metadata['warmup']))
+    throughput = "%s signals in %.2f s: %.1f signals/s" % (results['requests'],results['duration_s'],results['throughput_per_s'] or 0)
+    if results['lowest_window_per_s'] is not None:
+        throughput += ", lowest %s s window %s signals/s" % (metadata['window'],results['lowest_window_per_s'])
+    else:
+        throughput += ", the run is shorter than one %s s window, lowest window not measured" % (metadata['window'])
+    print(throughput)
+    latency = results['latency']
+    print("latency ms: p50 %.3f  p95 %.3f  p99 %.3f  p99.9 %.3f  max %.3f" % (latency['p50_ms'],latency['p95_ms'],latency['p99_ms'],latency['p999_ms'],latency['max_ms']))
+    print("errors %s (%.3f%%) %s  fallbacks %s (%.3f%%)" % (sum(results['errors'].values()),results['error_rate'] * 100,results['errors'] or "",
+                                                         results['fallbacks'],results['fallback_rate'] * 100))
+    print("actions %s" % (", ".join("%s %s" % (action,count) for action,count in sorted(results['actions'].items()))))
+    print("%-16s %8s %10s %10s %10s" % ("signal class","count","p50 ms","p99 ms","max ms"))
+    for signal_class,summary in results['classes'].items():
+        print("%-16s %8s %10.3f %10.3f %10.3f" % (signal_class,summary['count'],summary['p50_ms'],summary['p99_ms'],summary['max_ms']))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git","rev-parse","HEAD"],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-channel ESAM load generator")
+    parser.add_argument("--channels",type=int,default=100,help="number of channels")
+    parser.add_argument("--channel-prefix",default="loadgen",help="channel names are {prefix}-0000, {prefix}-0001...")
+    parser.add_argument("--requests",type=int,default=20000,help="timed SignalProcessingEvents, the warmup events are sent on top")
+    parser.add_argument("--workers",type=int,default=1,help="processor instances (handler) or connections (--url) sending at once")
+    parser.add_argument("--warmup",type=int,default=100,help="events each worker sends before the run starts, on top of --requests and not counted")
+    parser.add_argument("--rate",type=float,help="signals per second for all workers together, as fast as possible if not set")
+    parser.add_argument("--time-signal-ratio",type=float,default=0.7,help="share of new cues that are time_signals, the rest are splice_inserts")
+    parser.add_argument("--descriptor-weights",default="70,20,10",help="relative weights of time_signals with 1, 2, 3... segmentation descriptors")
+    parser.add_argument("--duplicate-rate",type=float,default=0.05,help="share of signals that resend the channel's previous cue with a new acquisitionSignalID")
+    parser.add_argument("--retry-rate",type=float,default=0.02,help="share of signals that resend the channel's previous SignalProcessingEvent unchanged")
+    parser.add_argument("--corrupt-rate",type=float,default=0.0,help="share of signals with a truncated cue")
+    parser.add_argument("--stateful-ratio",type=float,default=0.1,help="share of channels in stateful mode")
+    parser.add_argument("--seed",type=int,default=1,help="random seed of the generated events")
+    parser.add_argument("--url",help="base URL of a running POIS, ie. http://127.0.0.1:8080, instead of loading the handlers")
+    parser.add_argument("--timeout",type=float,default=10.0,help="HTTP timeout in seconds with --url")
+    parser.add_argument("--storage",default="memory",choices=["memory","sqlite"],help="storage backend of the handlers, sqlite is shared by the workers")
+    parser.add_argument("--cache-ttl",help="CHANNEL_CACHE_TTL of the processor")
+    parser.add_argument("--scte35-cache-size",help="SCTE35_CACHE_SIZE of the processor")
+    parser.add_argument("--decision-cache-ttl",help="DECISION_CACHE_TTL of the processor")
+    parser.add_argument("--window",type=float,default=1.0,help="seconds of the windows the lowest sustained throughput is measured over")
+    parser.add_argument("--output",help="write the results to this JSON file")
+    parser.add_argument("--log-level",default="WARNING",help="python logging level, the Lambda handlers log every request at INFO")
+    options = parser.parse_args()
+
+    options.descriptor_weights = [float(weight) for weight in options.descriptor_weights.split(",")]
+    if options.workers < 1 or options.channels < 1 or options.requests < 1:
+        parser.error("--workers, --channels and --requests must be at least 1")
+    if options.warmup < 0:
+        parser.error("--warmup can't be negative")
+    if options.retry_rate + options.duplicate_rate + options.corrupt_rate > 1.0:
+        parser.error("--retry-rate, --duplicate-rate and --corrupt-rate add up to more than 1")
+    # every channel is sent to by one worker
+    options.workers = min(options.workers,options.channels)
+
+    options.processor_environment = dict()
+    for variable,value in (("CHANNEL_CACHE_TTL",options.cache_ttl),("SCTE35_CACHE_SIZE",options.scte35_cache_size),("DECISION_CACHE_TTL",options.decision_cache_ttl)):
+        if value is not None:
+            options.processor_environment[variable] = value
+    sqlite_dir = tempfile.TemporaryDirectory()
+    options.sqlite_path = os.path.join(sqlite_dir.name,"pois.db")
+
+    channels = channel_profiles(options)
+    worker_events = generate_events(options,channels)
+    worker_results = run_workers(options,channels,worker_events)
+
+    failed = [r for r in worker_results if "exception" in r]
+    if len(failed) > 0:
+        for r in failed:
+            print("worker %s failed: %s" % (r['worker'],r['exception']))
+        return 1
+
+    results = aggregate(options,worker_results)
+    results['metadata'] = {
+        "timestamp":datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "git_commit":git_commit(),
+        "python":platform.python_version(),
+        "platform":platform.platform(),
+        "target":options.url or "handler, %s storage" % (options.storage),
+        "channels":options.channels,
+        "stateful_channels":sum(1 for profile in channels.values() if profile is STATEFUL_PROFILE),
+        "workers":options.workers,
+        "warmup":options.warmup,
+        "rate":options.rate,
+        "window":options.window,
+        "seed":options.seed,
+        "mix":{
+            "time_signal_ratio":options.time_signal_ratio,
+            "descriptor_weights":options.descriptor_weights,
+            "duplicate_rate":options.duplicate_rate,
+            "retry_rate":options.retry_rate,
+            "corrupt_rate":options.corrupt_rate
+        },
+        "processor_environment":options.processor_environment
+    }
+    print_results(results)
+
+    if options.output:
+        with open(options.output,"w") as output_file:
+            json.dump(results,output_file,indent=2)
+
+    # errors mean the processor or server failed requests, fallbacks are reported only
+    if sum(results['errors'].values()) > 0:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+'''
+Standalone POIS server for on-prem deployments, colocated with the transcoder.
+
+Serves the same API as the AWS deployment, without API Gateway and Lambda in the path:
+    POST   /esam                     = ESAM SignalProcessingEvent, handled by esam-processor.py
+    GET    /pois/channels            = handled by pois-control.py
+    PUT    /pois/channels            = bulk create or update
+    GET    /pois/channels/{channel}
+    PUT    /pois/channels/{channel}
+    DELETE /pois/channels/{channel}
+
+Requests are adapted to the API Gateway proxy event shape and passed to the unmodified lambda_handler
+functions. Channel config and state live in memory, or in a SQLite database with --storage sqlite,
+so no AWS account or network access is needed. Each handler runs on a thread of its own, off the event loop, so
+a slow request doesn't hold up the connections of the other handler. Like a Lambda container, each handler
+serves one request at a time and keeps its caches between requests. Clients that send Expect: 100-continue get the
+interim response before the body is read, and a POST /esam without a body is answered with 400.
+
+Usage:
+    python3 pois-local-server.py --port 8080
+    python3 pois-local-server.py --port 8080 --storage sqlite --sqlite-path /var/lib/pois/pois.db
+'''
+
+import argparse
+import asyncio
+import concurrent.futures
+import importlib.util
+import logging
+import os
+import sys
+import urllib.parse
+
+LOGGER = logging.getLogger("pois-local-server")
+
+# HTTP/1.1 request limits
+MAX_HEADER_BYTES = 65536
+MAX_BODY_BYTES = 4 * 1024 * 1024
+KEEPALIVE_TIMEOUT = 60
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    417: "Expectation Failed",
+    500: "Internal Server Error",
+    502: "Bad Gateway"
+}
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def load_handler(module_name,file_name):
+    # The Lambda sources have dashes in their file names, so load them by path
+    file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),file_name)
+    spec = importlib.util.spec_from_file_location(module_name,file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_handlers(storage_type,sqlite_path):
+    # The handlers pick their storage backend from the environment when they are loaded
+    os.environ['POIS_STORAGE'] = storage_type
+    os.environ['POIS_SQLITE_PATH'] = sqlite_path
+    # Table names are only used as keys of the local store
+    os.environ.setdefault('CHANNELDB','POIS-channels-local')
+    os.environ.setdefault('SCHEDULEDB','POIS-schedules-local')
+    os.environ.setdefault('STATEDB','POIS-state-local')
+
+    esam_processor = load_handler("esam_processor","esam-processor.py")
+    pois_control = load_handler("pois_control","pois-control.py")
+    return esam_processor,pois_control
+
+
+class PoisHttpServer(object):
+
+    def __init__(self,esam_processor,pois_control):
+        self.esam_processor = esam_processor
+        self.pois_control = pois_control
+        # one thread per handler, the module level caches of the handlers are not shared between threads
+        self.executors = {
+            esam_processor.lambda_handler:concurrent.futures.ThreadPoolExecutor(max_workers=1,thread_name_prefix="esam-processor"),
+            pois_control.lambda_handler:concurrent.futures.ThreadPoolExecutor(max_workers=1,thread_name_prefix="pois-control")
+        }
+
+    def route(self,method,path):
+        if path == "/esam" or path.startswith("/esam/"):
+            if method != "POST":
+                return None,405
+            return self.esam_processor.lambda_handler,200
+        if path == "/pois/channels" or path.startswith("/pois/channels/"):
+            return self.pois_control.lambda_handler,200
+        return None,404
+
+    def build_event(self,method,target,headers,body):
+        # API Gateway proxy integration event, only the keys the handlers use are guaranteed
+        url = urllib.parse.urlsplit(target)
+        query_string_parameters = None
+        if url.query:
+            query_string_parameters = dict(urllib.parse.parse_qsl(url.query,keep_blank_values=True))
+        return {
+            "httpMethod":method,
+            "path":url.path,
+            "headers":headers,
+            "queryStringParameters":query_string_parameters,
+            "body":body.decode("utf-8") if body else None,
+            "isBase64Encoded":False
+        }
+
+    async def read_body(self,reader,headers):
+        # raises BodyTooLarge, or ValueError if the body framing is malformed
+        if headers.get('transfer-encoding','').lower() == "chunked":
+            body = bytearray()
+            while True:
+                chunk_size = int((await reader.readline()).split(b";")[0].strip(),16)
+                if chunk_size < 0:
+                    raise ValueError("negative chunk size")
+                if chunk_size == 0:
+                    # trailers end with an empty line
+                    while (await reader.readline()) not in (b"\r\n",b"\n",b""):
+                        pass
+                    return bytes(body)
+                if len(body) + chunk_size > MAX_BODY_BYTES:
+                    raise BodyTooLarge()
+                body += await reader.readexactly(chunk_size)
+                await reader.readline()
+
+        content_length = int(headers.get('content-length','0'))
+        if content_length < 0:
+            raise ValueError("negative content-length")
+        if content_length > MAX_BODY_BYTES:
+            raise BodyTooLarge()
+        if content_length == 0:
+            return b""
+        return await reader.readexactly(content_length)
+
+    def write_response(self,writer,status_code,headers,body,keep_alive):
+        if isinstance(body,str):
+            body = body.encode("utf-8")
+        response_headers = {"Content-Type":"text/plain"}
+        response_headers.update(headers or dict())
+        response_headers['Content-Length'] = str(len(body))
+        response_headers['Connection'] = "keep-alive" if keep_alive else "close"
+
+        head = "HTTP/1.1 %s %s\r\n" % (status_code,HTTP_REASONS.get(status_code,""))
+        for k,v in response_headers.items():
+            head += "%s: %s\r\n" % (k,v)
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+
+    async def handle_connection(self,reader,writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    request_head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),KEEPALIVE_TIMEOUT)
+                except (asyncio.TimeoutError,asyncio.IncompleteReadError,ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    self.write_response(writer,400,None,"request header too large",False)
+                    return
+
+                lines = request_head.decode("latin-1").split("\r\n")
+                try:
+                    method,target,version = lines[0].split(" ",2)
+                except ValueError:
+                    self.write_response(writer,400,None,"malformed request line",False)
+                    return
+
+                headers = dict()
+                for line in lines[1:]:
+                    if ":" in line:
+                        k,v = line.split(":",1)
+                        headers[k.strip().lower()] = v.strip()
+
+                connection = headers.get('connection','').lower()
+                if version == "HTTP/1.0":
+                    keep_alive = connection == "keep-alive"
+                else:
+                    keep_alive = connection != "close"
+
+                expect = headers.get('expect')
+                if expect is not None:
+                    # curl and other clients wait for the interim response before sending a larger body
+                    if expect.lower() != "100-continue":
+                        self.write_response(writer,417,None,"unsupported expectation",False)
+                        await writer.drain()
+                        return
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                    await writer.drain()
+
+                try:
+                    body = await self.read_body(reader,headers)
+                except BodyTooLarge:
+                    self.write_response(writer,413,None,"request body too large",False)
+                    await writer.drain()
+                    return
+                except ValueError:
+                    self.write_response(writer,400,None,"malformed request body framing",False)
+                    await writer.drain()
+                    return
+                except asyncio.IncompleteReadError:
+                    return
+
+                handler,status_code = self.route(method,urllib.parse.urlsplit(target).path)
+                if handler is None:
+                    self.write_response(writer,status_code,None,HTTP_REASONS[status_code],keep_alive)
+                elif handler == self.esam_processor.lambda_handler and len(body) == 0:
+                    # there is no SignalProcessingEvent to parse
+                    self.write_response(writer,400,None,"empty request body",keep_alive)
+                else:
+                    try:
+                        event = self.build_event(method,target,headers,body)
+                        response = await asyncio.get_running_loop().run_in_executor(self.executors[handler],handler,event,None)
+                        self.write_response(writer,response['statusCode'],response.get('headers'),response.get('body') or "",keep_alive)
+                    except Exception as e:
+                        LOGGER.exception("Handler failed for %s %s from %s" % (method,target,peer))
+                        self.write_response(writer,500,None,"internal server error",keep_alive)
+
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def serve(self,host,port):
+        server = await asyncio.start_server(self.handle_connection,host,port,limit=MAX_HEADER_BYTES)
+        LOGGER.info("POIS listening on %s" % (", ".join(str(sock.getsockname()) for sock in server.sockets)))
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Standalone POIS reference server")
+    parser.add_argument("--host",default="0.0.0.0",help="address to listen on")
+    parser.add_argument("--port",type=int,default=8080,help="port to listen on")
+    parser.add_argument("--storage",default="memory",choices=["memory","sqlite","dynamodb"],help="where channel config and state are kept")
+    parser.add_argument("--sqlite-path",default="pois.db",help="database file for --storage sqlite")
+    parser.add_argument("--log-level",default="WARNING",help="python logging level, the Lambda handlers log every request at INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(),format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    esam_processor,pois_control = load_handlers(args.storage,args.sqlite_path)
+    # the handlers set the root logger to INFO at import
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    try:
+        asyncio.run(PoisHttpServer(esam_processor,pois_control).serve(args.host,args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
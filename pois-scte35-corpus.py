@@ -0,0 +1,211 @@
+'''
+SCTE35 cue corpus generator.
+
+Builds base64 SCTE35 cues of every class the ESAM processor is expected to handle, plus malformed ones, for
+pois-benchmark.py --cues and pois-loadgen.py. Segmentation descriptors are encoded by pois_scte35, the rest of
+the splice_info_section is built here in the same layout, with a valid CRC unless the class says otherwise.
+
+Classes (see cue_classes()):
+    splice_insert_duration     out of network splice_insert with a break_duration
+    splice_insert_return       return to network splice_insert without a break_duration
+    splice_insert_immediate    splice_immediate_flag set, no splice_time
+    time_signal_{n}            time_signal with n segmentation descriptors, 1 to --max-descriptors
+    time_signal_immediate      time_signal without a PTS
+    time_signal_cancel         segmentation_event_cancel_indicator set
+    time_signal_pts_wrap       PTS and pts_adjustment that add up past 2^33
+    time_signal_upid_{name}    one time_signal per UPID type in UPID_TYPES
+    corrupt_crc                valid cue with a wrong CRC_32
+    truncated                  valid cue cut in half
+    bad_table_id               table_id isn't 0xFC
+The last three are not valid cues, what a decoder does with them is reported rather than checked.
+
+Cues are random within their class and the same for the same --seed.
+
+Usage:
+    python3 pois-scte35-corpus.py --output corpus.json
+    python3 pois-scte35-corpus.py --output corpus.json --per-class 50 --max-descriptors 8 --seed 7
+'''
+
+import argparse
+import base64
+import json
+import random
+import struct
+import sys
+
+import pois_scte35
+
+# segmentation_type_ids and whether they carry a duration: program start, provider ad start/end,
+# placement opportunity start/end, distributor placement opportunity start
+SEGMENTATION_TYPES = [(0x10,False),(0x30,True),(0x31,False),(0x34,True),(0x35,False),(0x36,True)]
+BREAK_DURATIONS = [15,30,60,90,120,180]
+
+# segmentation_upid_type -> (name, random upid of the type)
+UPID_TYPES = {
+    0x00:("none",lambda rng: b""),
+    0x01:("user_defined",lambda rng: ("USER%08d" % (rng.randrange(0,10 ** 8))).encode("ascii")),
+    0x03:("ad_id",lambda rng: ("ABCD%08d" % (rng.randrange(0,10 ** 8))).encode("ascii")),
+    0x08:("airing_id",lambda rng: struct.pack(">Q",rng.getrandbits(64))),
+    0x09:("adi",lambda rng: ("SIGNAL:%016x" % (rng.getrandbits(64))).encode("ascii")),
+    0x0C:("mpu",lambda rng: b"CUEI" + struct.pack(">I",rng.getrandbits(32))),
+    0x0E:("ads_info",lambda rng: ("ads=%08x" % (rng.getrandbits(32))).encode("ascii")),
+    0x0F:("uri",lambda rng: ("urn:uuid:%032x" % (rng.getrandbits(128))).encode("ascii")),
+    0x10:("uuid",lambda rng: struct.pack(">QQ",rng.getrandbits(64),rng.getrandbits(64)))
+}
+
+PTS_MAX = 0x1FFFFFFFF
+
+
+def splice_time(pts_time_ticks):
+    # splice_time(), immediate when pts_time_ticks is None
+    if pts_time_ticks is None:
+        return b"\x7f"
+    pts_time_ticks = pts_time_ticks & PTS_MAX
+    return struct.pack(">BI",0xFE | (pts_time_ticks >> 32),pts_time_ticks & 0xFFFFFFFF)
+
+
+def splice_info_section(splice_command_type,splice_command,descriptors=b"",pts_adjustment_ticks=0,table_id=0xFC):
+    # Returns the splice_info_section of a splice command and descriptor loop, with its CRC, in the layout
+    # pois_scte35.encode_time_signal writes
+    cue_length = pois_scte35.INFO_SECTION_LENGTH + len(splice_command) + pois_scte35.DESCRIPTOR_LOOP_LENGTH_LENGTH + len(descriptors) + pois_scte35.CRC_LENGTH
+    cue = bytearray(struct.pack(">BHBBIBHBB",
+        table_id,
+        (3 << 12) | ((cue_length - 3) & 0xFFF),
+        0,
+        (pts_adjustment_ticks >> 32) & 0x1,
+        pts_adjustment_ticks & 0xFFFFFFFF,
+        0,
+        (0xFFF << 4) | (len(splice_command) >> 8),
+        len(splice_command) & 0xFF,
+        splice_command_type
+    ))
+    cue += splice_command + struct.pack(">H",len(descriptors)) + descriptors
+    cue += struct.pack(">I",pois_scte35.crc32_mpeg(cue))
+    return bytes(cue)
+
+
+def splice_insert(splice_event_id,pts_time_ticks,break_duration_ticks,out_of_network_indicator=True):
+    # program splice_insert, immediate when pts_time_ticks is None, without a break_duration when
+    # break_duration_ticks is None
+    flags = (out_of_network_indicator << 7) | 0x40 | ((break_duration_ticks is not None) << 5) | ((pts_time_ticks is None) << 4) | 0x0F
+    splice_command = struct.pack(">IBB",splice_event_id & 0xFFFFFFFF,0x7F,flags)
+    if pts_time_ticks is not None:
+        splice_command += splice_time(pts_time_ticks)
+    if break_duration_ticks is not None:
+        splice_command += struct.pack(">BI",0xFE | ((break_duration_ticks >> 32) & 0x1),break_duration_ticks & 0xFFFFFFFF)
+    # unique_program_id, avail_num, avails_expected
+    splice_command += struct.pack(">HBB",1,1,1)
+    return splice_info_section(5,splice_command)
+
+
+def segmentation_descriptor(fields):
+    # the segmentation_descriptor pois_scte35 encodes for fields, cut out of its time_signal
+    cue = base64.b64decode(pois_scte35.encode_time_signal(fields))
+    splice_command_length = len(splice_time(fields.pts_time_ticks))
+    return cue[pois_scte35.INFO_SECTION_LENGTH + splice_command_length + pois_scte35.DESCRIPTOR_LOOP_LENGTH_LENGTH:-pois_scte35.CRC_LENGTH]
+
+
+def time_signal(pts_time_ticks,descriptor_fields,pts_adjustment_ticks=0,table_id=0xFC):
+    # time_signal with a segmentation_descriptor for each of descriptor_fields
+    descriptors = b"".join(segmentation_descriptor(fields) for fields in descriptor_fields)
+    return splice_info_section(6,splice_time(pts_time_ticks),descriptors,pts_adjustment_ticks,table_id)
+
+
+def random_upid(rng):
+    # Returns (segmentation_upid_type, segmentation_upid) of a random UPID type
+    upid_type = rng.choice(sorted(UPID_TYPES.keys()))
+    return upid_type,UPID_TYPES[upid_type][1](rng)
+
+
+def random_descriptor(rng,pts_time_ticks,segmentation_event_id,upid_type=None):
+    segmentation_type_id,has_duration = rng.choice(SEGMENTATION_TYPES)
+    if upid_type is None:
+        upid_type,upid = random_upid(rng)
+    else:
+        upid = UPID_TYPES[upid_type][1](rng)
+    return pois_scte35.TimeSignalFields(
+        pts_time_ticks=pts_time_ticks,
+        segmentation_event_id=segmentation_event_id,
+        segmentation_duration_ticks=rng.choice(BREAK_DURATIONS) * 90000 if has_duration else None,
+        segmentation_type_id=segmentation_type_id,
+        segmentation_upid_type=upid_type,
+        segmentation_upid=upid
+    )
+
+
+def random_time_signal(rng,descriptor_count,pts_time_ticks=None,upid_type=None,pts_adjustment_ticks=0,table_id=0xFC):
+    event_id = rng.getrandbits(31)
+    descriptor_fields = [random_descriptor(rng,pts_time_ticks,event_id + d,upid_type) for d in range(0,descriptor_count)]
+    return time_signal(pts_time_ticks,descriptor_fields,pts_adjustment_ticks,table_id)
+
+
+def time_signal_cancel(rng):
+    fields = pois_scte35.TimeSignalFields(pts_time_ticks=rng.getrandbits(33),segmentation_event_id=rng.getrandbits(31))
+    fields.segmentation_event_cancel_indicator = True
+    return time_signal(fields.pts_time_ticks,[fields])
+
+
+def corrupt_crc(rng):
+    cue = random_time_signal(rng,1,rng.getrandbits(33))
+    return cue[:-1] + bytes([cue[-1] ^ 0xFF])
+
+
+def truncated(rng):
+    cue = random_time_signal(rng,rng.randint(1,3),rng.getrandbits(33))
+    return cue[:len(cue) // 2]
+
+
+def cue_classes(max_descriptors):
+    # class name -> (valid, description, builder of one random bytes cue)
+    classes = dict()
+    classes['splice_insert_duration'] = (True,"out of network splice_insert with a break_duration",
+        lambda rng: splice_insert(rng.getrandbits(31),rng.getrandbits(33),rng.choice(BREAK_DURATIONS) * 90000))
+    classes['splice_insert_return'] = (True,"return to network splice_insert without a break_duration",
+        lambda rng: splice_insert(rng.getrandbits(31),rng.getrandbits(33),None,out_of_network_indicator=False))
+    classes['splice_insert_immediate'] = (True,"splice_insert with splice_immediate_flag",
+        lambda rng: splice_insert(rng.getrandbits(31),None,rng.choice(BREAK_DURATIONS) * 90000))
+    for descriptor_count in range(1,max_descriptors + 1):
+        classes['time_signal_%s' % (descriptor_count)] = (True,"time_signal with %s segmentation descriptors" % (descriptor_count),
+            lambda rng,descriptor_count=descriptor_count: random_time_signal(rng,descriptor_count,rng.getrandbits(33)))
+    classes['time_signal_immediate'] = (True,"time_signal without a PTS",
+        lambda rng: random_time_signal(rng,1))
+    classes['time_signal_cancel'] = (True,"segmentation_event_cancel_indicator set",time_signal_cancel)
+    classes['time_signal_pts_wrap'] = (True,"PTS and pts_adjustment adding up past 2^33",
+        lambda rng: random_time_signal(rng,1,PTS_MAX - rng.randrange(0,90000),pts_adjustment_ticks=rng.randrange(90000,PTS_MAX)))
+    for upid_type,(upid_name,upid) in sorted(UPID_TYPES.items()):
+        classes['time_signal_upid_%s' % (upid_name)] = (True,"time_signal with a UPID of type 0x%02X" % (upid_type),
+            lambda rng,upid_type=upid_type: random_time_signal(rng,1,rng.getrandbits(33),upid_type))
+    classes['corrupt_crc'] = (False,"valid time_signal with a wrong CRC_32",corrupt_crc)
+    classes['truncated'] = (False,"valid time_signal cut in half",truncated)
+    classes['bad_table_id'] = (False,"time_signal with table_id 0xFD",
+        lambda rng: random_time_signal(rng,1,rng.getrandbits(33),table_id=0xFD))
+    return classes
+
+
+def generate_corpus(seed=1,per_class=20,max_descriptors=5):
+    # Returns a list of {"class","valid","cue"}, per_class cues of every class
+    rng = random.Random(seed)
+    corpus = []
+    for class_name,(valid,description,builder) in cue_classes(max_descriptors).items():
+        for i in range(0,per_class):
+            corpus.append({"class":class_name,"valid":valid,"cue":base64.b64encode(builder(rng)).decode("ascii")})
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SCTE35 cue corpus generator")
+    parser.add_argument("--output",required=True,help="JSON file to write the corpus to")
+    parser.add_argument("--per-class",type=int,default=20,help="cues of every class")
+    parser.add_argument("--max-descriptors",type=int,default=5,help="time_signals are generated with 1 to this many segmentation descriptors")
+    parser.add_argument("--seed",type=int,default=1,help="random seed")
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.seed,args.per_class,args.max_descriptors)
+    with open(args.output,"w") as output_file:
+        json.dump({"metadata":{"seed":args.seed,"per_class":args.per_class,"max_descriptors":args.max_descriptors},"cues":corpus},output_file,indent=2)
+    print("%s cues of %s classes written to %s" % (len(corpus),len(corpus) // args.per_class,args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
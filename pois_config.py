@@ -0,0 +1,102 @@
+'''
+Compiled form of a channel config, written by the control API at PUT and read by the ESAM processor.
+
+The channel item keeps the config in one binary attribute, config_blob, instead of a DynamoDB map of every rule:
+
+    byte 0      CONFIG_BLOB_FORMAT, the layout of the rest of the blob
+    byte 1      ENCODING_JSON or ENCODING_ZLIB_JSON
+    bytes 2..   {"config":channel config,"rules":[normalized rule,...]} as compact JSON, zlib compressed once
+                it is larger than CONFIG_BLOB_COMPRESS_SIZE bytes
+
+Normalized rules have their condition value already split and parsed:
+    {"type","property","operator","values":[value,...],"replace_params":[[property,value],...]}
+    range rules have "ranges":[[min,max],...] instead of values, and a rule whose condition can't be parsed
+    has "error" instead, it never matches
+Values are cast to the type of their SCTE35 property by the processor.
+
+The top level settings that aren't maps or lists (default_behavior, mode, ...) are also kept as attributes of their
+own, so the channel listing can project them without decoding the blob. Items written before config_blob existed
+hold the whole config as attributes, config_from_item() reads both kinds. A blob of an unknown format is logged
+and the attributes are used, which for current items means the channel has no rules.
+
+This file is bundled with both Lambda functions by the CloudFormation file copier.
+'''
+
+import json
+import logging
+import zlib
+
+import pois_dynamodb
+
+LOGGER = logging.getLogger()
+
+CONFIG_BLOB_FORMAT = 1
+ENCODING_JSON = 0
+ENCODING_ZLIB_JSON = 1
+
+# small configs aren't worth the decompression time
+CONFIG_BLOB_COMPRESS_SIZE = 1024
+CONFIG_BLOB_COMPRESS_LEVEL = 6
+
+
+def normalize_rule(rule):
+    normalized = {"type":rule['type'],"property":rule['condition']['property'],"operator":rule['condition']['operator'],"replace_params":[]}
+
+    try:
+        rule_condition_values = str(rule['condition']['value']).split(",")
+        if normalized['operator'] == "-":
+            ranges = []
+            for rule_condition_value in rule_condition_values:
+                rule_value_min,rule_value_max = rule_condition_value.split("-",1)
+                ranges.append([float(rule_value_min),float(rule_value_max)])
+            normalized['ranges'] = ranges
+        else:
+            normalized['values'] = rule_condition_values
+    except Exception as e:
+        normalized['error'] = str(e)
+
+    for rule_param in rule.get('replace_params',[]):
+        r_key = list(rule_param.keys())[0]
+        normalized['replace_params'].append([r_key,rule_param[r_key]])
+    return normalized
+
+
+def normalize_rules(channel_config):
+    return [normalize_rule(rule) for rule in channel_config.get('rules',[])]
+
+
+def encode_config(channel_config):
+    payload = json.dumps({"config":channel_config,"rules":normalize_rules(channel_config)},separators=(",",":")).encode("utf-8")
+    if len(payload) > CONFIG_BLOB_COMPRESS_SIZE:
+        return bytes([CONFIG_BLOB_FORMAT,ENCODING_ZLIB_JSON]) + zlib.compress(payload,CONFIG_BLOB_COMPRESS_LEVEL)
+    return bytes([CONFIG_BLOB_FORMAT,ENCODING_JSON]) + payload
+
+
+def decode_config(config_blob):
+    # Returns (channel config, normalized rules)
+    if len(config_blob) < 2 or config_blob[0] != CONFIG_BLOB_FORMAT:
+        raise ValueError("Unsupported config_blob format %s" % (config_blob[0] if len(config_blob) > 0 else None))
+
+    if config_blob[1] == ENCODING_ZLIB_JSON:
+        payload = zlib.decompress(config_blob[2:])
+    elif config_blob[1] == ENCODING_JSON:
+        payload = config_blob[2:]
+    else:
+        raise ValueError("Unsupported config_blob encoding %s" % (config_blob[1]))
+
+    blob = json.loads(payload)
+    return blob['config'],blob['rules']
+
+
+def config_from_item(channel_item):
+    # Returns (channel config, normalized rules) of a channel item, the normalized rules are None for items
+    # without config_blob
+    if "config_blob" in channel_item:
+        try:
+            return decode_config(channel_item['config_blob']['B'])
+        except Exception as e:
+            LOGGER.warning("Unable to decode config_blob of channel %s, reading the config attributes: %s" % (channel_item.get('channelid',{}).get('S'),e))
+
+    channel_config = pois_dynamodb.from_dynamodb_item(channel_item)
+    channel_config.pop('config_blob',None)
+    return channel_config,None
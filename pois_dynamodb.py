@@ -0,0 +1,157 @@
+'''
+Conversion between DynamoDB JSON and plain python values, for the channel configs both handlers read and write.
+
+    to_dynamodb_item({"rules":[{"type":"delete"}],"stateful":True})
+        = {"rules":{"L":[{"M":{"type":{"S":"delete"}}}]},"stateful":{"BOOL":True}}
+    from_dynamodb_item() is the reverse
+
+Every DynamoDB type is handled: S, N, B, BOOL, NULL, M, L, SS, NS and BS. N values become int when they are whole
+numbers written without a decimal point or exponent, float otherwise. Sets become lists so the values can be
+returned as JSON.
+
+Both directions walk nested maps and lists with an explicit stack, so each value is visited once however deep
+or large the config is, and neither modifies its argument.
+
+This file is bundled with both Lambda functions by the CloudFormation file copier.
+'''
+
+import decimal
+import math
+
+
+def number_from_dynamodb(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def number_to_dynamodb(value):
+    if isinstance(value,float) and (math.isnan(value) or math.isinf(value)):
+        raise ValueError("DynamoDB numbers can't be NaN or infinity, got %s" % (value))
+    return str(value)
+
+
+SCALAR_FROM_DYNAMODB = {
+    "S":lambda value: value,
+    "N":number_from_dynamodb,
+    "B":lambda value: value,
+    "BOOL":lambda value: value,
+    "NULL":lambda value: None,
+    "SS":list,
+    "NS":lambda value: [number_from_dynamodb(v) for v in value],
+    "BS":list
+}
+
+
+def python_value(dynamodb_value,pending):
+    # Maps and lists are returned empty and queued on pending, to be filled by the caller's loop
+    for value_type,value in dynamodb_value.items():
+        if value_type == "S":
+            return value
+        elif value_type == "M":
+            python_map = dict()
+            pending.append((value,python_map))
+            return python_map
+        elif value_type == "L":
+            python_list = []
+            pending.append((value,python_list))
+            return python_list
+        convert = SCALAR_FROM_DYNAMODB.get(value_type)
+        if convert is None:
+            raise ValueError("Unsupported DynamoDB type %s" % (value_type))
+        return convert(value)
+    raise ValueError("DynamoDB attribute value without a type")
+
+
+def from_dynamodb(dynamodb_value):
+    # Python value of one DynamoDB attribute value, ie. {"L":[{"S":"a"}]} = ["a"]
+    pending = []
+    result = python_value(dynamodb_value,pending)
+    while len(pending) > 0:
+        source,target = pending.pop()
+        if type(target) is dict:
+            for k,v in source.items():
+                target[k] = python_value(v,pending)
+        else:
+            for v in source:
+                target.append(python_value(v,pending))
+    return result
+
+
+def from_dynamodb_item(item):
+    # Python dict of a DynamoDB item
+    return from_dynamodb({"M":item})
+
+
+def set_to_dynamodb(value):
+    if len(value) == 0:
+        raise ValueError("DynamoDB sets can't be empty")
+    if all(isinstance(v,str) for v in value):
+        return {"SS":sorted(value)}
+    if all(isinstance(v,(int,float,decimal.Decimal)) and not isinstance(v,bool) for v in value):
+        return {"NS":[number_to_dynamodb(v) for v in sorted(value)]}
+    if all(isinstance(v,bytes) for v in value):
+        return {"BS":sorted(value)}
+    raise TypeError("DynamoDB sets hold strings, numbers or bytes, got %s" % (sorted(type(v).__name__ for v in value)))
+
+
+def attribute_value(value,pending):
+    # Maps and lists are returned empty and queued on pending, to be filled by the caller's loop.
+    # Exact types are checked first as they are what json.loads returns, subclasses go through isinstance
+    value_type = type(value)
+    if value_type is str:
+        return {"S":value}
+    elif value_type is dict:
+        dynamodb_map = dict()
+        pending.append((value,dynamodb_map))
+        return {"M":dynamodb_map}
+    elif value_type is list:
+        dynamodb_list = []
+        pending.append((value,dynamodb_list))
+        return {"L":dynamodb_list}
+
+    # bool before the numbers, bool is a subclass of int
+    if isinstance(value,str):
+        return {"S":str(value)}
+    elif isinstance(value,bool):
+        return {"BOOL":bool(value)}
+    elif isinstance(value,(int,float,decimal.Decimal)):
+        return {"N":number_to_dynamodb(value)}
+    elif value is None:
+        return {"NULL":True}
+    elif isinstance(value,dict):
+        dynamodb_map = dict()
+        pending.append((value,dynamodb_map))
+        return {"M":dynamodb_map}
+    elif isinstance(value,(list,tuple)):
+        dynamodb_list = []
+        pending.append((value,dynamodb_list))
+        return {"L":dynamodb_list}
+    elif isinstance(value,(bytes,bytearray)):
+        return {"B":bytes(value)}
+    elif isinstance(value,(set,frozenset)):
+        return set_to_dynamodb(value)
+    raise TypeError("Unable to store a %s in DynamoDB" % (value_type.__name__))
+
+
+def to_dynamodb(value):
+    # DynamoDB attribute value of a python value, ie. ["a"] = {"L":[{"S":"a"}]}
+    pending = []
+    result = attribute_value(value,pending)
+    while len(pending) > 0:
+        source,target = pending.pop()
+        if type(target) is dict:
+            for k,v in source.items():
+                if type(k) is not str:
+                    raise TypeError("DynamoDB map keys must be strings, got %s" % (type(k).__name__))
+                target[k] = attribute_value(v,pending)
+        else:
+            for v in source:
+                target.append(attribute_value(v,pending))
+    return result
+
+
+def to_dynamodb_item(python_dict):
+    # DynamoDB item of a python dict
+    return to_dynamodb(python_dict)['M']
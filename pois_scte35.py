@@ -0,0 +1,181 @@
+'''
+SCTE35 encoder for the time_signal cues the ESAM processor sends back on replace.
+
+Builds a splice_info_section with a time_signal command and one segmentation_descriptor straight from
+a TimeSignalFields, without going through the threefive object model. The output is byte for byte what
+threefive.Cue.encode() returns for the same fields (see pois-benchmark.py --codec).
+
+Times are in ticks of the 90kHz clock. This file is bundled with both Lambda functions by the CloudFormation
+file copier.
+'''
+
+import binascii
+import struct
+
+# CRC-32/MPEG-2: polynomial 0x04C11DB7, initial value 0xFFFFFFFF, no reflection, no final xor
+CRC32_MPEG_POLYNOMIAL = 0x04C11DB7
+
+
+def crc32_mpeg_table():
+    table = []
+    for i in range(0,256):
+        crc = i << 24
+        for bit in range(0,8):
+            if crc & 0x80000000:
+                crc = ((crc << 1) ^ CRC32_MPEG_POLYNOMIAL) & 0xFFFFFFFF
+            else:
+                crc = (crc << 1) & 0xFFFFFFFF
+        table.append(crc)
+    return tuple(table)
+
+
+CRC32_MPEG_TABLE = crc32_mpeg_table()
+
+
+def crc32_mpeg(data):
+    crc = 0xFFFFFFFF
+    table = CRC32_MPEG_TABLE
+    for byte in data:
+        crc = table[byte ^ (crc >> 24)] ^ ((crc << 8) & 0xFFFFFFFF)
+    return crc
+
+
+# segmentation_type_ids that carry sub_segment_num and sub_segments_expected
+SUB_SEGMENT_TYPE_IDS = frozenset([0x30,0x32,0x34,0x36,0x38,0x3A,0x44,0x46])
+
+TIME_SIGNAL_COMMAND_TYPE = 6
+SEGMENTATION_DESCRIPTOR_TAG = 2
+CUEI_IDENTIFIER = b"CUEI"
+
+# table_id, flags and section_length, protocol_version, encryption and pts_adjustment, cw_index, tier and
+# splice_command_length, splice_command_type
+INFO_SECTION_LENGTH = 14
+DESCRIPTOR_LOOP_LENGTH_LENGTH = 2
+CRC_LENGTH = 4
+
+
+class TimeSignalFields(object):
+    # Everything needed to encode a time_signal with one segmentation_descriptor.
+    # pts_time_ticks None is an immediate time_signal (time_specified_flag 0),
+    # segmentation_duration_ticks None leaves the duration out (segmentation_duration_flag 0)
+    __slots__ = ('pts_time_ticks','pts_adjustment_ticks','cw_index','tier','sap_type',
+                 'segmentation_event_id','segmentation_event_cancel_indicator','segmentation_event_id_compliance_indicator',
+                 'segmentation_duration_ticks','delivery_not_restricted_flag','web_delivery_allowed_flag',
+                 'no_regional_blackout_flag','archive_allowed_flag','device_restrictions',
+                 'segmentation_upid_type','segmentation_upid','segmentation_type_id',
+                 'segment_num','segments_expected','sub_segment_num','sub_segments_expected')
+
+    def __init__(self,pts_time_ticks=None,pts_adjustment_ticks=0,segmentation_event_id=1,segmentation_duration_ticks=None,
+                 segmentation_type_id=0x34,segmentation_upid_type=9,segmentation_upid=b"",segment_num=0,segments_expected=1,
+                 sub_segment_num=0,sub_segments_expected=0):
+        self.pts_time_ticks = pts_time_ticks
+        self.pts_adjustment_ticks = pts_adjustment_ticks
+        self.cw_index = 0
+        self.tier = 0xFFF
+        self.sap_type = 3
+        self.segmentation_event_id = segmentation_event_id
+        self.segmentation_event_cancel_indicator = False
+        self.segmentation_event_id_compliance_indicator = True
+        self.segmentation_duration_ticks = segmentation_duration_ticks
+        self.delivery_not_restricted_flag = False
+        self.web_delivery_allowed_flag = False
+        self.no_regional_blackout_flag = False
+        self.archive_allowed_flag = True
+        # 3 = No Restrictions
+        self.device_restrictions = 3
+        self.segmentation_upid_type = segmentation_upid_type
+        self.segmentation_upid = segmentation_upid
+        self.segmentation_type_id = segmentation_type_id
+        self.segment_num = segment_num
+        self.segments_expected = segments_expected
+        self.sub_segment_num = sub_segment_num
+        self.sub_segments_expected = sub_segments_expected
+
+
+def segmentation_descriptor_length(fields):
+    # bytes after descriptor_length: identifier, event id and flags, then the segmentation fields unless cancelled
+    length = 4 + 4 + 1
+    if not fields.segmentation_event_cancel_indicator:
+        length += 1 + 2 + len(fields.segmentation_upid) + 3
+        if fields.segmentation_duration_ticks is not None:
+            length += 5
+        if fields.segmentation_type_id in SUB_SEGMENT_TYPE_IDS:
+            length += 2
+    return length
+
+
+def encode_time_signal(fields):
+    # Returns the base64 SCTE35 of fields. Every field is written with struct into one buffer allocated at its
+    # final size, the CRC is computed over that buffer
+    command_length = 1 if fields.pts_time_ticks is None else 5
+    descriptor_length = segmentation_descriptor_length(fields)
+    descriptor_loop_length = 2 + descriptor_length
+    cue_length = INFO_SECTION_LENGTH + command_length + DESCRIPTOR_LOOP_LENGTH_LENGTH + descriptor_loop_length + CRC_LENGTH
+    cue = bytearray(cue_length)
+
+    # splice_info_section, section_syntax_indicator, private_indicator, encrypted_packet and encryption_algorithm are 0
+    section_length = cue_length - 3
+    pts_adjustment_ticks = fields.pts_adjustment_ticks & 0x1FFFFFFFF
+    struct.pack_into(">BHBBIBHBB",cue,0,
+        0xFC,
+        ((fields.sap_type & 0x3) << 12) | (section_length & 0xFFF),
+        0,
+        pts_adjustment_ticks >> 32,
+        pts_adjustment_ticks & 0xFFFFFFFF,
+        fields.cw_index & 0xFF,
+        ((fields.tier & 0xFFF) << 4) | (command_length >> 8),
+        command_length & 0xFF,
+        TIME_SIGNAL_COMMAND_TYPE
+    )
+    offset = INFO_SECTION_LENGTH
+
+    # time_signal, splice_time() with 6 (or 7) reserved bits set to 1
+    if fields.pts_time_ticks is None:
+        cue[offset] = 0x7F
+    else:
+        pts_time_ticks = fields.pts_time_ticks & 0x1FFFFFFFF
+        struct.pack_into(">BI",cue,offset,0xFE | (pts_time_ticks >> 32),pts_time_ticks & 0xFFFFFFFF)
+    offset += command_length
+
+    struct.pack_into(">HBB4sIB",cue,offset,
+        descriptor_loop_length,
+        SEGMENTATION_DESCRIPTOR_TAG,
+        descriptor_length,
+        CUEI_IDENTIFIER,
+        fields.segmentation_event_id & 0xFFFFFFFF,
+        (fields.segmentation_event_cancel_indicator << 7) | (fields.segmentation_event_id_compliance_indicator << 6) | 0x3F
+    )
+    offset += 2 + 2 + 4 + 4 + 1
+
+    if not fields.segmentation_event_cancel_indicator:
+        # program_segmentation_flag is always 1, there is no component loop
+        flags = 0x80 | ((fields.segmentation_duration_ticks is not None) << 6) | (fields.delivery_not_restricted_flag << 5)
+        if fields.delivery_not_restricted_flag:
+            flags |= 0x1F
+        else:
+            flags |= (fields.web_delivery_allowed_flag << 4) | (fields.no_regional_blackout_flag << 3) | (fields.archive_allowed_flag << 2) | (fields.device_restrictions & 0x3)
+        cue[offset] = flags
+        offset += 1
+
+        if fields.segmentation_duration_ticks is not None:
+            segmentation_duration_ticks = fields.segmentation_duration_ticks & 0xFFFFFFFFFF
+            struct.pack_into(">BI",cue,offset,segmentation_duration_ticks >> 32,segmentation_duration_ticks & 0xFFFFFFFF)
+            offset += 5
+
+        upid_length = len(fields.segmentation_upid)
+        struct.pack_into(">BB%dsBBB" % (upid_length),cue,offset,
+            fields.segmentation_upid_type,
+            upid_length,
+            fields.segmentation_upid,
+            fields.segmentation_type_id,
+            fields.segment_num,
+            fields.segments_expected
+        )
+        offset += 2 + upid_length + 3
+
+        if fields.segmentation_type_id in SUB_SEGMENT_TYPE_IDS:
+            struct.pack_into(">BB",cue,offset,fields.sub_segment_num,fields.sub_segments_expected)
+            offset += 2
+
+    struct.pack_into(">I",cue,offset,crc32_mpeg(memoryview(cue)[:offset]))
+    return binascii.b2a_base64(cue,newline=False).decode("ascii")
@@ -0,0 +1,466 @@
+'''
+Storage backends for the POIS channel, state and schedule tables.
+
+Every backend stores items in DynamoDB JSON, keyed by table name and channelid, so the
+Lambda handlers work the same whichever backend is configured:
+
+    POIS_STORAGE=dynamodb   (default) Amazon DynamoDB through boto3
+    POIS_STORAGE=memory     in-process dicts, nothing is persisted
+    POIS_STORAGE=sqlite     a local SQLite database in WAL mode, path set with POIS_SQLITE_PATH
+
+Stateful locks are items of the state table with the lock end time twice: signal_expiry_time (S), read by the
+processor, and expires_at (N), used for the conditional lock writes and as the DynamoDB TTL attribute so expired
+locks are removed by DynamoDB. Items without a numeric expires_at aren't locked. acquire_lock() checks and takes a
+lock in one step on every backend.
+
+scan() returns the whole table. scan_page() returns one page and the channelid to continue after, pages are
+in channelid order on the memory and SQLite backends and in DynamoDB's hash order on DynamoDB.
+scan_segments() reads DynamoDB scan segments in parallel, the local backends scan in one pass.
+
+This file is bundled with both Lambda functions by the CloudFormation file copier.
+'''
+
+import base64
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+LOGGER = logging.getLogger()
+
+# BatchGetItem accepts up to 100 keys per request
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_RETRIES = 5
+
+# BatchWriteItem accepts up to 25 put or delete requests
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_RETRIES = 5
+
+
+def lock_item(channel,expiry_time):
+    return {"channelid":{"S":channel},"signal_expiry_time":{"S":str(expiry_time)},"expires_at":{"N":str(expiry_time)}}
+
+
+def lock_expired(item,time_now):
+    # items without a numeric expires_at have no lock, as in the DynamoDB acquire_lock condition
+    if item is None or "N" not in item.get('expires_at',dict()):
+        return True
+    return int(item['expires_at']['N']) <= time_now
+
+
+def project_item(item,attributes):
+    if attributes is None:
+        return item
+    return {k:v for k,v in item.items() if k in attributes}
+
+
+class DynamoDBStorage(object):
+
+    def __init__(self,db_client=None,connect_timeout=2,read_timeout=5):
+        if db_client is None:
+            # boto3 is only needed by this backend
+            import boto3
+            import botocore.config
+
+            # Keep-alive connections avoid a new TLS handshake on warm invocations
+            db_client = boto3.client('dynamodb',config=botocore.config.Config(
+                max_pool_connections=int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS','10')),
+                tcp_keepalive=True,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                retries={'max_attempts':3,'mode':'standard'}
+            ))
+        self.db_client = db_client
+        # cleared when botocore doesn't know ReturnValuesOnConditionCheckFailure
+        self.return_old_on_condition_failure = True
+
+    def projection(self,attributes):
+        # attribute names go through ExpressionAttributeNames so reserved words can be projected
+        if attributes is None:
+            return dict()
+        names = dict()
+        for i in range(0,len(attributes)):
+            names["#a%s" % (i)] = attributes[i]
+        return {"ProjectionExpression":",".join(names.keys()),"ExpressionAttributeNames":names}
+
+    def get_item(self,table_name,channel,attributes=None):
+        response = self.db_client.get_item(TableName=table_name,Key={"channelid":{"S":channel}},**self.projection(attributes))
+        return response.get('Item')
+
+    def batch_get_items(self,table_keys,attributes=None):
+        # table_keys is {table: [channelid,...]}, attributes is {table: [attribute,...]} for projected tables.
+        # Returns {table: {channelid: item}} for the items that exist, unprocessed keys are retried with backoff
+        attributes = attributes or dict()
+        found_items = dict()
+
+        keys = []
+        for table_name in table_keys:
+            found_items[table_name] = dict()
+            for channel in table_keys[table_name]:
+                keys.append((table_name,channel))
+
+        for chunk_start in range(0,len(keys),BATCH_GET_MAX_KEYS):
+            request_items = dict()
+            for table_name,channel in keys[chunk_start:chunk_start+BATCH_GET_MAX_KEYS]:
+                if table_name not in request_items:
+                    request_items[table_name] = {"Keys":[]}
+                    if table_name in attributes:
+                        # channelid is needed to match the items to their keys
+                        request_items[table_name].update(self.projection(["channelid"] + list(attributes[table_name])))
+                request_items[table_name]['Keys'].append({"channelid":{"S":channel}})
+
+            attempt = 0
+            while len(request_items) > 0:
+                response = self.db_client.batch_get_item(RequestItems=request_items)
+                for table_name,items in response.get('Responses',{}).items():
+                    for item in items:
+                        found_items[table_name][item['channelid']['S']] = item
+
+                request_items = response.get('UnprocessedKeys') or dict()
+                if len(request_items) > 0:
+                    attempt += 1
+                    if attempt > BATCH_GET_RETRIES:
+                        raise Exception("Unable to get all items from DynamoDB, keys still unprocessed after %s retries" % (BATCH_GET_RETRIES))
+                    time.sleep(0.025 * (2 ** attempt))
+
+        return found_items
+
+    def put_item(self,table_name,item):
+        return self.db_client.put_item(TableName=table_name,Item=item)
+
+    def delete_item(self,table_name,channel):
+        return self.db_client.delete_item(TableName=table_name,Key={"channelid":{"S":channel}})
+
+    def batch_put_items(self,table_name,items):
+        # BatchWriteItem in chunks of 25, unprocessed items are retried with backoff. Items must have different
+        # channelids. Returns {channelid: error} for the items that weren't written, a failed chunk doesn't stop
+        # the chunks after it
+        failed_items = dict()
+        for chunk_start in range(0,len(items),BATCH_WRITE_MAX_ITEMS):
+            request_items = {table_name:[{"PutRequest":{"Item":item}} for item in items[chunk_start:chunk_start+BATCH_WRITE_MAX_ITEMS]]}
+
+            attempt = 0
+            while len(request_items) > 0:
+                try:
+                    response = self.db_client.batch_write_item(RequestItems=request_items)
+                except Exception as e:
+                    for request in request_items[table_name]:
+                        failed_items[request['PutRequest']['Item']['channelid']['S']] = str(e)
+                    break
+
+                request_items = response.get('UnprocessedItems') or dict()
+                if len(request_items) > 0:
+                    attempt += 1
+                    if attempt > BATCH_WRITE_RETRIES:
+                        for request in request_items[table_name]:
+                            failed_items[request['PutRequest']['Item']['channelid']['S']] = "still unprocessed after %s retries" % (BATCH_WRITE_RETRIES)
+                        break
+                    time.sleep(0.025 * (2 ** attempt))
+
+        return failed_items
+
+    def scan_page(self,table_name,attributes=None,limit=None,start_channel=None,segment=None,total_segments=None):
+        # One Scan call, at most limit items and never more than 1 MB. Returns (items, channelid of the
+        # LastEvaluatedKey), the channelid is None once the table or segment has been read
+        parameters = self.projection(attributes)
+        if limit is not None:
+            parameters['Limit'] = limit
+        if start_channel is not None:
+            parameters['ExclusiveStartKey'] = {"channelid":{"S":start_channel}}
+        if total_segments is not None:
+            parameters['Segment'] = segment
+            parameters['TotalSegments'] = total_segments
+        response = self.db_client.scan(TableName=table_name,**parameters)
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if last_evaluated_key is None:
+            return response['Items'],None
+        return response['Items'],last_evaluated_key['channelid']['S']
+
+    def scan(self,table_name,attributes=None,segment=None,total_segments=None):
+        # follows LastEvaluatedKey, a single Scan call stops at 1 MB of items
+        items = []
+        start_channel = None
+        while True:
+            page_items,start_channel = self.scan_page(table_name,attributes,None,start_channel,segment,total_segments)
+            items.extend(page_items)
+            if start_channel is None:
+                return items
+
+    def scan_segments(self,table_name,total_segments,attributes=None):
+        # Parallel scan, one thread per segment. Each segment is a full paginated scan of its part of the table
+        if total_segments <= 1:
+            return self.scan(table_name,attributes)
+        # only the control API's full exports use threads
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=total_segments) as executor:
+            futures = [executor.submit(self.scan,table_name,attributes,segment,total_segments) for segment in range(0,total_segments)]
+            items = []
+            for future in futures:
+                items.extend(future.result())
+        return items
+
+    def acquire_lock(self,table_name,channel,expiry_time,time_now):
+        # One conditional UpdateItem. Returns (True, new item) if the lock was free or expired at time_now,
+        # (False, current item) if another signal holds it. An expires_at that is missing or isn't a number is no lock
+        update = {
+            "TableName":table_name,
+            "Key":{"channelid":{"S":channel}},
+            "UpdateExpression":"SET signal_expiry_time = :signal_expiry_time, expires_at = :expires_at",
+            "ConditionExpression":"attribute_not_exists(expires_at) OR NOT attribute_type(expires_at, :number_type) OR expires_at <= :time_now",
+            "ExpressionAttributeValues":{
+                ":signal_expiry_time":{"S":str(expiry_time)},
+                ":expires_at":{"N":str(expiry_time)},
+                ":time_now":{"N":str(time_now)},
+                ":number_type":{"S":"N"}
+            },
+            "ReturnValues":"ALL_NEW"
+        }
+        if self.return_old_on_condition_failure:
+            update['ReturnValuesOnConditionCheckFailure'] = "ALL_OLD"
+        try:
+            try:
+                response = self.db_client.update_item(**update)
+            except Exception as e:
+                # botocore older than 1.31, as bundled with the python3.8 Lambda runtime, rejects the parameter
+                # before sending the request. The current item is then read with a GetItem
+                if "ReturnValuesOnConditionCheckFailure" not in update or type(e).__name__ != "ParamValidationError":
+                    raise
+                LOGGER.warning("ReturnValuesOnConditionCheckFailure isn't supported by this botocore, reading the current lock item after a failed acquire")
+                self.return_old_on_condition_failure = False
+                del update['ReturnValuesOnConditionCheckFailure']
+                response = self.db_client.update_item(**update)
+            return True,response['Attributes']
+        except self.db_client.exceptions.ConditionalCheckFailedException as e:
+            item = e.response.get('Item')
+            if item is None:
+                # the current item isn't returned by older botocore versions and DynamoDB endpoints
+                item = self.get_item(table_name,channel)
+            return False,item
+
+
+class MemoryStorage(object):
+    # Items are copied on the way in and out so callers can't modify the stored items
+
+    def __init__(self):
+        self.tables = dict()
+        self.lock = threading.Lock()
+
+    def table(self,table_name):
+        return self.tables.setdefault(table_name,dict())
+
+    def get_item(self,table_name,channel,attributes=None):
+        with self.lock:
+            item = self.table(table_name).get(channel)
+            if item is None:
+                return None
+            return copy.deepcopy(project_item(item,attributes))
+
+    def batch_get_items(self,table_keys,attributes=None):
+        attributes = attributes or dict()
+        found_items = dict()
+        for table_name in table_keys:
+            found_items[table_name] = dict()
+            table_attributes = None
+            if table_name in attributes:
+                table_attributes = ["channelid"] + list(attributes[table_name])
+            for channel in table_keys[table_name]:
+                item = self.get_item(table_name,channel,table_attributes)
+                if item is not None:
+                    found_items[table_name][channel] = item
+        return found_items
+
+    def put_item(self,table_name,item):
+        with self.lock:
+            self.table(table_name)[item['channelid']['S']] = copy.deepcopy(item)
+        return {}
+
+    def batch_put_items(self,table_name,items):
+        with self.lock:
+            table = self.table(table_name)
+            for item in items:
+                table[item['channelid']['S']] = copy.deepcopy(item)
+        return {}
+
+    def delete_item(self,table_name,channel):
+        with self.lock:
+            self.table(table_name).pop(channel,None)
+        return {}
+
+    def scan(self,table_name,attributes=None):
+        with self.lock:
+            return [copy.deepcopy(project_item(item,attributes)) for item in self.table(table_name).values()]
+
+    def scan_page(self,table_name,attributes=None,limit=None,start_channel=None):
+        with self.lock:
+            table = self.table(table_name)
+            channels = sorted(channel for channel in table if start_channel is None or channel > start_channel)
+            if limit is None or len(channels) <= limit:
+                next_channel = None
+            else:
+                channels = channels[:limit]
+                next_channel = channels[-1]
+            return [copy.deepcopy(project_item(table[channel],attributes)) for channel in channels],next_channel
+
+    def scan_segments(self,table_name,total_segments,attributes=None):
+        # nothing to parallelise in memory
+        return self.scan(table_name,attributes)
+
+    def acquire_lock(self,table_name,channel,expiry_time,time_now):
+        with self.lock:
+            item = self.table(table_name).get(channel)
+            if not lock_expired(item,time_now):
+                return False,copy.deepcopy(item)
+            item = lock_item(channel,expiry_time)
+            self.table(table_name)[channel] = item
+            return True,copy.deepcopy(item)
+
+
+def item_to_json(item):
+    # SQLite keeps items as DynamoDB JSON text. Binary attributes are base64 encoded, as in DynamoDB's own JSON,
+    # only top level attributes can be binary
+    binary_attributes = [k for k,v in item.items() if "B" in v]
+    if len(binary_attributes) > 0:
+        item = dict(item)
+        for k in binary_attributes:
+            item[k] = {"B":base64.b64encode(item[k]['B']).decode("ascii")}
+    return json.dumps(item)
+
+
+def item_from_json(item_json):
+    item = json.loads(item_json)
+    for v in item.values():
+        if "B" in v:
+            v['B'] = base64.b64decode(v['B'])
+    return item
+
+
+class SQLiteStorage(object):
+    # One SQLite table holds every POIS table, items are stored as DynamoDB JSON text.
+    # WAL mode lets several server processes read while one of them writes
+
+    def __init__(self,path):
+        # sqlite3 is only needed by this backend
+        import sqlite3
+
+        self.connection = sqlite3.connect(path,timeout=5,isolation_level=None,check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pois_items (table_name TEXT NOT NULL, channelid TEXT NOT NULL, item TEXT NOT NULL, PRIMARY KEY (table_name, channelid)) WITHOUT ROWID")
+        self.lock = threading.Lock()
+
+    def get_item(self,table_name,channel,attributes=None):
+        with self.lock:
+            row = self.connection.execute("SELECT item FROM pois_items WHERE table_name = ? AND channelid = ?",(table_name,channel)).fetchone()
+        if row is None:
+            return None
+        return project_item(item_from_json(row[0]),attributes)
+
+    def batch_get_items(self,table_keys,attributes=None):
+        attributes = attributes or dict()
+        found_items = dict()
+        for table_name in table_keys:
+            found_items[table_name] = dict()
+            channels = list(table_keys[table_name])
+            table_attributes = None
+            if table_name in attributes:
+                table_attributes = ["channelid"] + list(attributes[table_name])
+
+            # stay under the default SQLITE_MAX_VARIABLE_NUMBER
+            for chunk_start in range(0,len(channels),BATCH_GET_MAX_KEYS):
+                chunk = channels[chunk_start:chunk_start+BATCH_GET_MAX_KEYS]
+                query = "SELECT channelid, item FROM pois_items WHERE table_name = ? AND channelid IN (%s)" % (",".join("?" * len(chunk)))
+                with self.lock:
+                    rows = self.connection.execute(query,[table_name] + chunk).fetchall()
+                for channel,item in rows:
+                    found_items[table_name][channel] = project_item(item_from_json(item),table_attributes)
+        return found_items
+
+    def put_item(self,table_name,item):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO pois_items (table_name, channelid, item) VALUES (?, ?, ?)",(table_name,item['channelid']['S'],item_to_json(item)))
+        return {}
+
+    def batch_put_items(self,table_name,items):
+        # one transaction, so either every item is written or none is
+        rows = [(table_name,item['channelid']['S'],item_to_json(item)) for item in items]
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany("INSERT OR REPLACE INTO pois_items (table_name, channelid, item) VALUES (?, ?, ?)",rows)
+                self.connection.execute("COMMIT")
+            except:
+                self.connection.execute("ROLLBACK")
+                raise
+        return {}
+
+    def delete_item(self,table_name,channel):
+        with self.lock:
+            self.connection.execute("DELETE FROM pois_items WHERE table_name = ? AND channelid = ?",(table_name,channel))
+        return {}
+
+    def scan(self,table_name,attributes=None):
+        with self.lock:
+            rows = self.connection.execute("SELECT item FROM pois_items WHERE table_name = ? ORDER BY channelid",(table_name,)).fetchall()
+        return [project_item(item_from_json(row[0]),attributes) for row in rows]
+
+    def scan_page(self,table_name,attributes=None,limit=None,start_channel=None):
+        # one extra row is read to know whether there is a next page
+        query = "SELECT channelid, item FROM pois_items WHERE table_name = ? AND channelid > ? ORDER BY channelid"
+        parameters = [table_name,start_channel or ""]
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit + 1)
+        with self.lock:
+            rows = self.connection.execute(query,parameters).fetchall()
+        next_channel = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_channel = rows[-1][0]
+        return [project_item(item_from_json(item),attributes) for channel,item in rows],next_channel
+
+    def scan_segments(self,table_name,total_segments,attributes=None):
+        # the rows come from one local file, a single query is faster than several threads sharing the connection
+        return self.scan(table_name,attributes)
+
+    def acquire_lock(self,table_name,channel,expiry_time,time_now):
+        # BEGIN IMMEDIATE takes the write lock before the read, so processes sharing the database can't both
+        # see the lock as expired
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT item FROM pois_items WHERE table_name = ? AND channelid = ?",(table_name,channel)).fetchone()
+                item = item_from_json(row[0]) if row is not None else None
+                if not lock_expired(item,time_now):
+                    self.connection.execute("COMMIT")
+                    return False,item
+                item = lock_item(channel,expiry_time)
+                self.connection.execute("INSERT OR REPLACE INTO pois_items (table_name, channelid, item) VALUES (?, ?, ?)",(table_name,channel,item_to_json(item)))
+                self.connection.execute("COMMIT")
+                return True,item
+            except:
+                self.connection.execute("ROLLBACK")
+                raise
+
+
+MEMORY_STORAGE = None
+
+
+def storage_from_environment(connect_timeout=2,read_timeout=5):
+    # connect_timeout and read_timeout only apply to the DynamoDB backend
+    storage_type = os.environ.get('POIS_STORAGE','dynamodb').lower()
+
+    if storage_type == "dynamodb":
+        return DynamoDBStorage(connect_timeout=connect_timeout,read_timeout=read_timeout)
+    elif storage_type == "memory":
+        # both handlers share one store when they run in the same process
+        global MEMORY_STORAGE
+        if MEMORY_STORAGE is None:
+            MEMORY_STORAGE = MemoryStorage()
+        return MEMORY_STORAGE
+    elif storage_type == "sqlite":
+        return SQLiteStorage(os.environ.get('POIS_SQLITE_PATH','/tmp/pois.db'))
+
+    raise ValueError("POIS_STORAGE must be one of dynamodb, memory, sqlite, got %s" % (storage_type))
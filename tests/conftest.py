@@ -0,0 +1,83 @@
+# Shared fixtures of the test suite. The Lambda handlers are loaded by path, the way pois-local-server.py does, with
+# the in-memory storage backend, so no AWS account or network access is needed. threefive and xmltodict are
+# imported from the Lambda layer zips of the repo when they aren't installed
+import base64
+import copy
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPO_DIR)
+for layer_zip,module_name in (("threefive.zip","threefive"),("xmltodict.zip","xmltodict")):
+    if importlib.util.find_spec(module_name) is None:
+        sys.path.append(os.path.join(REPO_DIR,layer_zip,"python","lib","python3.8","site-packages"))
+
+import xmltodict
+
+# The handlers read these when they are loaded
+os.environ['POIS_STORAGE'] = "memory"
+os.environ.setdefault('CHANNELDB','POIS-channels-test')
+os.environ.setdefault('SCHEDULEDB','POIS-schedules-test')
+os.environ.setdefault('STATEDB','POIS-state-test')
+
+
+def load_module(module_name,file_name):
+    # The Lambda sources have dashes in their file names, so load them by path
+    spec = importlib.util.spec_from_file_location(module_name,os.path.join(REPO_DIR,file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def esam_processor():
+    return load_module("esam_processor","esam-processor.py")
+
+
+@pytest.fixture(scope="session")
+def pois_control(esam_processor):
+    return load_module("pois_control","pois-control.py")
+
+
+@pytest.fixture(scope="session")
+def corpus():
+    return load_module("pois_scte35_corpus","pois-scte35-corpus.py")
+
+
+@pytest.fixture(scope="session")
+def spe_template():
+    with open(os.path.join(REPO_DIR,"spe.json")) as spe_file:
+        return json.load(spe_file)
+
+
+@pytest.fixture
+def configure_channel(pois_control):
+    # PUTs a channel config through the control API, the processor caches are per channel so every test uses
+    # channels of its own
+    def configure(channel,channel_config):
+        response = pois_control.lambda_handler({"httpMethod":"PUT","path":"/pois/channels/%s" % (channel),"body":json.dumps(channel_config)},None)
+        assert response['statusCode'] == 200, response['body']
+    return configure
+
+
+@pytest.fixture
+def send_signal(esam_processor,spe_template):
+    # Sends one AcquiredSignal of cue, bytes or base64, to the processor and returns the parsed ResponseSignal and
+    # StatusCode
+    def send(channel,signal_id,cue):
+        if isinstance(cue,bytes):
+            cue = base64.b64encode(cue).decode("ascii")
+        spe = copy.deepcopy(spe_template)
+        acq_signal = spe['SignalProcessingEvent']['AcquiredSignal']
+        acq_signal['@acquisitionPointIdentity'] = channel
+        acq_signal['@acquisitionSignalID'] = signal_id
+        acq_signal['sig:BinaryData']['#text'] = cue
+        response = esam_processor.lambda_handler({"body":xmltodict.unparse(spe)},None)
+        assert response['statusCode'] == 200
+        notification = xmltodict.parse(response['body'])['SignalProcessingNotification']
+        return notification['ResponseSignal'],notification['StatusCode']
+    return send
@@ -0,0 +1,67 @@
+import base64
+import random
+
+import pois_scte35
+import threefive
+
+# avail_descriptor, not a segmentation descriptor so it has no segmentation_type_id
+AVAIL_DESCRIPTOR = b"\x00\x08CUEI\x00\x00\x00\x01"
+
+NO_MATCH_RULES = [{"type":"delete","condition":{"property":"splice_command_type","operator":"=","value":"5"}}]
+
+
+def priority_config(descriptor_priority):
+    return {"default_behavior":"noop","esam_version":"2013","descriptor_priority":descriptor_priority,"rules":NO_MATCH_RULES}
+
+
+def placement_opportunity_start(corpus):
+    return corpus.segmentation_descriptor(pois_scte35.TimeSignalFields(
+        pts_time_ticks=0x72bd0050,segmentation_event_id=0x4800008e,segmentation_duration_ticks=60 * 90000,segmentation_type_id=0x34,
+        segmentation_upid_type=0x08,segmentation_upid=b"\x00\x00\x00\x00\x2c\xa0\xa1\x8a"))
+
+
+def replaced_type_ids(response_signal):
+    cue = threefive.Cue(response_signal['sig:BinaryData']['#text'])
+    cue.decode()
+    return [descriptor['segmentation_type_id'] for descriptor in cue.get()['descriptors']]
+
+
+def test_cancel_cue_falls_back_to_default(corpus,configure_channel,send_signal):
+    configure_channel("priority-cancel",priority_config("52,48"))
+    response_signal,status_code = send_signal("priority-cancel","cancel-1",corpus.time_signal_cancel(random.Random(1)))
+    assert response_signal['@action'] == "noop"
+    assert status_code['@classCode'] == "0"
+
+
+def test_non_segmentation_descriptor_is_skipped(corpus,configure_channel,send_signal):
+    configure_channel("priority-avail",priority_config("52,48"))
+    cue = corpus.splice_info_section(6,corpus.splice_time(0x72bd0050),AVAIL_DESCRIPTOR + placement_opportunity_start(corpus))
+    response_signal,status_code = send_signal("priority-avail","avail-1",cue)
+    assert response_signal['@action'] == "replace"
+    assert replaced_type_ids(response_signal) == [0x34]
+
+
+def test_only_non_segmentation_descriptors(corpus,configure_channel,send_signal):
+    configure_channel("priority-avail-only",priority_config("52"))
+    cue = corpus.splice_info_section(6,corpus.splice_time(0x72bd0050),AVAIL_DESCRIPTOR)
+    response_signal,status_code = send_signal("priority-avail-only","avail-only-1",cue)
+    assert response_signal['@action'] == "noop"
+
+
+def test_values_that_are_not_numbers_are_ignored(esam_processor,corpus,configure_channel,send_signal):
+    assert esam_processor.compile_descriptor_priority({"descriptor_priority":"abc, 52,,48"}) == [52,48]
+    assert esam_processor.compile_descriptor_priority({"descriptor_priority":""}) == []
+    assert esam_processor.compile_descriptor_priority({}) == []
+
+    configure_channel("priority-bad-value",priority_config("abc,52"))
+    cue = corpus.splice_info_section(6,corpus.splice_time(0x72bd0050),placement_opportunity_start(corpus))
+    response_signal,status_code = send_signal("priority-bad-value","bad-value-1",cue)
+    assert response_signal['@action'] == "replace"
+
+
+def test_empty_descriptor_priority_is_no_priority(corpus,configure_channel,send_signal):
+    # the README template has "descriptor_priority":""
+    configure_channel("priority-empty",priority_config(""))
+    cue = corpus.splice_info_section(6,corpus.splice_time(0x72bd0050),placement_opportunity_start(corpus))
+    response_signal,status_code = send_signal("priority-empty","empty-1",cue)
+    assert response_signal['@action'] == "noop"
@@ -0,0 +1,42 @@
+import threefive
+
+import pois_scte35
+
+STATEFUL_REPLACE_RULES = [{"type":"replace","condition":{"property":"segmentation_type_id","operator":"=","value":"52"},"replace_params":[{"segmentation_duration":"60"}]}]
+
+
+def placement_opportunity(corpus,pts_time_ticks):
+    return corpus.time_signal(pts_time_ticks,[pois_scte35.TimeSignalFields(pts_time_ticks=pts_time_ticks,segmentation_event_id=1,
+        segmentation_duration_ticks=30 * 90000,segmentation_type_id=0x34,segmentation_upid_type=0x08,segmentation_upid=b"\x00" * 8)])
+
+
+def test_unregistered_channel(send_signal,corpus):
+    response_signal,status_code = send_signal("not-registered","unregistered-1",placement_opportunity(corpus,90000))
+    assert response_signal['@action'] == "noop"
+    # as before the rewrite, the no rules branch leaves classCode 0
+    assert status_code['@classCode'] == "0"
+    assert status_code['core:Note'] == "Channel not configured in POIS DB"
+
+
+def test_replace(configure_channel,send_signal,corpus):
+    configure_channel("replace",{"default_behavior":"noop","esam_version":"2013","rules":STATEFUL_REPLACE_RULES})
+    response_signal,status_code = send_signal("replace","replace-1",placement_opportunity(corpus,90000))
+    assert response_signal['@action'] == "replace"
+    cue = threefive.Cue(response_signal['sig:BinaryData']['#text'])
+    cue.decode()
+    assert cue.get()['descriptors'][0]['segmentation_duration'] == 60.0
+
+
+def test_stateful_lock(configure_channel,send_signal,corpus):
+    configure_channel("stateful",{"default_behavior":"noop","esam_version":"2013","mode":"stateful","rules":STATEFUL_REPLACE_RULES})
+    assert send_signal("stateful","stateful-1",placement_opportunity(corpus,90000))[0]['@action'] == "replace"
+    # a second placement opportunity inside the 60 seconds of the replaced one is deleted
+    response_signal,status_code = send_signal("stateful","stateful-2",placement_opportunity(corpus,180000))
+    assert response_signal['@action'] == "delete"
+    # retries of the replaced signal get the same replace back
+    assert send_signal("stateful","stateful-1",placement_opportunity(corpus,90000))[0]['@action'] == "replace"
+
+
+def test_default_behavior(configure_channel,send_signal,corpus):
+    configure_channel("default-delete",{"default_behavior":"delete","esam_version":"2013","rules":STATEFUL_REPLACE_RULES[:0]})
+    assert send_signal("default-delete","default-1",placement_opportunity(corpus,90000))[0]['@action'] == "delete"
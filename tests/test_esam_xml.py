@@ -0,0 +1,114 @@
+import copy
+import os
+
+import pytest
+import xmltodict
+
+from conftest import load_module
+
+SPN_ATTRIBUTES = {
+    "@xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+    "@xmlns:sig": "urn:cablelabs:md:xsd:signaling:3.0",
+    "@xmlns:core":"urn:cablelabs:md:xsd:core:3.0",
+    "@xsi:schemaLocation": "urn:cablelabs:iptvservices:esam:xsd:common:1 OC-SP-ESAM- API-I0x-Common.xsd",
+    "@xmlns": "urn:cablelabs:iptvservices:esam:xsd:common:1"
+}
+
+STATUS_CODES = [
+    dict(),
+    {"@classCode":0},
+    {"core:Note":"No conditioning rules at POIS, using default behavior","@classCode":0},
+    {"@classCode":2,"core:Note":["Unable to decode inbound SCTE35, using default behavior","<&> \"quoted\""]}
+]
+
+
+@pytest.fixture(scope="module",params=[False,True],ids=["compact","pretty"])
+def spn_processor(request,esam_processor):
+    if not request.param:
+        return esam_processor
+    os.environ['SPN_PRETTY'] = "true"
+    try:
+        return load_module("esam_processor_pretty","esam-processor.py")
+    finally:
+        del os.environ['SPN_PRETTY']
+
+
+def acquired_signals(spe_template):
+    acq_signal = spe_template['SignalProcessingEvent']['AcquiredSignal']
+    escaped = copy.deepcopy(acq_signal)
+    escaped['@acquisitionPointIdentity'] = "<channel & \"1\">"
+    escaped['@acquisitionSignalID'] = "it's\ta\nsignal"
+    one_stream_time = copy.deepcopy(acq_signal)
+    one_stream_time['sig:StreamTimes'] = {"sig:StreamTime":{"@timeType":"PTS","@timeValue":"1"}}
+    no_stream_times = copy.deepcopy(acq_signal)
+    no_stream_times['sig:StreamTimes'] = None
+    return [acq_signal,escaped,one_stream_time,no_stream_times]
+
+
+def baseline_spn(resp_signal,custom_status_code,pretty):
+    # the SignalProcessingNotification as esam-processor.py rendered it with xmltodict before the templates
+    spn = {"SignalProcessingNotification":dict(SPN_ATTRIBUTES)}
+    spn['SignalProcessingNotification']['ResponseSignal'] = resp_signal
+    if len(custom_status_code) > 0:
+        spn['SignalProcessingNotification']['StatusCode'] = custom_status_code
+    return xmltodict.unparse(spn,short_empty_elements=True,pretty=pretty)
+
+
+def baseline_response_signal(action,acq_signal,sig_binary_data):
+    resp_signal = {"@action":action,"@acquisitionPointIdentity":acq_signal['@acquisitionPointIdentity'],"@acquisitionSignalID":acq_signal['@acquisitionSignalID']}
+    if action == "delete":
+        resp_signal['@zoneIdentity'] = acq_signal['@zoneIdentity']
+        resp_signal['sig:UTCPoint'] = {"@utcPoint":acq_signal['sig:UTCPoint']['@utcPoint']}
+        resp_signal['sig:StreamTimes'] = acq_signal['sig:StreamTimes']
+    else:
+        resp_signal['@acquisitionTime'] = acq_signal['@acquisitionTime']
+        resp_signal['sig:UTCPoint'] = {"@utcPoint":acq_signal['sig:UTCPoint']['@utcPoint']}
+        resp_signal['sig:BinaryData'] = {"@signalType":acq_signal['sig:BinaryData']['@signalType'],"#text":sig_binary_data}
+    return resp_signal
+
+
+@pytest.mark.parametrize("action",["noop","delete","replace"])
+def test_spn_matches_baseline_rendering(spn_processor,spe_template,action):
+    replaced = "/DAsAAAAAAAAAP/wBQb+AAAAAAAWAhRDVUVJAAAAAX+/CQAAAAAAAAAAAAC3Jb0l"
+    for acq_signal in acquired_signals(spe_template):
+        if action == "delete":
+            resp_signal = spn_processor.spn_delete(acq_signal)
+        elif action == "noop":
+            resp_signal = spn_processor.spn_noop(acq_signal)
+        else:
+            resp_signal = spn_processor.spn_replace(acq_signal,replaced)
+        sig_binary_data = replaced if action == "replace" else acq_signal['sig:BinaryData']['#text']
+        for custom_status_code in STATUS_CODES:
+            spn_xml = spn_processor.SPN_HEAD + resp_signal + spn_processor.spn_status_code(custom_status_code) + spn_processor.SPN_TAIL
+            assert spn_xml == baseline_spn(baseline_response_signal(action,acq_signal,sig_binary_data),custom_status_code,spn_processor.SPN_PRETTY)
+
+
+def signal_processing_events(spe_template):
+    spe = copy.deepcopy(spe_template)
+    acq_signals = acquired_signals(spe_template)
+    events = []
+    for acq_signal in acq_signals:
+        spe['SignalProcessingEvent']['AcquiredSignal'] = acq_signal
+        events.append(xmltodict.unparse(spe))
+        events.append(xmltodict.unparse(spe,pretty=True))
+    spe['SignalProcessingEvent']['AcquiredSignal'] = acq_signals
+    events.append(xmltodict.unparse(spe,pretty=True))
+    return events
+
+
+def test_spe_parser_matches_xmltodict(esam_processor,spe_template):
+    for esam_payload_xml in signal_processing_events(spe_template):
+        expected = xmltodict.parse(esam_payload_xml)['SignalProcessingEvent']['AcquiredSignal']
+        if not isinstance(expected,list):
+            expected = [expected]
+        assert esam_processor.parse_signal_processing_event(esam_payload_xml) == expected
+
+
+@pytest.mark.parametrize("esam_payload_xml",[
+    "<SignalProcessingEvent/>",
+    "not xml",
+    '<SignalProcessingEvent xmlns="urn:cablelabs:iptvservices:esam:xsd:signal:1" xmlns:sig="urn:cablelabs:md:xsd:signaling:3.0"><AcquiredSignal><sig:StreamTimes><sig:Unexpected/></sig:StreamTimes></AcquiredSignal></SignalProcessingEvent>',
+    '<SignalProcessingEvent xmlns="urn:cablelabs:iptvservices:esam:xsd:signal:1" xmlns:sig="urn:cablelabs:md:xsd:signaling:3.0"><AcquiredSignal><sig:UTCPoint utcPoint="a"/><sig:UTCPoint utcPoint="b"/></AcquiredSignal></SignalProcessingEvent>'
+])
+def test_spe_parser_leaves_other_payloads_to_xmltodict(esam_processor,esam_payload_xml):
+    assert esam_processor.parse_signal_processing_event(esam_payload_xml) is None
@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+import pytest
+
+from conftest import load_module
+
+
+@pytest.fixture(scope="module")
+def local_server():
+    return load_module("pois_local_server","pois-local-server.py")
+
+
+def exchange(local_server,esam_processor,pois_control,request):
+    # Sends raw request bytes to a server on an ephemeral port and returns everything it answers before closing
+    async def run():
+        server = local_server.PoisHttpServer(esam_processor,pois_control)
+        listener = await asyncio.start_server(server.handle_connection,"127.0.0.1",0,limit=local_server.MAX_HEADER_BYTES)
+        port = listener.sockets[0].getsockname()[1]
+        reader,writer = await asyncio.open_connection("127.0.0.1",port)
+        writer.write(request)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(),5)
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        for executor in server.executors.values():
+            executor.shutdown()
+        return response
+    return asyncio.run(run())
+
+
+def test_empty_esam_body_is_rejected(local_server,esam_processor,pois_control):
+    response = exchange(local_server,esam_processor,pois_control,b"POST /esam HTTP/1.1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 400 ")
+    response = exchange(local_server,esam_processor,pois_control,b"POST /esam HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 400 ")
+
+
+def test_expect_100_continue(local_server,esam_processor,pois_control):
+    body = json.dumps({"default_behavior":"noop","esam_version":"2013","rules":[]}).encode("utf-8")
+    head = b"PUT /pois/channels/local-server-expect HTTP/1.1\r\nExpect: 100-continue\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % (len(body))
+    response = exchange(local_server,esam_processor,pois_control,head + body)
+    assert response.startswith(b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 ")
+
+
+def test_unsupported_expectation(local_server,esam_processor,pois_control):
+    response = exchange(local_server,esam_processor,pois_control,b"PUT /pois/channels/x HTTP/1.1\r\nExpect: bogus\r\nContent-Length: 2\r\n\r\n{}")
+    assert response.startswith(b"HTTP/1.1 417 ")
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+import pois_config
+import pois_storage
+
+
+def channel_config(channel,**overrides):
+    config = {"channelid":channel,"default_behavior":"noop","esam_version":"2013","rules":[{"type":"delete","condition":{"property":"segmentation_type_id","operator":"=","value":"52"}}]}
+    config.update(overrides)
+    return config
+
+
+@pytest.fixture(params=["memory","sqlite"])
+def control(request,tmp_path,monkeypatch,pois_control):
+    # pois-control.py on an empty store of its own
+    if request.param == "memory":
+        storage = pois_storage.MemoryStorage()
+    else:
+        storage = pois_storage.SQLiteStorage(str(tmp_path / "pois.db"))
+    monkeypatch.setattr(pois_control,"STORAGE",storage)
+
+    def call(method,path,body=None,query_string_parameters=None):
+        event = {"httpMethod":method,"path":path,"queryStringParameters":query_string_parameters}
+        if body is not None:
+            event['body'] = json.dumps(body)
+        response = pois_control.lambda_handler(event,None)
+        return response['statusCode'],json.loads(response['body'])
+    call.storage = storage
+    return call
+
+
+def test_bulk_put_and_list(control):
+    status_code,body = control("PUT","/pois/channels",[channel_config("ch%03d" % (i)) for i in range(0,60)])
+    assert status_code == 200, body
+    status_code,channels = control("GET","/pois/channels")
+    assert status_code == 200
+    assert sorted(channel['channelid'] for channel in channels) == ["ch%03d" % (i) for i in range(0,60)]
+
+    # an export imports back as is
+    status_code,body = control("PUT","/pois/channels",channels)
+    assert status_code == 200, body
+
+
+def test_bulk_put_rejects_invalid_channels(control):
+    status_code,body = control("PUT","/pois/channels",[channel_config("a"),channel_config("b",default_behavior="x"),channel_config("a"),{"rules":[]}])
+    assert status_code == 502
+    assert control("GET","/pois/channels")[1] == []
+
+
+def test_paging(control):
+    for i in range(0,23):
+        assert control("PUT","/pois/channels/ch%02d" % (i),channel_config("ch%02d" % (i)))[0] == 200
+
+    seen = []
+    next_page = None
+    while True:
+        query_string_parameters = {"limit":"5","fields":"channelid,default_behavior"}
+        if next_page is not None:
+            query_string_parameters['next'] = next_page
+        status_code,body = control("GET","/pois/channels",query_string_parameters=query_string_parameters)
+        assert status_code == 200
+        assert len(body['channels']) <= 5
+        seen.extend(body['channels'])
+        next_page = body['next']
+        if next_page is None:
+            break
+    assert [channel['channelid'] for channel in seen] == ["ch%02d" % (i) for i in range(0,23)]
+    assert set(seen[0]) == {"channelid","default_behavior"}
+    assert len(control("GET","/pois/channels",query_string_parameters={"segments":"4"})[1]) == 23
+
+
+@pytest.mark.parametrize("query_string_parameters",[{"limit":"0"},{"limit":"x"},{"next":"!!"},{"segments":"99"},{"limit":"2","segments":"2"}])
+def test_paging_rejects_bad_parameters(control,query_string_parameters):
+    assert control("GET","/pois/channels",query_string_parameters=query_string_parameters)[0] == 502
+
+
+def test_config_blob_round_trip(control,pois_control):
+    rules = [{"type":"replace","condition":{"property":"segmentation_type_id","operator":"-","value":"48-53"},"replace_params":[{"segmentation_duration":"60"}]}]
+    config = channel_config("blob",rules=rules,mode="stateful",descriptor_priority="52,48")
+    assert control("PUT","/pois/channels/blob",config)[0] == 200
+
+    item = control.storage.get_item(pois_control.CHANNELDB,"blob")
+    decoded_config,normalized_rules = pois_config.config_from_item(item)
+    assert decoded_config['rules'] == rules
+    assert normalized_rules == pois_config.normalize_rules(config)
+    status_code,body = control("GET","/pois/channels/blob")
+    assert status_code == 200
+    assert body['rules'] == rules and body['descriptor_priority'] == "52,48"
+
+
+@pytest.mark.parametrize("size",[10,2000])
+def test_config_blob_encodings(size):
+    config = channel_config("blob",rules=[{"type":"delete","condition":{"property":"segmentation_upid","operator":"=","value":"x" * size}}])
+    config_blob = pois_config.encode_config(config)
+    assert config_blob[1] == (pois_config.ENCODING_ZLIB_JSON if size > pois_config.CONFIG_BLOB_COMPRESS_SIZE else pois_config.ENCODING_JSON)
+    assert pois_config.decode_config(config_blob) == (config,pois_config.normalize_rules(config))
+    with pytest.raises(ValueError):
+        pois_config.decode_config(b"\x09" + config_blob[1:])
@@ -0,0 +1,90 @@
+import copy
+import decimal
+import random
+
+import pytest
+
+import pois_dynamodb
+
+
+def random_value(rng,depth=0):
+    choice = rng.randrange(0,10 if depth < 4 else 6)
+    if choice == 0:
+        return rng.choice(["","a","xyz"])
+    elif choice == 1:
+        return rng.randrange(-10 ** 12,10 ** 12)
+    elif choice == 2:
+        return rng.choice([True,False])
+    elif choice == 3:
+        return None
+    elif choice == 4:
+        return b"\x00\x01"
+    elif choice == 5:
+        return rng.random() * 1000
+    elif choice in (6,7):
+        return {"k%d" % (i):random_value(rng,depth + 1) for i in range(0,rng.randrange(0,5))}
+    return [random_value(rng,depth + 1) for i in range(0,rng.randrange(0,5))]
+
+
+def boto3_value(value):
+    # boto3's TypeSerializer takes Decimal numbers
+    if isinstance(value,float):
+        return decimal.Decimal(repr(value))
+    if isinstance(value,int) and not isinstance(value,bool):
+        return decimal.Decimal(value)
+    if isinstance(value,dict):
+        return {k:boto3_value(v) for k,v in value.items()}
+    if isinstance(value,list):
+        return [boto3_value(v) for v in value]
+    return value
+
+
+def binary_values(item):
+    # boto3 wraps B values in its Binary class
+    if isinstance(item,dict):
+        return {k:(bytes(v.value) if k == "B" and hasattr(v,"value") else binary_values(v)) for k,v in item.items()}
+    if isinstance(item,list):
+        return [binary_values(v) for v in item]
+    return item
+
+
+def test_round_trip():
+    rng = random.Random(1)
+    for i in range(0,1000):
+        value = {"x":random_value(rng)}
+        unchanged = copy.deepcopy(value)
+        item = pois_dynamodb.to_dynamodb_item(value)
+        assert value == unchanged
+        assert pois_dynamodb.from_dynamodb_item(item) == value
+
+
+def test_matches_boto3_serializer():
+    types = pytest.importorskip("boto3.dynamodb.types")
+    serializer = types.TypeSerializer()
+    rng = random.Random(2)
+    for i in range(0,500):
+        value = {"x":random_value(rng)}
+        item = pois_dynamodb.to_dynamodb_item(value)
+        # number strings can be formatted differently, the values are compared
+        expected = {k:serializer.serialize(boto3_value(v)) for k,v in value.items()}
+        assert pois_dynamodb.from_dynamodb_item(item) == pois_dynamodb.from_dynamodb_item(binary_values(expected))
+
+
+def test_sets_and_numbers():
+    assert pois_dynamodb.from_dynamodb_item({"s":{"SS":["a"]},"n":{"NS":["1","2.5"]},"f":{"N":"1e3"},"i":{"N":"52"}}) == {"s":["a"],"n":[1,2.5],"f":1000.0,"i":52}
+    with pytest.raises(ValueError):
+        pois_dynamodb.to_dynamodb_item({"x":float("nan")})
+
+
+def test_deeply_nested_values():
+    deep = []
+    current = deep
+    for i in range(0,5000):
+        current.append([])
+        current = current[0]
+    converted = pois_dynamodb.from_dynamodb(pois_dynamodb.to_dynamodb(deep))
+    depth = 0
+    while converted:
+        converted = converted[0]
+        depth += 1
+    assert depth == 5000
@@ -0,0 +1,137 @@
+import pytest
+
+import pois_storage
+
+TABLE = "POIS-state-test"
+
+
+@pytest.fixture(params=["memory","sqlite"])
+def local_storage(request,tmp_path):
+    if request.param == "memory":
+        return pois_storage.MemoryStorage()
+    return pois_storage.SQLiteStorage(str(tmp_path / "pois.db"))
+
+
+def channel_item(channel,**attributes):
+    item = {"channelid":{"S":channel},"default_behavior":{"S":"noop"},"config_blob":{"B":b"\x01\x00{}"}}
+    item.update(attributes)
+    return item
+
+
+def test_put_get_delete(local_storage):
+    assert local_storage.get_item(TABLE,"a") is None
+    local_storage.put_item(TABLE,channel_item("a"))
+    assert local_storage.get_item(TABLE,"a") == channel_item("a")
+    assert local_storage.get_item(TABLE,"a",["channelid","config_blob"]) == {"channelid":{"S":"a"},"config_blob":{"B":b"\x01\x00{}"}}
+    # tables are kept apart
+    assert local_storage.get_item("POIS-channels-test","a") is None
+    local_storage.delete_item(TABLE,"a")
+    assert local_storage.get_item(TABLE,"a") is None
+
+
+def test_returned_items_are_copies(local_storage):
+    local_storage.put_item(TABLE,channel_item("a"))
+    local_storage.get_item(TABLE,"a")['default_behavior']['S'] = "delete"
+    assert local_storage.get_item(TABLE,"a") == channel_item("a")
+
+
+def test_batch_put_and_get(local_storage):
+    local_storage.batch_put_items(TABLE,[channel_item("ch%03d" % (i)) for i in range(0,250)])
+    found_items = local_storage.batch_get_items({TABLE:["ch000","ch249","missing"],"POIS-channels-test":["ch000"]},{TABLE:["default_behavior"]})
+    assert found_items == {
+        TABLE:{"ch000":{"channelid":{"S":"ch000"},"default_behavior":{"S":"noop"}},"ch249":{"channelid":{"S":"ch249"},"default_behavior":{"S":"noop"}}},
+        "POIS-channels-test":dict()
+    }
+
+
+def test_scan_page(local_storage):
+    local_storage.batch_put_items(TABLE,[channel_item("ch%02d" % (i)) for i in range(0,23)])
+    channels = []
+    start_channel = None
+    while True:
+        items,start_channel = local_storage.scan_page(TABLE,["channelid"],5,start_channel)
+        assert len(items) <= 5
+        channels.extend(item['channelid']['S'] for item in items)
+        if start_channel is None:
+            break
+    assert channels == ["ch%02d" % (i) for i in range(0,23)]
+    assert sorted(item['channelid']['S'] for item in local_storage.scan_segments(TABLE,4)) == channels
+
+
+def test_sqlite_storage_is_persisted(tmp_path):
+    path = str(tmp_path / "pois.db")
+    pois_storage.SQLiteStorage(path).put_item(TABLE,channel_item("a"))
+    assert pois_storage.SQLiteStorage(path).get_item(TABLE,"a") == channel_item("a")
+
+
+def test_lock_expired():
+    assert pois_storage.lock_expired(None,100)
+    assert pois_storage.lock_expired({"channelid":{"S":"a"}},100)
+    assert pois_storage.lock_expired({"channelid":{"S":"a"},"signal_expiry_time":{"S":"200"}},100)
+    assert pois_storage.lock_expired({"channelid":{"S":"a"},"expires_at":{"S":"200"}},100)
+    assert pois_storage.lock_expired(pois_storage.lock_item("a",100),100)
+    assert not pois_storage.lock_expired(pois_storage.lock_item("a",200),100)
+
+
+def test_local_acquire_lock(local_storage):
+    assert local_storage.acquire_lock(TABLE,"a",200,100) == (True,pois_storage.lock_item("a",200))
+    assert local_storage.acquire_lock(TABLE,"a",300,150) == (False,pois_storage.lock_item("a",200))
+    assert local_storage.acquire_lock(TABLE,"a",300,200) == (True,pois_storage.lock_item("a",300))
+
+
+def test_local_acquire_lock_without_expires_at(local_storage):
+    # state items written before expires_at existed only have signal_expiry_time
+    local_storage.put_item(TABLE,{"channelid":{"S":"a"},"signal_expiry_time":{"S":"500"}})
+    assert local_storage.acquire_lock(TABLE,"a",200,100) == (True,pois_storage.lock_item("a",200))
+
+
+class OldBotocoreClient(object):
+    # A DynamoDB client whose botocore doesn't know ReturnValuesOnConditionCheckFailure
+    def __init__(self,db_client):
+        self.db_client = db_client
+        self.exceptions = db_client.exceptions
+
+    def update_item(self,**kwargs):
+        import botocore.exceptions
+        if "ReturnValuesOnConditionCheckFailure" in kwargs:
+            raise botocore.exceptions.ParamValidationError(report='Unknown parameter in input: "ReturnValuesOnConditionCheckFailure"')
+        return self.db_client.update_item(**kwargs)
+
+    def get_item(self,**kwargs):
+        return self.db_client.get_item(**kwargs)
+
+
+@pytest.fixture
+def stubbed_client():
+    boto3 = pytest.importorskip("boto3")
+    from botocore.stub import ANY,Stubber
+    db_client = boto3.client("dynamodb",region_name="us-east-1",aws_access_key_id="test",aws_secret_access_key="test")
+    with Stubber(db_client) as stubber:
+        yield db_client,stubber,ANY
+        stubber.assert_no_pending_responses()
+
+
+def test_dynamodb_acquire_lock_condition(stubbed_client):
+    db_client,stubber,ANY = stubbed_client
+    stubber.add_response("update_item",{"Attributes":pois_storage.lock_item("a",200)},{
+        "TableName":TABLE,"Key":{"channelid":{"S":"a"}},"UpdateExpression":ANY,
+        "ConditionExpression":"attribute_not_exists(expires_at) OR NOT attribute_type(expires_at, :number_type) OR expires_at <= :time_now",
+        "ExpressionAttributeValues":ANY,"ReturnValues":"ALL_NEW","ReturnValuesOnConditionCheckFailure":"ALL_OLD"})
+    assert pois_storage.DynamoDBStorage(db_client).acquire_lock(TABLE,"a",200,100) == (True,pois_storage.lock_item("a",200))
+
+
+def test_dynamodb_acquire_lock_held(stubbed_client):
+    db_client,stubber,ANY = stubbed_client
+    stubber.add_client_error("update_item","ConditionalCheckFailedException",modeled_fields={"Item":pois_storage.lock_item("a",200)})
+    assert pois_storage.DynamoDBStorage(db_client).acquire_lock(TABLE,"a",300,100) == (False,pois_storage.lock_item("a",200))
+
+
+def test_dynamodb_acquire_lock_old_botocore(stubbed_client):
+    db_client,stubber,ANY = stubbed_client
+    storage = pois_storage.DynamoDBStorage(OldBotocoreClient(db_client))
+    # the parameter is left out, and the current item read with a GetItem, from the first rejection on
+    for attempt in range(0,2):
+        stubber.add_client_error("update_item","ConditionalCheckFailedException")
+        stubber.add_response("get_item",{"Item":pois_storage.lock_item("a",200)},{"TableName":TABLE,"Key":{"channelid":{"S":"a"}}})
+        assert storage.acquire_lock(TABLE,"a",300,100) == (False,pois_storage.lock_item("a",200))
+    assert not storage.return_old_on_condition_failure
@@ -0,0 +1,73 @@
+import logging
+import random
+
+import threefive
+
+import pois_config
+
+PROPERTIES = ['segmentation_type_id','splice_command_type','segmentation_duration','segmentation_upid','pts_time',
+    'segmentation_upid_type','out_of_network_indicator','missing_property','break_duration']
+OPERATORS = ['=','!=','>','<','-','>=']
+VALUES = ['0','5','6','48','52','30','300','9','true','abc','12.5','','x']
+
+
+def linear_match(esam_processor,compiled_rules,scte_35_index):
+    # the rule evaluation before RuleIndex, every rule in order
+    for rule in compiled_rules:
+        if rule.evaluate(scte_35_index.get(rule.property,esam_processor.SCTE_PROPERTY_MISSING)):
+            return rule.index
+    return None
+
+
+def random_condition_value(rng,operator):
+    if operator == "-":
+        return ",".join("%d-%d" % tuple(sorted(rng.sample(range(0,400),2))) for i in range(0,rng.randint(1,3)))
+    return ",".join(rng.choice(VALUES) for i in range(0,rng.randint(1,3)))
+
+
+def random_rules(rng):
+    rules = []
+    for r in range(0,rng.randint(1,40)):
+        operator = rng.choice(OPERATORS)
+        rules.append({"type":rng.choice(["delete","replace"]),"condition":{"property":rng.choice(PROPERTIES),"operator":operator,"value":random_condition_value(rng,operator)}})
+    return rules
+
+
+def scte_35_indexes(esam_processor,corpus):
+    indexes = []
+    for entry in corpus.generate_corpus(seed=5,per_class=2,max_descriptors=3):
+        if entry['valid']:
+            scte_35_cue = threefive.Cue(entry['cue'])
+            scte_35_cue.decode()
+            indexes.append(esam_processor.scte_property_index(esam_processor.scte35_freeze(scte_35_cue.get())))
+    # values the decoded cues don't have: mixed types, unhashable upids, empty strings
+    indexes.append({'segmentation_type_id':(48,52),'segmentation_duration':(30.0,''),'segmentation_upid':(esam_processor.scte35_freeze({'a':1}),'abc'),'splice_command_type':(6,)})
+    indexes.append({'segmentation_duration':('',),'segmentation_upid':('',)})
+    indexes.append(dict())
+    return indexes
+
+
+def test_rule_index_matches_linear_evaluation(esam_processor,corpus):
+    rng = random.Random(3)
+    indexes = scte_35_indexes(esam_processor,corpus)
+    logging.disable(logging.WARNING)
+    try:
+        for trial in range(0,300):
+            compiled_rules = esam_processor.compile_rules(pois_config.normalize_rules({"rules":random_rules(rng)}))
+            rule_index = esam_processor.RuleIndex(compiled_rules)
+            for scte_35_index in indexes:
+                assert rule_index.match(scte_35_index) == linear_match(esam_processor,compiled_rules,scte_35_index)
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def test_first_matching_rule_wins(esam_processor):
+    rules = [
+        {"type":"delete","condition":{"property":"segmentation_type_id","operator":">","value":"50"}},
+        {"type":"replace","condition":{"property":"segmentation_type_id","operator":"=","value":"52"}},
+        {"type":"noop","condition":{"property":"splice_command_type","operator":"=","value":"6"}}
+    ]
+    rule_index = esam_processor.RuleIndex(esam_processor.compile_rules(pois_config.normalize_rules({"rules":rules})))
+    assert rule_index.match({'segmentation_type_id':(52,),'splice_command_type':(6,)}) == 0
+    assert rule_index.match({'segmentation_type_id':(48,),'splice_command_type':(6,)}) == 2
+    assert rule_index.match({'segmentation_type_id':(48,),'splice_command_type':(5,)}) is None
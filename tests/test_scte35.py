@@ -0,0 +1,95 @@
+import base64
+import random
+
+import pytest
+import threefive
+
+import pois_scte35
+
+SEGMENTATION_TYPE_IDS = [0x10,0x22,0x30,0x34,0x35,0x36,0x40,0x44,0x46]
+
+
+def threefive_time_signal(fields):
+    # The time_signal esam-processor.py built with threefive before pois_scte35, for the same fields
+    cue = threefive.Cue()
+    command = threefive.TimeSignal()
+    command.time_specified_flag = fields.pts_time_ticks is not None
+    if fields.pts_time_ticks is not None:
+        command.pts_time_ticks = fields.pts_time_ticks
+        command.pts_time = fields.pts_time_ticks / 90000.0
+    cue.command = command
+    cue.info_section.pts_adjustment_ticks = fields.pts_adjustment_ticks
+
+    descriptor = threefive.SegmentationDescriptor(None)
+    descriptor.tag = 2
+    descriptor.identifier = "CUEI"
+    descriptor.components = []
+    descriptor.segmentation_event_id = hex(fields.segmentation_event_id)
+    descriptor.segmentation_event_cancel_indicator = False
+    descriptor.segmentation_event_id_compliance_indicator = True
+    descriptor.program_segmentation_flag = True
+    descriptor.segmentation_duration_flag = fields.segmentation_duration_ticks is not None
+    descriptor.segmentation_duration_ticks = fields.segmentation_duration_ticks
+    descriptor.delivery_not_restricted_flag = False
+    descriptor.web_delivery_allowed_flag = False
+    descriptor.no_regional_blackout_flag = False
+    descriptor.archive_allowed_flag = True
+    descriptor.device_restrictions = "No Restrictions"
+    descriptor.segmentation_upid_type = fields.segmentation_upid_type
+    descriptor.segmentation_upid_length = len(fields.segmentation_upid)
+    descriptor.segmentation_upid = fields.segmentation_upid.decode()
+    descriptor.segmentation_type_id = fields.segmentation_type_id
+    descriptor.segment_num = fields.segment_num
+    descriptor.segments_expected = fields.segments_expected
+    descriptor.sub_segment_num = fields.sub_segment_num
+    descriptor.sub_segments_expected = fields.sub_segments_expected
+    cue.descriptors.append(descriptor)
+    return cue.encode()
+
+
+def random_fields(rng):
+    return pois_scte35.TimeSignalFields(
+        pts_time_ticks=rng.choice([None,rng.randrange(1,2 ** 33)]),
+        pts_adjustment_ticks=rng.choice([0,rng.randrange(0,2 ** 33)]),
+        segmentation_event_id=rng.randrange(0,2 ** 32),
+        segmentation_duration_ticks=rng.choice([None,rng.randrange(1,2 ** 40)]),
+        segmentation_type_id=rng.choice(SEGMENTATION_TYPE_IDS),
+        segmentation_upid_type=9,
+        segmentation_upid=rng.choice([b"",b"SIGNAL:abc",b"x" * 30]),
+        segment_num=rng.randrange(0,256),
+        segments_expected=rng.randrange(0,256),
+        sub_segment_num=rng.randrange(1,256),
+        sub_segments_expected=rng.randrange(0,256))
+
+
+def test_encoder_matches_threefive():
+    rng = random.Random(7)
+    for i in range(0,500):
+        fields = random_fields(rng)
+        assert pois_scte35.encode_time_signal(fields) == threefive_time_signal(fields), vars(fields)
+
+
+def test_crc32_mpeg():
+    cue = base64.b64decode(pois_scte35.encode_time_signal(random_fields(random.Random(1))))
+    assert pois_scte35.crc32_mpeg(cue[:-4]) == int.from_bytes(cue[-4:],"big")
+    assert pois_scte35.crc32_mpeg(cue) == 0
+
+
+def test_header_index_matches_full_decode(esam_processor,corpus):
+    # every header property the full decode gives is read the same from the first 14 bytes
+    for entry in corpus.generate_corpus(seed=3,per_class=5):
+        if not entry['valid']:
+            continue
+        header_index = esam_processor.scte35_header_index(entry['cue'])
+        scte_35_cue = threefive.Cue(entry['cue'])
+        scte_35_cue.decode()
+        full_index = esam_processor.scte_property_index(scte_35_cue.get())
+        assert header_index is not None, entry
+        for property_key in esam_processor.SCTE35_HEADER_PROPERTIES:
+            if property_key in full_index:
+                assert header_index[property_key] == full_index[property_key][:1], (entry,property_key)
+
+
+@pytest.mark.parametrize("cue",["", "not base64!", "ZmFrZQ==", "fc302500", base64.b64encode(b"\xfc\x30\x25" + b"\x00" * 11).decode("ascii")])
+def test_header_index_leaves_other_cues_to_the_full_decode(esam_processor,cue):
+    assert esam_processor.scte35_header_index(cue) is None